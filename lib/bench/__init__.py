@@ -0,0 +1,9 @@
+# The scripts here import their siblings as top-level modules (`from common
+# import ...`), which works when they are run by path. Put this directory on
+# sys.path too so `python -m bench.<script>` from lib/ works the same way.
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCH_DIR not in sys.path:
+    sys.path.insert(0, BENCH_DIR)
@@ -0,0 +1,211 @@
+# commands.py
+# Times every CLI command against seeded synthetic datasets (db/seed.py), both
+# in-process through click's CliRunner (warm: connections and imports reused)
+# and as `python lib/cli.py ...` subprocesses (cold: what a user waits for).
+#
+#   python lib/bench/commands.py --sizes 1k,100k --output results.json
+#   python lib/bench/commands.py --sizes 1k,100k --baseline baseline.json
+#
+# With --baseline, exits with status 1 when any command's median is more than
+# --tolerance slower than the stored run (and slower by at least
+# --min-delta-ms, so sub-millisecond noise can't fail the check).
+import argparse
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import LIB_DIR, make_workspace
+
+from click.testing import CliRunner
+
+import cli
+from db import storage
+from db.seed import parse_size, seed
+
+COLLECTIONS = 50
+FANOUT = 2
+
+# name -> argv; {spark} is a fresh existing spark id per run, {doomed} one that is deleted
+COMMANDS = {
+    "add": ["add", "benchmark idea"],
+    "add --collection": ["add", "--collection", "collection-2", "benchmark idea"],
+    "list": ["list"],
+    "list --limit 50": ["list", "--limit", "50"],
+    "list --collection": ["list", "--collection", "collection-1"],
+    "search": ["search", "latency"],
+    "search prefix": ["search", "bench*"],
+    "collections": ["collections"],
+    "collections add": ["collections", "add", "collection-3", "{spark}"],
+    "show": ["show", "{spark}"],
+    "edit": ["edit", "{spark}", "edited benchmark idea"],
+    "delete": ["delete", "{doomed}"],
+}
+
+class SparkIds:
+    """Hands out distinct seeded ids: ascending for reads/updates, descending for deletes."""
+
+    def __init__(self, sparks):
+        self.spark = itertools.count(1)
+        self.doomed = itertools.count(sparks, -1)
+
+    def fill(self, argv):
+        return [
+            arg.format(spark=next(self.spark)) if arg == "{spark}"
+            else arg.format(doomed=next(self.doomed)) if arg == "{doomed}"
+            else arg
+            for arg in argv
+        ]
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "median_ms": statistics.median(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+def check(name, output, exit_code):
+    if "✗" in output or exit_code != 0:
+        raise RuntimeError(f"{name} failed: {output.strip()[-500:]}")
+
+def time_runner(db_path, ids, commands, repeat):
+    cli._database_url = f"sqlite:///{db_path}"
+    cli._engine = None
+    cli._Session = None
+    runner = CliRunner()
+    results = {}
+    for name in commands:
+        samples = []
+        for _ in range(repeat):
+            argv = ids.fill(COMMANDS[name])
+            started = time.perf_counter()
+            result = runner.invoke(cli.cli, argv)
+            samples.append(time.perf_counter() - started)
+            check(name, result.output, result.exit_code)
+        results[name] = summarize(samples)
+    if cli._engine is not None:
+        cli._engine.dispose()
+    return results
+
+def time_subprocess(root, db_path, ids, commands, repeat):
+    env = dict(
+        os.environ,
+        SPARK_DATABASE_URL=f"sqlite:///{db_path}",
+        SPARK_CACHE_DIR=os.path.join(root, ".cache"),
+        SPARK_NO_DAEMON="1",
+    )
+    script = os.path.join(LIB_DIR, "cli.py")
+    results = {}
+    for name in commands:
+        samples = []
+        for _ in range(repeat):
+            argv = ids.fill(COMMANDS[name])
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, script, *argv], cwd=root, env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+            )
+            samples.append(time.perf_counter() - started)
+            check(name, result.stdout, result.returncode)
+        results[name] = summarize(samples)
+    return results
+
+def run_size(size, modes, commands, repeat, random_seed):
+    sparks = parse_size(size)
+    with tempfile.TemporaryDirectory() as root:
+        root = os.path.realpath(root)
+        db_path = make_workspace(root)
+        engine = storage.create_engine(f"sqlite:///{db_path}")
+        started = time.perf_counter()
+        seed(engine, sparks, contexts=1, collections=COLLECTIONS, fanout=FANOUT, seed=random_seed, working_directory=root)
+        seed_s = time.perf_counter() - started
+        engine.dispose()
+
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            ids = SparkIds(sparks)
+            results = {"sparks": sparks, "seed_s": seed_s}
+            if "runner" in modes:
+                results["runner"] = time_runner(db_path, ids, commands, repeat)
+            if "subprocess" in modes:
+                results["subprocess"] = time_subprocess(root, db_path, ids, commands, repeat)
+        finally:
+            os.chdir(cwd)
+    return results
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Return (size, mode, command, baseline_ms, current_ms) for every regression."""
+    regressions = []
+    for size, by_mode in results["sizes"].items():
+        for mode in ("runner", "subprocess"):
+            for name, current in by_mode.get(mode, {}).items():
+                previous = baseline["sizes"].get(size, {}).get(mode, {}).get(name)
+                if previous is None:
+                    continue
+                before, after = previous["median_ms"], current["median_ms"]
+                if after > before * (1 + tolerance) and after - before >= min_delta_ms:
+                    regressions.append((size, mode, name, before, after))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every CLI command on synthetic datasets")
+    parser.add_argument("--sizes", default="1k,100k", help="comma separated: 1k, 10k, 100k, 1m or a number")
+    parser.add_argument("--modes", default="runner,subprocess", help="runner, subprocess or both")
+    parser.add_argument("--commands", help="comma separated subset of: " + ", ".join(COMMANDS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="compare against a previous --output file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    modes = args.modes.split(",")
+    commands = args.commands.split(",") if args.commands else list(COMMANDS)
+    unknown = set(commands) - set(COMMANDS)
+    if unknown:
+        parser.error(f"unknown commands: {', '.join(sorted(unknown))}")
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "sizes": {},
+    }
+    for size in args.sizes.split(","):
+        results["sizes"][size] = by_mode = run_size(size, modes, commands, args.repeat, args.seed)
+        print(f"\n{size} ({by_mode['sparks']} sparks, seeded in {by_mode['seed_s']:.1f}s)")
+        print(f"{'command':20} {'mode':>10} {'median ms':>10} {'min ms':>10}")
+        for mode in modes:
+            for name, timing in by_mode[mode].items():
+                print(f"{name:20} {mode:>10} {timing['median_ms']:10.2f} {timing['min_ms']:10.2f}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance, args.min_delta_ms)
+        for size, mode, name, before, after in regressions:
+            print(f"REGRESSION {size} {mode} {name}: {before:.2f}ms -> {after:.2f}ms")
+        if regressions:
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
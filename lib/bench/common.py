@@ -0,0 +1,34 @@
+# common.py
+# Shared setup for the scripts in lib/bench: scratch databases migrated with
+# the real Alembic history and a .spark file to run commands against.
+import os
+import sys
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_DIR = os.path.join(LIB_DIR, "db")
+
+for path in (LIB_DIR, DB_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+def migrate(database_url, revision="head"):
+    """Bring the database at `database_url` up to `revision` with Alembic."""
+    from alembic import command
+    from alembic.config import Config
+
+    # No ini file: keeps env.py from reconfiguring logging for every run
+    config = Config()
+    config.set_main_option("script_location", os.path.join(DB_DIR, "migrations"))
+    config.attributes["database_url"] = database_url
+    command.upgrade(config, revision)
+
+def make_workspace(root, project_name="bench", default_collection="general"):
+    """Create a project directory with a .spark file and a migrated database in `root`."""
+    import yaml
+
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".spark"), "w") as spark_file:
+        yaml.dump({"project_name": project_name, "default_collection": default_collection}, spark_file)
+    db_path = os.path.join(root, "spark_store.db")
+    migrate(f"sqlite:///{db_path}")
+    return db_path
@@ -0,0 +1,123 @@
+# completion.py
+# Latency of completion lookups (db.complete) on a seeded store: id
+# prefixes, substrings, scattered-character (fuzzy) matches and queries
+# that match nothing, next to the LIKE queries they replace; then the cost
+# of bringing the index up to date after an add, an edit, a delete and a
+# bulk add.
+#
+#   python lib/bench/completion.py --sparks 100k
+#   python lib/bench/completion.py --sparks 1m --lookups 500
+#
+# Ends by churning the store (adds, edits, deletes, collection changes),
+# refreshing the index and comparing it with one built from scratch; exits
+# with status 1 if they differ.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from common import make_workspace
+
+from db.seed import parse_size
+
+TERMS = ("cache", "index", "token", "query", "retry", "auth")
+FUZZY = ("cchtok", "idxq", "rtry", "athses")
+
+def timings(fn, queries):
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(0.99 * (len(samples) - 1))] * 1000
+
+def report(label, fn, queries):
+    p50, p99 = timings(fn, queries)
+    print(f"{label:<28} p50={p50:8.3f}ms  p99={p99:8.3f}ms")
+
+def timed(label, fn):
+    started = time.perf_counter()
+    fn()
+    print(f"{label:<28} {(time.perf_counter() - started) * 1000:10.1f}ms")
+
+def live_entries(conn, database):
+    from db import complete
+    with complete.opened(conn, database) as index:
+        return [index.entry(position) for position in range(index.count) if not index.deleted(position)]
+
+def churn(conn, context_id, rng, operations):
+    from db import lite
+    last = conn.execute("SELECT MAX(id) FROM sparks").fetchone()[0]
+    for _ in range(operations):
+        choice = rng.random()
+        spark_id = rng.randint(1, last)
+        if choice < 0.4:
+            lite.add_spark(conn, f"churned idea {rng.random()}", context_id, rng.choice(("bugs", "perf", "ideas")))
+        elif choice < 0.6:
+            conn.execute("UPDATE sparks SET content = ? WHERE id = ?", (f"edited idea {rng.random()}", spark_id))
+        elif choice < 0.8:
+            conn.execute("DELETE FROM spark_collections WHERE spark_id = ?", (spark_id,))
+            conn.execute("DELETE FROM sparks WHERE id = ?", (spark_id,))
+        else:
+            collection_id = lite.get_or_create_collection_id(conn, rng.choice(("bugs", "perf", "archive")))
+            conn.execute(
+                "INSERT OR IGNORE INTO spark_collections (spark_id, collection_id) VALUES (?, ?)", (spark_id, collection_id)
+            )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="completion index benchmark")
+    parser.add_argument("--sparks", default="100k", help="seeded sparks, e.g. 100k or 1m")
+    parser.add_argument("--lookups", type=int, default=200, help="lookups per query kind")
+    parser.add_argument("--churn", type=int, default=2000, help="random changes before the consistency check")
+    args = parser.parse_args(argv)
+
+    from db import complete, lite, storage
+    from db.seed import seed
+
+    sparks = parse_size(args.sparks)
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as root:
+        os.environ["SPARK_CACHE_DIR"] = os.path.join(root, "cache")
+        database = make_workspace(root)
+        engine = storage.create_engine(f"sqlite:///{database}")
+        seed(engine, sparks, working_directory=root)
+        engine.dispose()
+        conn = lite.connect(database)
+        context_id = conn.execute("SELECT id FROM contexts LIMIT 1").fetchone()[0]
+
+        timed("build index", lambda: complete.sparks(conn, database, "1", 1))
+        prefixes = [str(rng.randint(1, sparks))[:rng.randint(1, 3)] for _ in range(args.lookups)]
+        report("id prefix", lambda query: complete.sparks(conn, database, query), prefixes)
+        report("substring", lambda query: complete.sparks(conn, database, query), [rng.choice(TERMS) for _ in range(args.lookups)])
+        report("fuzzy", lambda query: complete.sparks(conn, database, query), [rng.choice(FUZZY) for _ in range(args.lookups)])
+        report("no match (full scan)", lambda query: complete.sparks(conn, database, query), ["zzqx"] * (args.lookups // 10 or 1))
+        report("collections", lambda query: complete.collections(conn, database, query), ["b", "", "pe"] * (args.lookups // 3))
+        like = (
+            "SELECT id, content FROM sparks WHERE CAST(id AS TEXT) LIKE ? || '%' ORDER BY id DESC LIMIT 50",
+            "SELECT id, content FROM sparks WHERE content LIKE '%' || ? || '%' ORDER BY id DESC LIMIT 50",
+        )
+        report("LIKE id prefix (before)", lambda query: conn.execute(like[0], (query,)).fetchall(), prefixes[:args.lookups // 10 or 1])
+        report("LIKE substring (before)", lambda query: conn.execute(like[1], (query,)).fetchall(), ["zzqx"] * (args.lookups // 10 or 1))
+
+        timed("refresh after add", lambda: (lite.add_spark(conn, "one more idea", context_id, "bugs"), complete.sparks(conn, database, "1", 1)))
+        timed("refresh after edit", lambda: (conn.execute("UPDATE sparks SET content = 'reworded' WHERE id = 7"), complete.sparks(conn, database, "1", 1)))
+        timed("refresh after delete", lambda: (conn.execute("DELETE FROM sparks WHERE id = 9"), complete.sparks(conn, database, "1", 1)))
+        records = [(f"bulk idea {i}", None) for i in range(1000)]
+        timed("refresh after 1k adds", lambda: (list(lite.bulk_add_sparks(conn, records, context_id, "bulk")), complete.sparks(conn, database, "1", 1)))
+
+        churn(conn, context_id, rng, args.churn)
+        refreshed = live_entries(conn, database)
+        os.remove(complete.index_path(database))
+        rebuilt = live_entries(conn, database)
+        if refreshed != rebuilt:
+            differing = sum(1 for first, second in zip(refreshed, rebuilt) if first != second)
+            print(f"✗ refreshed index differs from a rebuild ({len(refreshed)} vs {len(rebuilt)} sparks, {differing} differ)")
+            return 1
+        print(f"✓ refreshed index matches a rebuild after {args.churn} changes ({len(rebuilt):,} sparks)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
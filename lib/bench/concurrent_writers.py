@@ -0,0 +1,123 @@
+# concurrent_writers.py
+# Stress test: spawns N writer processes that each add sparks through the ORM
+# path and reports throughput, p50/p99 commit latency and "database is
+# locked" errors per backend and SQLite PRAGMA profile.
+#
+#   python lib/bench/concurrent_writers.py --writers 8 --sparks 200
+#   python lib/bench/concurrent_writers.py --sqlite-profiles tuned,default
+#   python lib/bench/concurrent_writers.py --postgres-url postgresql+psycopg://localhost/spark_bench
+#
+# Each SQLite profile (see db.storage.SQLITE_PROFILES) gets a fresh scratch
+# database; PostgreSQL runs only when a URL is given (or
+# SPARK_BENCH_POSTGRES_URL is set), e.g. a throwaway local server standing in
+# for the shared team database. Exits non-zero if any run hit lock errors
+# and --fail-on-errors is set.
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from common import migrate
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def writer(url, pragmas, context_id, writer_id, sparks):
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import sessionmaker
+    from db import storage
+    from helpers import create_spark_in_collection
+
+    engine = storage.create_engine(url, pragmas=pragmas)
+    session = sessionmaker(bind=engine)()
+    latencies = []
+    errors = 0
+    for i in range(sparks):
+        started = time.perf_counter()
+        try:
+            create_spark_in_collection(session, f"writer {writer_id} idea {i}", context_id, f"writer-{writer_id % 4}")
+            latencies.append(time.perf_counter() - started)
+        except OperationalError as e:
+            if "locked" not in str(e) and "deadlock" not in str(e):
+                raise
+            errors += 1
+    session.close()
+    engine.dispose()
+    return latencies, errors
+
+def prepare(url, pragmas):
+    from sqlalchemy.orm import sessionmaker
+    from db import storage
+    from helpers import create_context
+
+    migrate(url)
+    engine = storage.create_engine(url, pragmas=pragmas)
+    session = sessionmaker(bind=engine)()
+    context_id = create_context(session, f"/bench/{os.getpid()}/{time.time()}", "bench").id
+    session.close()
+    engine.dispose()
+    return context_id
+
+def run(label, url, writers, sparks, pragmas=None):
+    context_id = prepare(url, pragmas)
+    started = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(writers) as pool:
+        results = pool.starmap(writer, [(url, pragmas, context_id, w, sparks) for w in range(writers)])
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for result, _ in results for latency in result]
+    errors = sum(errors for _, errors in results)
+    return {
+        "backend": label,
+        "writers": writers,
+        "commits": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "commits_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def report(result):
+    print(
+        f"{result['backend']:<16} writers={result['writers']:<3} commits={result['commits']:<6} "
+        f"errors={result['errors']:<4} {result['commits_per_sec']:8.1f} commits/s  "
+        f"p50={result['p50_ms']:6.2f}ms  p99={result['p99_ms']:7.2f}ms"
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent writer benchmark")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--sparks", type=int, default=200, help="sparks added by each writer")
+    parser.add_argument("--sqlite-profiles", default="tuned,default", help="comma separated PRAGMA profiles")
+    parser.add_argument("--postgres-url", default=os.environ.get("SPARK_BENCH_POSTGRES_URL"))
+    parser.add_argument("--fail-on-errors", action="store_true", help="exit 1 if any writer hit a lock error")
+    args = parser.parse_args(argv)
+
+    from db import storage
+
+    results = []
+    for profile in filter(None, args.sqlite_profiles.split(",")):
+        with tempfile.TemporaryDirectory() as root:
+            url = f"sqlite:///{os.path.join(root, 'spark_store.db')}"
+            results.append(run(f"sqlite-{profile}", url, args.writers, args.sparks, storage.sqlite_pragmas(profile)))
+            report(results[-1])
+
+    if args.postgres_url:
+        results.append(run("postgresql", args.postgres_url, args.writers, args.sparks))
+        report(results[-1])
+    else:
+        print("postgresql       skipped (pass --postgres-url or set SPARK_BENCH_POSTGRES_URL)")
+
+    if args.fail_on_errors and any(result["errors"] for result in results):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# import_budget.py
+# Fails (exit status 1) when importing the CLI gets slower than the budget or
+# pulls in modules that are supposed to be loaded lazily.
+#
+#   python lib/bench/import_budget.py --budget-ms 80
+import argparse
+import os
+import subprocess
+import sys
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must never be imported just to start the CLI
+LAZY_MODULES = ("sqlalchemy", "yaml", "helpers", "db.models")
+
+def measure_import(module="cli"):
+    """Return {module: cumulative_us} from `python -X importtime -c 'import <module>'`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=LIB_DIR, capture_output=True, text=True, check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        timings[name.strip()] = int(cumulative.strip())
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the CLI import-time budget")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("SPARK_IMPORT_BUDGET_MS", 80)))
+    parser.add_argument("--runs", type=int, default=5, help="best-of-N runs to smooth out noise")
+    args = parser.parse_args(argv)
+
+    best = None
+    for _ in range(args.runs):
+        timings = measure_import()
+        if best is None or timings["cli"] < best["cli"]:
+            best = timings
+
+    total_ms = best["cli"] / 1000
+    leaked = [name for name in best if name in LAZY_MODULES]
+    slowest = sorted(((us, name) for name, us in best.items() if "." not in name), reverse=True)[:5]
+
+    print(f"import cli: {total_ms:.1f} ms (budget {args.budget_ms:.1f} ms)")
+    for us, name in slowest:
+        print(f"  {us / 1000:7.1f} ms  {name}")
+
+    failed = False
+    if leaked:
+        print(f"FAIL: eagerly imported {', '.join(leaked)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
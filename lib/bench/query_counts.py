@@ -0,0 +1,98 @@
+# query_counts.py
+# Runs every CLI command against a small and a larger dataset and fails
+# (exit status 1) if the number of SQL statements a command issues grows
+# with the data, i.e. when an N+1 query pattern sneaks back in.
+#
+#   python lib/bench/query_counts.py
+import os
+import sys
+import tempfile
+
+from common import make_workspace
+
+from click.testing import CliRunner
+
+import cli
+from db import lite
+from db.instrument import QueryCounter
+
+COMMANDS = [
+    ["add", "a brand new idea"],
+    ["add", "--collection", "bugs", "a brand new bug"],
+    ["list"],
+    ["list", "--collection", "bugs"],
+    ["list", "--week", "--since", "yesterday"],
+    ["search", "idea"],
+    ["collections"],
+    ["stats"],
+    ["collections", "add", "bugs", "1"],
+    ["show", "1"],
+    ["edit", "1", "reworded idea"],
+    ["edit", "1", "reworded idea, again"],
+    ["history", "1"],
+    ["revert", "1", "1"],
+    ["delete", "2"],
+    ["delete", "3-5", "--in", "bugs"],
+    ["undo"],
+    ["delete", "4"],
+    ["gc"],
+]
+
+def seed(root, sparks, collections):
+    runner = CliRunner()
+    lines = "\n".join(
+        f'{{"content": "idea {i}", "collection": "collection-{i % collections}"}}' for i in range(sparks)
+    )
+    result = runner.invoke(cli.cli, ["add", "--stdin"], input=lines)
+    assert "✓" in result.output, result.output
+
+def count_statements(db_path, sparks, collections):
+    counter = QueryCounter()
+    cli._database_url = f"sqlite:///{db_path}"
+    cli._engine = None
+    cli._Session = None
+
+    def connect():
+        return lite.connect(db_path, factory=counter.connection_factory)
+
+    cli.get_connection = connect
+    seed(os.getcwd(), sparks, collections)
+    counter.attach_engine(cli.get_engine())
+
+    runner = CliRunner()
+    counts = {}
+    for args in COMMANDS:
+        before = counter.count
+        result = runner.invoke(cli.cli, args)
+        if "✗" in result.output or result.exit_code != 0:
+            raise RuntimeError(f"{' '.join(args)} failed: {result.output}")
+        counts[" ".join(args)] = counter.count - before
+    counter.detach()
+    cli._engine.dispose()
+    return counts
+
+def run(sizes=((20, 2), (2000, 50))):
+    results = []
+    for sparks, collections in sizes:
+        with tempfile.TemporaryDirectory() as root:
+            db_path = make_workspace(root)
+            cwd = os.getcwd()
+            os.chdir(root)
+            try:
+                results.append(count_statements(db_path, sparks, collections))
+            finally:
+                os.chdir(cwd)
+    return results
+
+def main():
+    small, large = run()
+    failed = False
+    print(f"{'command':40} {'small':>6} {'large':>6}")
+    for command, count in small.items():
+        marker = "" if large[command] == count else "  <-- grows with data"
+        failed = failed or bool(marker)
+        print(f"{command:40} {count:6} {large[command]:6}{marker}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# query_plans.py
+# Runs every CLI command and SparkStore operation against a seeded database,
+# asks SQLite for the plan of each distinct statement they issue (EXPLAIN
+# QUERY PLAN) and fails (exit status 1) if any of them scans sparks,
+# spark_collections or contexts in full instead of seeking an index.
+#
+#   python lib/bench/query_plans.py
+#   python lib/bench/query_plans.py --verbose   # print every plan
+#
+# Maintenance statements that have to read every row are listed in
+# ALLOWED_SCANS with the reason.
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+from common import make_workspace
+
+GUARDED_TABLES = ("sparks", "spark_collections", "contexts")
+# `SCAN sparks` is a full table scan; `SCAN sparks USING INDEX ...` walks an
+# index in order and still stops at the LIMIT, so only the former fails
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+PLANNED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+# Statement prefixes allowed to scan, and why
+ALLOWED_SCANS = {
+    "DELETE FROM spark_collections WHERE (spark_collections.spark_id, spark_collections.collection_id) IN":
+        "gc's orphan sweep (helpers.purge_orphan_memberships) has to check every membership",
+}
+
+def statement_recorder(statements):
+    """(sqlite3.Connection subclass, SQLAlchemy listener) that record each (sql, parameters) once."""
+    def record(sql, parameters):
+        if sql.lstrip().upper().startswith(PLANNED):
+            statements.setdefault(" ".join(sql.split()), parameters)
+
+    class RecordingConnection(sqlite3.Connection):
+        def execute(self, sql, parameters=()):
+            record(sql, parameters)
+            return super().execute(sql, parameters)
+
+        def executemany(self, sql, parameters):
+            parameters = list(parameters)
+            if parameters:
+                record(sql, parameters[0])
+            return super().executemany(sql, parameters)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # insertmanyvalues batches arrive flattened into one parameter tuple
+        if executemany and parameters and isinstance(parameters[0], (list, tuple, dict)):
+            parameters = parameters[0]
+        record(statement, parameters)
+
+    return RecordingConnection, before_cursor_execute
+
+def run_commands(root, db_path, listener, factory):
+    from click.testing import CliRunner
+    from sqlalchemy import event
+
+    import cli
+    from db import lite
+    from query_counts import COMMANDS, seed
+
+    cli._database_url = f"sqlite:///{db_path}"
+    cli._engine = None
+    cli._Session = None
+    cli.get_connection = lambda: lite.connect(db_path, factory=factory)
+    event.listen(cli.get_engine(), "before_cursor_execute", listener)
+    seed(root, 500, 10)
+    runner = CliRunner()
+    for args in COMMANDS + [["list", "created:7d AND collection:bugs"], ["list", "context:* text:idea"]]:
+        result = runner.invoke(cli.cli, args)
+        if "✗" in result.output or result.exit_code != 0:
+            raise RuntimeError(f"{' '.join(args)} failed: {result.output}")
+    cli._engine.dispose()
+
+def run_store(root, db_path, listener):
+    from sqlalchemy import event
+
+    from store import SparkStore
+
+    with SparkStore(f"sqlite:///{db_path}") as store:
+        event.listen(store.engine, "before_cursor_execute", listener)
+        context = store.get_or_create_context(root, "bench")
+        spark = store.add_spark("plan me", context.id, "plans")
+        store.add_sparks([("one", None), ("two", "plans")], context.id, "general")
+        store.get_spark(spark.id, with_collections=True)
+        store.update_spark(spark.id, content="planned")
+        store.spark_history(spark.id)
+        store.revert_spark(spark.id, 1)
+        store.list_sparks(context.id, after_id=spark.id, limit=10)
+        store.search_sparks(context.id, "plan")
+        store.get_collections()
+        store.add_to_collection([spark.id], "more plans")
+        store.delete_spark(spark.id)
+        store.restore_sparks()
+        with store.unit_of_work() as uow:
+            uow.add_spark("batched", context.id, "plans")
+
+def full_scans(conn, sql, parameters):
+    """Guarded tables that `sql` reads in full, from its EXPLAIN QUERY PLAN rows."""
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    details = [row[-1] for row in plan]
+    scanned = []
+    for detail in details:
+        match = FULL_SCAN.match(detail)
+        if match and match.group(1) in GUARDED_TABLES:
+            scanned.append(match.group(1))
+    return scanned, details
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that no statement scans a large table in full")
+    parser.add_argument("--verbose", action="store_true", help="print every statement and its plan")
+    args = parser.parse_args(argv)
+
+    statements = {}
+    factory, listener = statement_recorder(statements)
+    with tempfile.TemporaryDirectory() as root:
+        db_path = make_workspace(root)
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            run_commands(root, db_path, listener, factory)
+            run_store(root, db_path, listener)
+        finally:
+            os.chdir(cwd)
+
+        conn = sqlite3.connect(db_path)
+        conn.execute("ANALYZE")
+        failed = []
+        for sql, parameters in statements.items():
+            scanned, details = full_scans(conn, sql, parameters)
+            allowed = next((reason for prefix, reason in ALLOWED_SCANS.items() if sql.startswith(prefix)), None)
+            if args.verbose or (scanned and not allowed):
+                print(sql[:160])
+                for detail in details:
+                    print(f"    {detail}")
+            if scanned and not allowed:
+                failed.append((sql, scanned))
+        conn.close()
+
+    print(f"{len(statements)} statements planned, {len(failed)} full scans of {', '.join(GUARDED_TABLES)}")
+    for sql, scanned in failed:
+        print(f"FAIL: scans {', '.join(scanned)}: {sql[:100]}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# revisions.py
+# Storage and read cost of spark revisions kept as compressed deltas
+# (db.revisions) against keeping a full copy of every version.
+#
+#   python lib/bench/revisions.py
+#   python lib/bench/revisions.py --sparks 1000 --edits 40
+#
+# Edits go through helpers.update_spark like `spark edit`: mostly small
+# (a word replaced, a sentence added, removed or inserted) with an
+# occasional rewrite, on sparks from a line to a few pages long. Every
+# version is also written to a full_copies table in the same database.
+# Sizes come from dbstat (pages, indexes included) and from the payloads
+# alone; reconstruction reads random revisions both ways. Exits with status
+# 1 if a reconstructed revision differs from its full copy.
+import argparse
+import random
+import sys
+import tempfile
+import time
+
+from common import make_workspace
+
+WORDS = (
+    "cache session token auth index query retry worker queue latency parser schema endpoint "
+    "deploy rollback metrics trace memory vector search ranking import export backup config"
+).split()
+LENGTHS = (60, 300, 1500, 6000)
+
+def sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 14))).capitalize() + "."
+
+def text_of(rng, length):
+    sentences = []
+    while sum(len(s) + 1 for s in sentences) < length:
+        sentences.append(sentence(rng))
+    return " ".join(sentences)
+
+def edited(rng, text):
+    sentences = text.split(". ")
+    choice = rng.random()
+    if choice < 0.4:
+        words = text.split(" ")
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+        return " ".join(words)
+    if choice < 0.65:
+        return f"{text} {sentence(rng)}"
+    if choice < 0.8 and len(sentences) > 1:
+        del sentences[rng.randrange(len(sentences))]
+        return ". ".join(sentences)
+    if choice < 0.95:
+        sentences.insert(rng.randrange(len(sentences) + 1), sentence(rng).rstrip("."))
+        return ". ".join(sentences)
+    return text_of(rng, len(text))
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(0.99 * (len(samples) - 1))] * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="spark revision storage benchmark")
+    parser.add_argument("--sparks", type=int, default=500, help="sparks to edit")
+    parser.add_argument("--edits", type=int, default=20, help="edits per spark")
+    parser.add_argument("--reads", type=int, default=2000, help="random revisions to reconstruct")
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import text
+    from sqlalchemy.orm import sessionmaker
+
+    import helpers
+    from db import revisions, storage
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as root:
+        database = make_workspace(root)
+        engine = storage.create_engine(f"sqlite:///{database}")
+        session = sessionmaker(bind=engine)()
+        context = helpers.create_context(session, root, "bench")
+        session.execute(text(
+            "CREATE TABLE full_copies (spark_id INTEGER, rev INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, "
+            "content TEXT NOT NULL, PRIMARY KEY (spark_id, rev)) WITHOUT ROWID"
+        ))
+        copy = text("INSERT INTO full_copies (spark_id, rev, content) VALUES (:spark_id, :rev, :content)")
+
+        versions, edit_times, deflated = 0, [], 0
+        for number in range(args.sparks):
+            content = text_of(rng, rng.choice(LENGTHS))
+            spark = helpers.create_spark(session, content, context)
+            history = [content]
+            for _ in range(args.edits):
+                content = edited(rng, content)
+                if content == history[-1]:
+                    continue
+                started = time.perf_counter()
+                helpers.update_spark(session, spark.id, content=content)
+                edit_times.append(time.perf_counter() - started)
+                history.append(content)
+            for rev, version in enumerate(history, 1):
+                session.execute(copy, {"spark_id": spark.id, "rev": rev, "content": version})
+                deflated += len(revisions.pack(version.encode()))
+            versions += len(history)
+            session.commit()
+
+        def pages(table):
+            return session.execute(text("SELECT SUM(pgsize) FROM dbstat WHERE name = :name"), {"name": table}).scalar()
+
+        payload = session.execute(text("SELECT SUM(LENGTH(data)), SUM(snapshot) FROM spark_revisions")).one()
+        full = session.execute(text("SELECT SUM(LENGTH(CAST(content AS BLOB))) FROM full_copies")).scalar()
+        print(f"{args.sparks:,} sparks, {versions:,} versions ({payload[1]:,} snapshots)")
+        print(f"{'':<22} {'on disk':>12} {'payload':>12}")
+        print(f"{'full copies':<22} {pages('full_copies') / 1024:>10.0f}KB {full / 1024:>10.0f}KB")
+        print(f"{'full copies, deflated':<22} {'':>12} {deflated / 1024:>10.0f}KB")
+        print(f"{'deltas':<22} {pages('spark_revisions') / 1024:>10.0f}KB {payload[0] / 1024:>10.0f}KB"
+              f"   ({pages('full_copies') / pages('spark_revisions'):.1f}x smaller on disk)")
+
+        p50, p99 = percentiles(edit_times)
+        print(f"edit with revision      p50={p50:7.3f}ms  p99={p99:7.3f}ms")
+        spark_ids = session.execute(text("SELECT id FROM sparks")).scalars().all()
+        targets = []
+        for _ in range(args.reads):
+            spark_id = rng.choice(spark_ids)
+            targets.append((spark_id, rng.randint(1, revisions.latest(session, spark_id) or 1)))
+        read = text("SELECT content FROM full_copies WHERE spark_id = :spark_id AND rev = :rev")
+        for label, fn in (
+            ("read full copy", lambda spark_id, rev: session.execute(read, {"spark_id": spark_id, "rev": rev}).scalar()),
+            ("reconstruct from deltas", lambda spark_id, rev: revisions.content_at(session, spark_id, rev)),
+        ):
+            samples = []
+            for spark_id, rev in targets:
+                started = time.perf_counter()
+                fn(spark_id, rev)
+                samples.append(time.perf_counter() - started)
+            p50, p99 = percentiles(samples)
+            print(f"{label:<23} p50={p50:7.3f}ms  p99={p99:7.3f}ms")
+
+        copies = {}
+        for row in session.execute(text("SELECT spark_id, content FROM full_copies ORDER BY spark_id, rev")):
+            copies.setdefault(row.spark_id, []).append(row.content)
+        wrong = 0
+        for spark_id, copied in copies.items():
+            # Sparks never edited have one full copy and no revisions
+            rebuilt = [version for _, _, version in revisions.history(session, spark_id)] or copied[:1]
+            wrong += rebuilt != copied
+        session.close()
+        engine.dispose()
+        if wrong:
+            print(f"✗ the revisions of {wrong} sparks differ from their full copies")
+            return 1
+        print(f"✓ every revision matches its full copy ({versions:,} checked)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
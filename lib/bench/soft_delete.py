@@ -0,0 +1,124 @@
+# soft_delete.py
+# Cost of deleting sparks as tombstones (helpers.delete_sparks, `spark
+# delete`) against the hard deletes they replace, and of purging them later
+# with `spark gc` (helpers.purge_deleted_sparks) in short batches.
+#
+#   python lib/bench/soft_delete.py --sparks 100k
+#   python lib/bench/soft_delete.py --sparks 1m --bulk 100k --batch-size 5000
+#
+# Single deletes compare session.delete (what delete_spark did: load the
+# spark and its collections, then delete) with delete_spark; bulk deletes
+# compare one DELETE ... WHERE id IN (...), memberships cascading, with one
+# tombstoning UPDATE. gc reports its longest batch, which is how long other
+# writers can wait on it. Exits with status 1 if the stats tables, the FTS
+# index or the memberships disagree with the sparks afterwards.
+import argparse
+import random
+import sys
+import tempfile
+import time
+
+from common import make_workspace
+
+from db.seed import parse_size
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(0.99 * (len(samples) - 1))] * 1000
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="soft delete and gc benchmark")
+    parser.add_argument("--sparks", default="100k", help="seeded sparks, e.g. 100k or 1m")
+    parser.add_argument("--single", type=int, default=200, help="sparks deleted one at a time, each way")
+    parser.add_argument("--bulk", default="10k", help="sparks deleted in one statement, each way")
+    parser.add_argument("--batch-size", type=int, default=1000, help="gc batch size")
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import event, select, text
+    from sqlalchemy.orm import sessionmaker
+
+    import helpers
+    from db import lite, stats, storage
+    from db.models import Spark
+    from db.seed import seed
+
+    sparks, bulk = parse_size(args.sparks), parse_size(args.bulk)
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as root:
+        database = make_workspace(root)
+        engine = storage.create_engine(f"sqlite:///{database}")
+        seed(engine, sparks, collections=5, fanout=2, working_directory=root)
+        session = sessionmaker(bind=engine)()
+        conn = lite.connect(database, pragmas=storage.sqlite_pragmas())
+        context_id = conn.execute("SELECT id FROM contexts LIMIT 1").fetchone()[0]
+        first_page = lambda: conn.execute(
+            "SELECT id FROM sparks WHERE context_id = ? AND deleted_at IS NULL ORDER BY created_at DESC, id DESC LIMIT 50",
+            (context_id,),
+        ).fetchall()
+        _, listed = timed(first_page)
+
+        ids = rng.sample(range(1, sparks // 2), args.single * 2)
+        for label, delete in (
+            ("hard, session.delete", lambda spark_id: (session.delete(session.get(Spark, spark_id)), session.commit())),
+            ("soft, delete_spark", lambda spark_id: helpers.delete_spark(session, spark_id)),
+        ):
+            samples = [timed(lambda: delete(spark_id))[1] for spark_id in ids[:args.single]]
+            ids = ids[args.single:]
+            p50, p99 = percentiles(samples)
+            print(f"single {label:<22} p50={p50:7.2f}ms  p99={p99:7.2f}ms")
+
+        # Two equal id ranges from the newer half, untouched so far
+        low = sparks // 2 + 1
+        hard_range, soft_range = (low, low + bulk - 1), (low + bulk, low + 2 * bulk - 1)
+        hard = text("DELETE FROM sparks WHERE id BETWEEN :low AND :high")
+        _, seconds = timed(lambda: (session.execute(hard, dict(zip(("low", "high"), hard_range))), session.commit()))
+        print(f"bulk   hard, one DELETE      {bulk:,} sparks in {seconds * 1000:8.1f}ms")
+        selection = select(Spark.id).where(Spark.id.between(*soft_range))
+        deleted, seconds = timed(lambda: helpers.delete_sparks(session, selection))
+        print(f"bulk   soft, delete_sparks   {deleted:,} sparks in {seconds * 1000:8.1f}ms")
+        restored, seconds = timed(lambda: helpers.restore_sparks(session))
+        print(f"undo   restore_sparks        {restored:,} sparks in {seconds * 1000:8.1f}ms")
+        helpers.delete_sparks(session, selection)
+
+        _, tombstoned = timed(first_page)
+        print(f"list first page              {listed * 1000:.2f}ms before, {tombstoned * 1000:.2f}ms with tombstones")
+
+        commits = [time.perf_counter()]
+        event.listen(session, "after_commit", lambda _: commits.append(time.perf_counter()))
+        purged, seconds = timed(lambda: helpers.purge_deleted_sparks(session, batch_size=args.batch_size))
+        longest = max(later - earlier for earlier, later in zip(commits, commits[1:]))
+        print(
+            f"gc     {purged:,} tombstones in {seconds * 1000:.1f}ms, "
+            f"{len(commits) - 1} batches of {args.batch_size:,}, longest {longest * 1000:.1f}ms"
+        )
+        orphans = helpers.purge_orphan_memberships(session, args.batch_size)
+
+        drift = stats.rebuild(conn)
+        checks = {
+            "stats rows off": sum(drift.values()),
+            "tombstones left": conn.execute("SELECT COUNT(*) FROM sparks WHERE deleted_at IS NOT NULL").fetchone()[0],
+            "orphaned memberships": orphans + conn.execute(
+                "SELECT COUNT(*) FROM spark_collections WHERE spark_id NOT IN (SELECT id FROM sparks)"
+            ).fetchone()[0],
+            "FTS rows off": abs(
+                conn.execute("SELECT COUNT(*) FROM sparks_fts").fetchone()[0]
+                - conn.execute("SELECT COUNT(*) FROM sparks").fetchone()[0]
+            ),
+        }
+        session.close()
+        conn.close()
+        engine.dispose()
+        problems = {name: count for name, count in checks.items() if count}
+        if problems:
+            print("✗ " + ", ".join(f"{count:,} {name}" for name, count in problems.items()))
+            return 1
+        print("✓ stats, FTS index and memberships match the sparks after delete, undo and gc")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# store_throughput.py
+# Throughput of the library API (store.py): reads through SparkStore,
+# sequentially and from a thread pool, and through AsyncSparkStore with
+# hundreds of concurrent tasks on one event loop; writes one transaction per
+# spark against batched units of work and multi-row add_sparks batches.
+#
+#   python lib/bench/store_throughput.py --sparks 100k --concurrency 500
+#   python lib/bench/store_throughput.py --reads 20000 --threads 16 --batch 500
+#
+# For the async runs a ticker task measures event-loop lag (how late a 1 ms
+# sleep wakes up while the reads are in flight), which stays small as long
+# as no query blocks the loop. Needs aiosqlite for the async runs.
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import make_workspace
+
+from db.seed import parse_size
+
+SEARCH_TERMS = ("cache", "index", "token*", "query", "async", "retry")
+
+def report(label, operations, seconds, lag=None):
+    line = f"{label:<24} ops={operations:<7} {operations / seconds if seconds else 0.0:10.1f} ops/s"
+    if lag is not None:
+        line += f"  loop lag p99={lag[0] * 1000:6.2f}ms max={lag[1] * 1000:6.2f}ms"
+    print(line)
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+def sync_reads(store, ids, context_id, threads):
+    terms = [SEARCH_TERMS[i % len(SEARCH_TERMS)] for i in range(len(ids) // 10)]
+    report("sync get", len(ids), timed(lambda: [store.get_spark(i) for i in ids]))
+    report("sync search", len(terms), timed(lambda: [store.search_sparks(context_id, t, 20) for t in terms]))
+    with ThreadPoolExecutor(threads) as pool:
+        report(f"sync get x{threads} threads", len(ids), timed(lambda: list(pool.map(store.get_spark, ids))))
+        report(
+            f"sync search x{threads} thr",
+            len(terms),
+            timed(lambda: list(pool.map(lambda t: store.search_sparks(context_id, t, 20), terms))),
+        )
+
+async def _with_lag(coroutine):
+    """Run `coroutine` while sampling event-loop lag; returns (result, seconds, (p99, max) lag)."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    result = await coroutine
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    lags.sort()
+    return result, elapsed, (lags[int(0.99 * (len(lags) - 1))], lags[-1]) if lags else (0.0, 0.0)
+
+async def async_reads(url, ids, context_id, concurrency):
+    from store import AsyncSparkStore
+
+    terms = [SEARCH_TERMS[i % len(SEARCH_TERMS)] for i in range(len(ids) // 10)]
+    async with AsyncSparkStore(url, pool_size=concurrency // 10 or 1, max_overflow=0) as store:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def bounded(operation):
+            async with limit:
+                return await operation
+
+        # Open the pool's connections before timing
+        await asyncio.gather(*(store.get_spark(i) for i in ids[:concurrency]))
+        _, seconds, lag = await _with_lag(asyncio.gather(*(bounded(store.get_spark(i)) for i in ids)))
+        report(f"async get x{concurrency}", len(ids), seconds, lag)
+        _, seconds, lag = await _with_lag(
+            asyncio.gather(*(bounded(store.search_sparks(context_id, t, 20)) for t in terms))
+        )
+        report(f"async search x{concurrency}", len(terms), seconds, lag)
+
+def writes(store, context_id, count, batch):
+    def one_per_call():
+        for i in range(count):
+            store.add_spark(f"per-call idea {i}", context_id, "bench")
+
+    def batched():
+        for start in range(0, count, batch):
+            with store.unit_of_work() as uow:
+                for i in range(start, min(start + batch, count)):
+                    uow.add_spark(f"batched idea {i}", context_id, "bench")
+
+    def bulk():
+        for start in range(0, count, batch):
+            records = ((f"bulk idea {i}", None) for i in range(start, min(start + batch, count)))
+            store.add_sparks(records, context_id, "bench")
+
+    report("sync add per call", count, timed(one_per_call))
+    report(f"sync add uow x{batch}", count, timed(batched))
+    report(f"sync add_sparks x{batch}", count, timed(bulk))
+
+async def async_writes(url, context_id, count, batch):
+    from store import AsyncSparkStore
+
+    async with AsyncSparkStore(url) as store:
+        started = time.perf_counter()
+        for start in range(0, count, batch):
+            async with store.unit_of_work() as uow:
+                for i in range(start, min(start + batch, count)):
+                    await uow.add_spark(f"async batched idea {i}", context_id, "bench")
+        report(f"async add uow x{batch}", count, time.perf_counter() - started)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SparkStore / AsyncSparkStore throughput benchmark")
+    parser.add_argument("--sparks", default="20k", help="seeded sparks, e.g. 20k or 1m")
+    parser.add_argument("--reads", type=int, default=10000, help="point reads per run (searches are a tenth)")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=200, help="async reads in flight at once")
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=200, help="sparks per unit of work")
+    args = parser.parse_args(argv)
+
+    from db import storage
+    from db.seed import seed
+    from store import SparkStore
+
+    sparks = parse_size(args.sparks)
+    with tempfile.TemporaryDirectory() as root:
+        url = f"sqlite:///{make_workspace(root)}"
+        engine = storage.create_engine(url)
+        seed(engine, sparks, working_directory=root)
+        engine.dispose()
+
+        rng = random.Random(0)
+        ids = [rng.randint(1, sparks) for _ in range(args.reads)]
+        with SparkStore(url) as store:
+            context_id = store.get_context(root).id
+            sync_reads(store, ids, context_id, args.threads)
+            try:
+                asyncio.run(async_reads(url, ids, context_id, args.concurrency))
+            except ValueError as e:
+                print(f"async                    skipped ({e})")
+                return 0
+            writes(store, context_id, args.writes, args.batch)
+        asyncio.run(async_writes(url, context_id, args.writes, args.batch))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,40 @@
 # cli.py
+# Heavy modules (SQLAlchemy, the ORM models, helpers, PyYAML) are imported
+# inside the commands that need them. With a SQLite store, add/list/search
+# run on the sqlite3 fast path in db.lite and never touch the ORM.
+import sys
+import time
+
+# Start of the "startup" phase reported by --profile / SPARK_TRACE
+_started = time.perf_counter()
+
+if __name__ == "__main__":
+    # Hand add/list/search/related to a running `spark daemon` before importing
+    # anything else; None means no daemon (or not servable), so run here.
+    import daemon
+    _exit_code = daemon.run_via_daemon(sys.argv[1:])
+    if _exit_code is not None:
+        sys.exit(_exit_code)
+
 import click
-from utils import create_dot_spark, read_dot_spark, get_current_context_id, format_timestamp, validate_spark_id
-from helpers import (
-    create_context, get_context_by_id, update_context, delete_context,
-    create_spark, get_spark_by_id, update_spark, delete_spark,
-    create_collection, get_collection_by_id, update_collection, delete_collection,
-    get_all_contexts, get_sparks_by_context, get_sparks_by_collection,
-    get_sparks_from_today, search_sparks, get_all_collections,
-    get_collection_by_name, add_spark_to_collection, remove_spark_from_collection
+from utils import (
+    create_dot_spark, load_dot_spark, read_dot_spark, get_current_context_id, get_current_context_lite,
+    format_timestamp, validate_spark_id, read_spark_records, parse_spark_ids
 )
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from db import lite, storage
+from db.instrument import span, active_tracer, trace_setting
+from db.query import compile_query
+from contextlib import nullcontext
 from string import ascii_letters, digits
 import os
 
-engine = create_engine("sqlite:///lib/db/spark_store.db")
-Session = sessionmaker(bind=engine)
+_database_url = None
+_engine = None
+_Session = None
 
 RESERVED_STRINGS = {"all", "list", "help"}
+# Environment variable click's shell completion scripts set (see `spark complete --shell`)
+COMPLETE_VAR = "_SPARK_COMPLETE"
 
 def clean_alphanum(value):
     cleaned = ''.join(c for c in value if c in ascii_letters + digits + " -_").lower()
@@ -39,13 +56,126 @@ def validate_collection_name(ctx, param, value):
         raise click.BadParameter("Collection name must be at least 3 alphanumeric characters.")
     return cleaned
 
+def get_database_url():
+    global _database_url
+    if _database_url is None:
+        dot_spark, dot_config = load_dot_spark()
+        _database_url = storage.get_database_url(dot_config, dot_spark.parent if dot_spark else None)
+    return _database_url
+
+def get_sqlite_pragmas():
+    """PRAGMA profile for SQLite stores: SPARK_SQLITE_PROFILE, else .spark's sqlite_profile."""
+    dot_config = load_dot_spark()[1] or {}
+    return storage.sqlite_pragmas(dot_config.get("sqlite_profile"))
+
+def get_sqlite_path():
+    """Database file when the store is SQLite (fast path available), else None."""
+    return storage.sqlite_path(get_database_url())
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with span("create engine", "setup"):
+            pragmas = get_sqlite_pragmas() if get_sqlite_path() else None
+            _engine = storage.create_engine(get_database_url(), pragmas=pragmas)
+        if active_tracer():
+            active_tracer().attach_engine(_engine)
+    return _engine
+
 def get_session():
-    return Session()
+    global _Session
+    if _Session is None:
+        engine = get_engine()
+        with span("create session", "setup"):
+            from sqlalchemy.orm import sessionmaker
+            _Session = sessionmaker(bind=engine)
+    return _Session()
+
+def get_connection():
+    tracer = active_tracer()
+    options = {"factory": tracer.connection_factory} if tracer else {}
+    with span("connect", "setup"):
+        return lite.connect(get_sqlite_path(), pragmas=get_sqlite_pragmas(), **options)
+
+# Shell completion, from the memory-mapped index in db.complete. Errors give
+# no candidates rather than a traceback in the middle of the prompt.
+def complete_spark_ids(ctx, param, incomplete):
+    """Spark IDs matching the last entry of `incomplete` (so 3,7,1<TAB> works), described by their text."""
+    from click.shell_completion import CompletionItem
+    head, comma, tail = incomplete.rpartition(",")
+    try:
+        if not get_sqlite_path():
+            return []
+        from db import complete
+        matches = complete.sparks(get_connection(), get_sqlite_path(), tail)
+    except Exception:
+        return []
+    return [
+        CompletionItem(f"{head}{comma}{spark_id}", help=format_completion(text, names))
+        for spark_id, text, names in matches
+    ]
+
+def complete_collection_names(ctx, param, incomplete):
+    try:
+        if not get_sqlite_path():
+            return []
+        from db import complete
+        return complete.collections(get_connection(), get_sqlite_path(), incomplete)
+    except Exception:
+        return []
+
+def format_completion(text, names):
+    return f"{text} [{', '.join(names)}]" if names else text
 
 @click.group()
-def cli():
+@click.option('--profile', is_flag=True, help='Print a timing breakdown to stderr and save a Chrome trace')
+@click.option('--trace-file', type=click.Path(dir_okay=False), help='Where to save the trace (implies --profile)')
+@click.option('--pstats', 'pstats_file', type=click.Path(dir_okay=False), help='Also run cProfile and dump its stats here (implies --profile)')
+@click.pass_context
+def cli(ctx, profile, trace_file, pstats_file):
     """Spark - Capture and organize your coding ideas"""
-    pass
+    tracing, trace_env_file = trace_setting()
+    if tracing:
+        profile = True
+        trace_file = trace_file or trace_env_file
+    pstats_file = pstats_file or os.environ.get("SPARK_PSTATS")
+    if profile or trace_file or pstats_file:
+        start_profiling(ctx, trace_file, pstats_file)
+
+def default_trace_path(command):
+    from utils.context_cache import cache_path
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(os.path.dirname(cache_path()), "traces", f"{command}-{stamp}-{os.getpid()}.json")
+
+def start_profiling(ctx, trace_file, pstats_file):
+    from db import instrument
+
+    tracer = instrument.start_tracing(origin=_started)
+    tracer.add_span("startup", "startup", _started, time.perf_counter())
+    command = ctx.invoked_subcommand or "cli"
+    command_span = tracer.span(command, "command", argv=sys.argv[1:])
+    command_span.__enter__()
+    if pstats_file:
+        tracer.start_profiler()
+
+    def finish():
+        command_span.__exit__(None, None, None)
+        instrument.stop_tracing()
+        trace_path = trace_file or default_trace_path(command)
+        try:
+            if pstats_file:
+                tracer.stop_profiler(pstats_file)
+            tracer.write_chrome_trace(trace_path)
+        except OSError as e:
+            click.secho(f"✗ Could not save profile: {str(e)}", fg="red", err=True)
+            return
+        click.echo(f"\n{tracer.summary()}", err=True)
+        click.echo(f"Trace: {trace_path} (open in chrome://tracing or https://ui.perfetto.dev)", err=True)
+        if pstats_file:
+            click.echo(f"pstats: {pstats_file} (python -m pstats {pstats_file})", err=True)
+
+    # Runs after the subcommand returns or fails
+    ctx.call_on_close(finish)
 
 @click.command("init", help="creates a new spark context in the current directory")
 @click.option('--project-name', prompt='Project name', callback=validate_project_name, help='Name of the project')
@@ -58,130 +188,417 @@ def create_context_cmd(project_name, default_collection):
         click.secho(f"✗ {str(e)}", fg="red")
         raise click.Abort()
 
-@click.command("add", help="add a new spark")
-@click.argument('content')
-@click.option('--collection', '-c', help='Collection name')
-def add_spark(content, collection):
+@click.command("add", help="add a new spark, or many with --stdin/--file")
+@click.argument('content', required=False)
+@click.option('--collection', '-c', shell_complete=complete_collection_names, help='Collection name')
+@click.option('--stdin', 'from_stdin', is_flag=True, help='Read newline-delimited or JSONL sparks from stdin')
+@click.option('--file', '-f', 'from_file', type=click.File('r'), help='Read newline-delimited or JSONL sparks from a file')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1), help='Sparks per transaction for bulk adds')
+@click.option('--dedupe', is_flag=True, help='Skip sparks that nearly duplicate one in this context')
+@click.option('--threshold', default=0.7, show_default=True, type=click.FloatRange(0, 1), help='Similarity at which --dedupe counts a duplicate')
+@click.option('--merge', is_flag=True, help='With --dedupe, add a skipped spark\'s collection to the spark it duplicates')
+def add_spark(content, collection, from_stdin, from_file, batch_size, dedupe, threshold, merge):
     try:
-        session = get_session()
-        dot_config = read_dot_spark()
-        context_id = get_current_context_id(session)
-        
-        # Create spark
-        spark = create_spark(session, content, get_context_by_id(session, context_id))
-        
-        # Add to collection if specified
-        if collection:
-            collection_obj = get_collection_by_name(session, collection)
-            if not collection_obj:
-                collection_obj = create_collection(session, collection)
-            add_spark_to_collection(session, spark.id, collection_obj.id)
+        if merge and not dedupe:
+            raise click.UsageError("--merge needs --dedupe.")
+        if dedupe and not get_sqlite_path():
+            raise ValueError("--dedupe works with SQLite stores only")
+        if from_stdin or from_file:
+            if content:
+                raise click.UsageError("Pass CONTENT or --stdin/--file, not both.")
+            bulk_add(from_file or sys.stdin, collection, batch_size, threshold if dedupe else None, merge)
+            return
+        if not content:
+            raise click.UsageError("Missing argument 'CONTENT'.")
+
+        # Create spark and add it to the given (or default) collection in one transaction
+        if get_sqlite_path():
+            conn = get_connection()
+            context_id, dot_config = get_current_context_lite(conn, get_sqlite_path())
+            collection = collection or dot_config["default_collection"]
+            if dedupe:
+                from db.dedupe import add_spark as add_unique_spark
+                spark_id, match = add_unique_spark(conn, content, context_id, collection, threshold, merge)
+                if match:
+                    click.secho(format_duplicate(match, collection if merge else None), fg="yellow")
+                    return
+            else:
+                spark_id = lite.add_spark(conn, content, context_id, collection)
         else:
-            # Add to default collection
-            default_collection_obj = get_collection_by_name(session, dot_config["default_collection"])
-            if not default_collection_obj:
-                default_collection_obj = create_collection(session, dot_config["default_collection"])
-            add_spark_to_collection(session, spark.id, default_collection_obj.id)
+            from helpers import create_spark_in_collection
+            session = get_session()
+            context_id = get_current_context_id(session)
+            collection = collection or read_dot_spark()["default_collection"]
+            spark_id = create_spark_in_collection(session, content, context_id, collection).id
         
-        click.secho(f"✓ Spark #{spark.id} added successfully", fg="green")
+        click.secho(f"✓ Spark #{spark_id} added successfully", fg="green")
+    except click.UsageError:
+        raise
     except Exception as e:
         click.secho(f"✗ {str(e)}", fg="red")
 
-@click.command("list", help="list sparks")
-@click.option('--collection', '-c', help='Filter by collection name')
+def format_duplicate(match, merged_into=None):
+    spark_id, score = match
+    message = f"≈ Duplicate of spark #{spark_id} ({score:.2f}), not added"
+    return message + (f"; #{spark_id} added to '{merged_into}'" if merged_into else "")
+
+def bulk_add(stream, collection, batch_size, threshold=None, merge=False):
+    records = read_spark_records(stream)
+    if get_sqlite_path():
+        conn = get_connection()
+        context_id, dot_config = get_current_context_lite(conn, get_sqlite_path())
+        if threshold is not None:
+            from db import dedupe
+            batches = dedupe.bulk_add_sparks(
+                conn, records, context_id, collection or dot_config["default_collection"], batch_size, threshold, merge
+            )
+        else:
+            batches = lite.bulk_add_sparks(
+                conn, records, context_id, collection or dot_config["default_collection"], batch_size
+            )
+    else:
+        from helpers import bulk_create_sparks
+        session = get_session()
+        context_id = get_current_context_id(session)
+        batches = bulk_create_sparks(
+            session, records, context_id, collection or read_dot_spark()["default_collection"], batch_size
+        )
+
+    started = time.perf_counter()
+    total = skipped = 0
+    for progress in batches:
+        if threshold is None:
+            total = progress
+            continue
+        total, duplicates = progress
+        for number, spark_id, score in duplicates:
+            click.secho(f"≈ Record {number} duplicates spark #{spark_id} ({score:.2f})", fg="yellow")
+        skipped += len(duplicates)
+    elapsed = time.perf_counter() - started
+
+    rate = total / elapsed if elapsed > 0 else float(total)
+    summary = f"✓ {total} sparks added in {elapsed:.2f}s ({rate:,.0f} sparks/sec)"
+    if threshold is not None:
+        summary += f", {plural(skipped, 'duplicate')} {'merged' if merge else 'skipped'}"
+    click.secho(summary, fg="green")
+
+@click.command("list", help="list sparks, optionally filtered by a query like 'collection:bugs AND created>2026-01-01 AND text:auth'")
+@click.argument('query', required=False)
+@click.option('--collection', '-c', shell_complete=complete_collection_names, help='Filter by collection name')
 @click.option('--today', '-t', is_flag=True, help='Show only today\'s sparks')
+@click.option('--week', '-w', is_flag=True, help='Show only this week\'s sparks (since Monday)')
+@click.option('--since', help='Show sparks created on or after this date (YYYY-MM-DD, yesterday, 7d, ...)')
+@click.option('--until', help='Show sparks created on or before this date (the whole day included)')
 @click.option('--context', '-ctx', help='Show sparks from specific context path')
-def list_sparks(collection, today, context):
+@click.option('--limit', '-n', type=click.IntRange(min=0), help='Show at most this many sparks')
+@click.option('--after-id', type=int, help='Continue after this spark ID (keyset pagination)')
+@click.option('--reverse', '-r', is_flag=True, help='Newest first')
+def list_sparks(query, collection, today, week, since, until, context, limit, after_id, reverse):
     try:
-        session = get_session()
-        
-        if context:
-            context_obj = get_context_by_working_dir(session, context)
-            if not context_obj:
-                click.secho(f"✗ No context found for path: {context}", fg="red")
-                return
-            sparks = get_sparks_by_context(session, context_obj.id)
+        filters = list_filters(collection, today, context, week, since, until)
+        if get_sqlite_path():
+            sparks = select_sparks_lite(
+                get_connection(), get_sqlite_path(), query, filters, limit, after_id, reverse
+            )
         else:
-            context_id = get_current_context_id(session)
-            if today:
-                sparks = get_sparks_from_today(session, context_id)
-            elif collection:
-                collection_obj = get_collection_by_name(session, collection)
-                if not collection_obj:
-                    click.secho(f"✗ Collection '{collection}' not found", fg="red")
-                    return
-                sparks = get_sparks_by_collection(session, collection_obj.id)
-            else:
-                sparks = get_sparks_by_context(session, context_id)
+            sparks = select_sparks_orm(query, filters, limit, after_id, reverse)
         
-        if not sparks:
+        if not stream_sparks(sparks):
             click.secho("No sparks found", fg="yellow")
-            return
-            
-        for spark in sparks:
-            click.echo(f"{spark.id}: {spark.content} [{format_timestamp(spark.created_at)}]")
             
     except Exception as e:
         click.secho(f"✗ {str(e)}", fg="red")
 
-@click.command("collections", help="manage collections")
+def list_filters(collection, today, context, week=False, since=None, until=None):
+    """The --collection/--today/--week/--since/--until/--context shortcuts as query terms,
+    combinable with each other and a query."""
+    filters = []
+    if collection:
+        filters.append(f'collection:"{collection}"')
+    if today:
+        filters.append("created:today")
+    if week:
+        filters.append("created:week")
+    if since:
+        filters.append(f'created>="{since}"')
+    if until:
+        filters.append(f'created<="{until}"')
+    if context:
+        filters.append(f'context:"{context}"')
+    return tuple(filters)
+
+def select_sparks_lite(conn, database_path, query, filters, limit, after_id, reverse, cwd=None, timezone=None,
+                       context_lock=nullcontext()):
+    """Cursor over the sparks `list` should print, from one compiled query.
+
+    `context_lock` guards only the context lookup (the daemon shares its context cache between threads).
+    """
+    plan = compile_query(query or "", "sqlite", filters)
+    context_id = None
+    if plan.needs_context:
+        with context_lock:
+            context_id = get_current_context_lite(conn, database_path, cwd)[0]
+    return lite.query_sparks(conn, plan, context_id, after_id, limit, reverse, timezone)
+
+def select_sparks_orm(query, filters, limit, after_id, reverse):
+    from helpers import query_sparks
+    session = get_session()
+    plan = compile_query(query or "", session.get_bind().dialect.name, filters)
+    context_id = get_current_context_id(session) if plan.needs_context else None
+    return query_sparks(session, plan, context_id, after_id, limit, reverse)
+
+def format_spark(spark, tz=None):
+    return f"{spark.id}: {spark.content} [{format_timestamp(spark.created_at, tz)}]"
+
+def stream_sparks(sparks):
+    """Write sparks as they come off the cursor; returns how many were shown."""
+    shown = 0
+    try:
+        for spark in sparks:
+            sys.stdout.write(format_spark(spark) + "\n")
+            shown += 1
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader (head, less) went away: stop the query and exit quietly
+        close = getattr(sparks, "close", None)
+        if close:
+            close()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return shown or 1
+    return shown
+
+@click.command("collections", help="manage collections; spark IDs can be lists (3 7 9, 3,7,9) or ranges (10-200)")
 @click.argument('action', required=False)
-@click.argument('name', required=False)
-@click.argument('spark_id', required=False, type=int)
-def collections_cmd(action, name, spark_id):
+@click.argument('name', required=False, shell_complete=complete_collection_names)
+@click.argument('spark_ids', nargs=-1, shell_complete=complete_spark_ids)
+@click.option('--search', '-s', help='Select sparks in this context matching a search query')
+@click.option('--in', 'in_collection', shell_complete=complete_collection_names, help='Select sparks currently in this collection')
+@click.option('--from', 'from_collection', shell_complete=complete_collection_names, help='For move: only take sparks out of this collection (default: all others)')
+def collections_cmd(action, name, spark_ids, search, in_collection, from_collection):
     try:
+        from helpers import get_collection_spark_counts, get_collection_by_name, create_collection
         session = get_session()
         
         if not action:
-            # List all collections
-            collections = get_all_collections(session)
+            # List all collections with their spark counts in one query
+            collections = get_collection_spark_counts(session)
             if not collections:
                 click.secho("No collections found", fg="yellow")
                 return
                 
-            for collection in collections:
-                click.echo(f"{collection.name} ({len(collection.sparks)} sparks)")
+            for collection, spark_count in collections:
+                click.echo(f"{collection.name} ({spark_count} sparks)")
             return
             
         if action == "create" and name:
             collection = create_collection(session, name)
             click.secho(f"✓ Collection '{name}' created", fg="green")
-        elif action == "add" and name and spark_id:
-            collection_obj = get_collection_by_name(session, name)
-            if not collection_obj:
-                collection_obj = create_collection(session, name)
-            add_spark_to_collection(session, spark_id, collection_obj.id)
-            click.secho(f"✓ Spark #{spark_id} added to '{name}'", fg="green")
+        elif action in ("add", "remove", "move") and name:
+            update_memberships(session, action, name, spark_ids, search, in_collection, from_collection)
         else:
-            click.secho("Invalid command. Use: collections [create|add] [name] [spark_id]", fg="red")
+            click.secho("Invalid command. Use: collections [create|add|remove|move] [name] [ids...]", fg="red")
             
     except Exception as e:
         click.secho(f"✗ {str(e)}", fg="red")
 
-@click.command("search", help="search sparks")
+def update_memberships(session, action, name, spark_ids, search, in_collection, from_collection):
+    """Bulk add/remove/move: one set-based statement per step, one transaction."""
+    from helpers import (
+        get_collection_by_name, get_or_create_collection, select_spark_ids,
+        add_sparks_to_collection, remove_sparks_from_collection, move_sparks_to_collection
+    )
+
+    def existing_collection(collection_name):
+        collection = get_collection_by_name(session, collection_name)
+        if not collection:
+            raise ValueError(f"Collection '{collection_name}' not found")
+        return collection
+
+    ids, ranges = parse_spark_ids(spark_ids)
+    selection = select_spark_ids(
+        session, ids, ranges,
+        search=search,
+        context_id=get_current_context_id(session) if search else None,
+        in_collection_id=existing_collection(in_collection).id if in_collection else None,
+    )
+
+    if action == "remove":
+        removed = remove_sparks_from_collection(session, selection, existing_collection(name).id)
+        click.secho(f"✓ {plural(removed, 'spark')} removed from '{name}'", fg="green")
+        return
+
+    source_id = existing_collection(from_collection).id if from_collection else None
+    collection = get_or_create_collection(session, name)
+    if action == "add":
+        added = add_sparks_to_collection(session, selection, collection.id)
+        click.secho(f"✓ {plural(added, 'spark')} added to '{name}'", fg="green")
+    else:
+        added, removed = move_sparks_to_collection(session, selection, collection.id, source_id)
+        click.secho(f"✓ {plural(added, 'spark')} added to '{name}', {plural(removed, 'membership')} removed", fg="green")
+
+def plural(count, noun):
+    return f"{count:,} {noun}{'' if count == 1 else 's'}"
+
+def highlight(snippet):
+    snippet = snippet.replace(lite.HIGHLIGHT_START, "\x1b[1;33m")
+    return snippet.replace(lite.HIGHLIGHT_END, "\x1b[0m")
+
+@click.command("search", help="search sparks (supports prefix* and \"exact phrase\" queries)")
 @click.argument('query')
-def search_sparks_cmd(query):
+@click.option('--limit', '-n', default=50, show_default=True, help='Maximum number of results')
+@click.option('--semantic', is_flag=True, help='Rank by meaning instead of matching words (needs numpy)')
+def search_sparks_cmd(query, limit, semantic):
     try:
-        session = get_session()
-        context_id = get_current_context_id(session)
-        sparks = search_sparks(session, context_id, query)
+        if semantic:
+            if not get_sqlite_path():
+                raise ValueError("Semantic search works with SQLite stores only")
+            from db import semantic as vectors
+            conn = get_connection()
+            context_id = get_current_context_lite(conn, get_sqlite_path())[0]
+            matches = vectors.search(conn, query, limit=limit, context_id=context_id)
+            if not matches:
+                click.secho(f"No sparks found for '{query}'", fg="yellow")
+            for spark, score in matches:
+                click.echo(format_match(spark, score))
+            return
+        if get_sqlite_path():
+            conn = get_connection()
+            context_id = get_current_context_lite(conn, get_sqlite_path())[0]
+            sparks = lite.search_sparks(conn, context_id, query, limit=limit)
+        else:
+            from helpers import search_sparks
+            session = get_session()
+            sparks = search_sparks(session, get_current_context_id(session), query, limit=limit)
         
         if not sparks:
             click.secho(f"No sparks found for '{query}'", fg="yellow")
             return
             
         for spark in sparks:
-            click.echo(f"{spark.id}: {spark.content}")
+            click.echo(f"{spark.id}: {highlight(spark.snippet)}")
             
     except Exception as e:
         click.secho(f"✗ {str(e)}", fg="red")
 
+def format_match(spark, score):
+    return f"{spark.id}: {spark.content} ({score:.2f})"
+
+@click.command("related", help="show the sparks closest in meaning to a spark (needs numpy)")
+@click.argument('spark_id', type=int, shell_complete=complete_spark_ids)
+@click.option('--limit', '-n', default=10, show_default=True, help='Maximum number of results')
+def related_sparks_cmd(spark_id, limit):
+    try:
+        if not get_sqlite_path():
+            raise ValueError("spark related works with SQLite stores only")
+        from db import semantic
+        conn = get_connection()
+        context_id = get_current_context_lite(conn, get_sqlite_path())[0]
+        matches = semantic.related(conn, spark_id, limit=limit, context_id=context_id)
+        if not matches:
+            click.secho(f"No sparks related to #{spark_id}", fg="yellow")
+        for spark, score in matches:
+            click.echo(format_match(spark, score))
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("dedupe", help="find sparks that nearly duplicate an older spark in this context")
+@click.option('--threshold', default=0.7, show_default=True, type=click.FloatRange(0, 1), help='Similarity at which a spark counts as a duplicate')
+@click.option('--merge', is_flag=True, help='Give the older sparks the duplicates\' collections, then delete the duplicates')
+def dedupe_cmd(threshold, merge):
+    try:
+        if not get_sqlite_path():
+            raise ValueError("spark dedupe works with SQLite stores only")
+        from db import dedupe
+        conn = get_connection()
+        context_id = get_current_context_lite(conn, get_sqlite_path())[0]
+        pairs = []
+        for spark, original_id, score in dedupe.find_duplicates(conn, context_id, threshold):
+            click.echo(f"{spark.id} ≈ {original_id} ({score:.2f}): {spark.content}")
+            pairs.append((spark.id, original_id))
+        if not pairs:
+            click.secho("No duplicates found", fg="green")
+        elif merge:
+            dedupe.merge_duplicates(conn, pairs)
+            click.secho(f"✓ Merged {plural(len(pairs), 'duplicate')} into the sparks they duplicate", fg="green")
+        else:
+            click.secho(f"{plural(len(pairs), 'duplicate')} found; run with --merge to fold duplicates into the older sparks", fg="yellow")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("stats", help="spark counts and activity per project, collection and day")
+@click.option('--days', default=14, show_default=True, type=click.IntRange(1, 366), help='Days in the daily histogram')
+@click.option('--rebuild', is_flag=True, help='Recompute the stats from scratch and report any that were off')
+def stats_cmd(days, rebuild):
+    try:
+        if not get_sqlite_path():
+            raise ValueError("spark stats works with SQLite stores only")
+        from db import stats
+        conn = get_connection()
+        if rebuild:
+            drift = stats.rebuild(conn)
+            if any(drift.values()):
+                fixed = ", ".join(f"{table} {plural(rows, 'row')}" for table, rows in drift.items() if rows)
+                click.secho(f"✓ Stats rebuilt; corrected {fixed}", fg="yellow")
+            else:
+                click.secho("✓ Stats rebuilt; all were up to date", fg="green")
+
+        click.secho("Projects", bold=True)
+        for row in stats.context_stats(conn):
+            name = row.project_name or f"context {row.context_id}"
+            click.echo(
+                f"  {name:<24} {plural(row.sparks, 'spark'):>16}  "
+                f"{format_timestamp(row.first_at)} .. {format_timestamp(row.last_at)}  {row.working_directory or ''}"
+            )
+        click.secho("Collections", bold=True)
+        for row in stats.collection_stats(conn):
+            click.echo(
+                f"  {row.name:<24} {plural(row.sparks, 'spark'):>16}  "
+                f"{format_timestamp(row.first_at)} .. {format_timestamp(row.last_at)}"
+            )
+
+        context_id = get_current_context_lite(conn, get_sqlite_path())[0]
+        histogram = stats.daily(conn, context_id, days)
+        peak = max(count for _, count in histogram) or 1
+        click.secho(f"Last {plural(days, 'day')} in this project (UTC)", bold=True)
+        for day, count in histogram:
+            click.echo(f"  {day.isoformat()} {'█' * round(40 * count / peak):<40} {count:,}")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("complete", help="print sparks (or collections) matching a fuzzy query, e.g. for fzf; --shell prints a completion script")
+@click.argument('query', required=False, default="")
+@click.option('--collections', 'collection_names', is_flag=True, help='Complete collection names instead of sparks')
+@click.option('--limit', '-n', default=50, show_default=True, type=click.IntRange(min=1), help='Maximum number of results')
+@click.option('--shell', type=click.Choice(["bash", "zsh", "fish"]), help='Print the script that enables tab completion in this shell')
+def complete_cmd(query, collection_names, limit, shell):
+    try:
+        if shell:
+            from click.shell_completion import get_completion_class
+            click.echo(get_completion_class(shell)(cli, {}, "spark", COMPLETE_VAR).source())
+            return
+        if not get_sqlite_path():
+            raise ValueError("spark complete works with SQLite stores only")
+        from db import complete
+        if collection_names:
+            for name in complete.collections(get_connection(), get_sqlite_path(), query, limit):
+                click.echo(name)
+            return
+        for spark in complete.sparks(get_connection(), get_sqlite_path(), query, limit):
+            click.echo(format_completion_line(*spark))
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+def format_completion_line(spark_id, text, names):
+    """Tab-separated, so pickers can cut the ID out of the chosen line."""
+    return f"{spark_id}\t{text}\t{', '.join(names)}"
+
 @click.command("show", help="show spark details")
-@click.argument('spark_id', type=int)
+@click.argument('spark_id', type=int, shell_complete=complete_spark_ids)
 def show_spark(spark_id):
     try:
         session = get_session()
-        spark = validate_spark_id(session, spark_id)
+        spark = validate_spark_id(session, spark_id, with_collections=True)
         
         click.echo(f"ID: {spark.id}")
         click.echo(f"Content: {spark.content}")
@@ -195,10 +612,11 @@ def show_spark(spark_id):
         click.secho(f"✗ {str(e)}", fg="red")
 
 @click.command("edit", help="edit a spark")
-@click.argument('spark_id', type=int)
+@click.argument('spark_id', type=int, shell_complete=complete_spark_ids)
 @click.argument('content')
 def edit_spark(spark_id, content):
     try:
+        from helpers import update_spark
         session = get_session()
         spark = validate_spark_id(session, spark_id)
         update_spark(session, spark_id, content=content)
@@ -206,26 +624,345 @@ def edit_spark(spark_id, content):
     except Exception as e:
         click.secho(f"✗ {str(e)}", fg="red")
 
-@click.command("delete", help="delete a spark")
-@click.argument('spark_id', type=int)
-def delete_spark_cmd(spark_id):
+@click.command("history", help="list the earlier versions of an edited spark")
+@click.argument('spark_id', type=int, shell_complete=complete_spark_ids)
+@click.option('--rev', '-r', type=click.IntRange(min=1), help='Print the full text of this revision')
+@click.option('--diff', 'show_diff', is_flag=True, help='Show what each revision changed')
+def history_cmd(spark_id, rev, show_diff):
     try:
+        from db import revisions
         session = get_session()
         spark = validate_spark_id(session, spark_id)
-        delete_spark(session, spark_id)
-        click.secho(f"✓ Spark #{spark_id} deleted", fg="green")
+        history = revisions.history(session, spark_id)
+        if rev is not None:
+            texts = {number: text for number, _, text in history}
+            if rev not in texts:
+                raise ValueError(f"Spark #{spark_id} has no revision {rev}")
+            click.echo(texts[rev])
+            return
+        if not history:
+            click.echo(f"Spark #{spark_id} has not been edited")
+            return
+
+        previous = None
+        for number, created_at, text in history:
+            current = " (current)" if number == history[-1][0] and text == spark.content else ""
+            click.secho(f"r{number}  {format_timestamp(created_at)}  {plural(len(text), 'char')}{current}", bold=True)
+            if show_diff and previous is not None:
+                for line in format_diff(previous, text):
+                    click.echo(line)
+            else:
+                click.echo(f"  {preview(text)}")
+            previous = text
+        if history[-1][2] != spark.content:
+            click.secho("The current text was changed outside `spark edit`; the next edit records it", fg="yellow")
     except Exception as e:
         click.secho(f"✗ {str(e)}", fg="red")
 
+def preview(text, width=72):
+    lines = text.strip().splitlines() or [""]
+    return lines[0][:width - 1] + "…" if len(lines) > 1 or len(lines[0]) > width else lines[0]
+
+def format_diff(old, new):
+    from difflib import unified_diff
+    for line in unified_diff(old.splitlines(), new.splitlines(), lineterm="", n=1):
+        if line.startswith(("---", "+++")):
+            continue
+        color = {"-": "red", "+": "green", "@": "cyan"}.get(line[:1])
+        yield "  " + (click.style(line, fg=color) if color else line)
+
+@click.command("revert", help="restore an earlier revision of a spark (recorded as a new revision)")
+@click.argument('spark_id', type=int, shell_complete=complete_spark_ids)
+@click.argument('rev', type=click.IntRange(min=1))
+def revert_cmd(spark_id, rev):
+    try:
+        from helpers import revert_spark
+        from db import revisions
+        session = get_session()
+        validate_spark_id(session, spark_id)
+        before = revisions.latest(session, spark_id)
+        revert_spark(session, spark_id, rev)
+        latest = revisions.latest(session, spark_id)
+        if latest == before:
+            click.secho(f"✓ Spark #{spark_id} already matches r{rev}", fg="green")
+        else:
+            click.secho(f"✓ Spark #{spark_id} reverted to r{rev} (now r{latest})", fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("delete", help="delete sparks by ID, range (10-200), --search or --in; `spark undo` brings them back")
+@click.argument('spark_ids', nargs=-1, shell_complete=complete_spark_ids)
+@click.option('--search', '-s', help='Delete the sparks in this context matching a search query')
+@click.option('--in', 'in_collection', shell_complete=complete_collection_names, help='Delete the sparks in this collection')
+def delete_spark_cmd(spark_ids, search, in_collection):
+    try:
+        from helpers import delete_spark, delete_sparks, select_spark_ids, get_collection_by_name
+        session = get_session()
+        ids, ranges = parse_spark_ids(spark_ids)
+        if len(ids) == 1 and not (ranges or search or in_collection):
+            validate_spark_id(session, ids[0])
+            delete_spark(session, ids[0])
+            click.secho(f"✓ Spark #{ids[0]} deleted (`spark undo` restores it)", fg="green")
+            return
+
+        collection = get_collection_by_name(session, in_collection) if in_collection else None
+        if in_collection and not collection:
+            raise ValueError(f"Collection '{in_collection}' not found")
+        selection = select_spark_ids(
+            session, ids, ranges,
+            search=search,
+            context_id=get_current_context_id(session) if search else None,
+            in_collection_id=collection.id if collection else None,
+        )
+        deleted = delete_sparks(session, selection)
+        click.secho(f"✓ {plural(deleted, 'spark')} deleted" + (" (`spark undo` restores them)" if deleted else ""), fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("undo", help="restore the sparks last deleted in this project on this machine, or the deleted sparks given by ID or range")
+@click.argument('spark_ids', nargs=-1)
+def undo_cmd(spark_ids):
+    try:
+        from helpers import restore_sparks, select_spark_ids
+        session = get_session()
+        selection, context_id = None, None
+        if spark_ids:
+            ids, ranges = parse_spark_ids(spark_ids)
+            selection = select_spark_ids(session, ids, ranges, deleted=True)
+        else:
+            context_id = get_current_context_id(session)
+        restored = restore_sparks(session, selection, context_id)
+        if not restored:
+            click.secho("Nothing to undo: no deleted sparks" + (" with those IDs" if spark_ids else " in this project"), fg="yellow")
+            return
+        click.secho(f"✓ {plural(restored, 'spark')} restored", fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("gc", help="permanently remove deleted sparks, with their memberships and revisions")
+@click.option('--older-than', help='Only sparks deleted longer ago than this: 12h, 7d, 2w or a date')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1), help='Rows removed per transaction')
+def gc_cmd(older_than, batch_size):
+    try:
+        from helpers import purge_deleted_sparks, purge_orphan_memberships
+        from db.query import date_bounds, local_timezone
+        session = get_session()
+        before = date_bounds(older_than)(local_timezone())[0] if older_than else None
+        started = time.perf_counter()
+        purged = purge_deleted_sparks(session, before, batch_size)
+        orphans = purge_orphan_memberships(session, batch_size)
+        elapsed = time.perf_counter() - started
+        click.secho(
+            f"✓ Removed {plural(purged, 'deleted spark')} and {plural(orphans, 'orphaned membership')} in {elapsed:.2f}s",
+            fg="green",
+        )
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("sync", help="exchange changes with other replicas of this store through a shared directory")
+@click.argument('directory', type=click.Path(file_okay=False))
+def sync_cmd(directory):
+    try:
+        if not get_sqlite_path():
+            raise ValueError("spark sync works with SQLite stores only")
+        from db import sync
+        started = time.perf_counter()
+        counts = sync.sync(get_connection(), directory)
+        elapsed = time.perf_counter() - started
+        click.echo(
+            f"Pulled {plural(counts['files'], 'delta file')}: {plural(counts['applied'], 'change')} applied, "
+            f"{counts['skipped']:,} skipped (superseded here)"
+        )
+        click.secho(f"✓ Pushed {plural(counts['pushed'], 'change')} to {directory} in {elapsed:.2f}s", fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.group("db", help="database maintenance")
+def db_cmd():
+    pass
+
+@db_cmd.command("tune", help="apply the PRAGMA profile, checkpoint the WAL and refresh planner statistics")
+def db_tune_cmd():
+    try:
+        if not get_sqlite_path():
+            from sqlalchemy import text
+            with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(text("ANALYZE"))
+            click.secho("✓ ANALYZE complete", fg="green")
+            return
+        conn = get_connection()
+        busy, wal_pages, checkpointed = lite.checkpoint(conn)
+        lite.analyze(conn)
+        lite.optimize(conn)
+        click.echo(f"Checkpointed {checkpointed}/{wal_pages} WAL pages" + (" (busy)" if busy else ""))
+        for name, value in get_sqlite_pragmas().items():
+            click.echo(f"{name} = {conn.execute(f'PRAGMA {name}').fetchone()[0]}")
+        click.secho("✓ Database tuned (ANALYZE, optimize)", fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@db_cmd.command("vacuum", help="checkpoint the WAL and reclaim free pages")
+@click.option('--full', is_flag=True, help='Rebuild the whole file instead of an incremental vacuum')
+def db_vacuum_cmd(full):
+    try:
+        if not get_sqlite_path():
+            from sqlalchemy import text
+            with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(text("VACUUM (FULL, ANALYZE)" if full else "VACUUM (ANALYZE)"))
+            click.secho("✓ VACUUM complete", fg="green")
+            return
+        conn = get_connection()
+        before = lite.database_stats(conn)
+        lite.checkpoint(conn)
+        lite.vacuum(conn, full=full)
+        lite.checkpoint(conn)
+        after = lite.database_stats(conn)
+        # A vacuum can leave the file as it was, or a page or two larger
+        freed = max(before["page_count"] - after["page_count"], 0) * after["page_size"]
+        click.echo(f"Pages: {before['page_count']} -> {after['page_count']} ({freed / 1024:.0f} KiB freed)")
+        click.echo(f"auto_vacuum = {after['auto_vacuum']}")
+        click.secho("✓ Vacuum complete", fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("export", help="stream every context, collection, spark and membership to a dump file")
+@click.argument('path', type=click.Path())
+@click.option('--format', 'fmt', type=click.Choice(["jsonl", "csv", "parquet"]), help='Default: from the file extension (jsonl otherwise)')
+@click.option('--compress', type=click.Choice(["none", "gzip", "zstd"]), help='Default: from the extension (.gz, .zst)')
+@click.option('--chunk-size', default=10000, show_default=True, type=click.IntRange(min=1), help='Rows read and written at a time')
+@click.option('--resume', is_flag=True, help='Continue an interrupted export from its checkpoint')
+def export_cmd(path, fmt, compress, chunk_size, resume):
+    try:
+        from db import transfer
+        fmt, compress = transfer.detect_format(path, fmt, compress)
+        counts = run_transfer(transfer.export_store(get_engine(), path, fmt, compress, chunk_size, resume))
+        click.secho(f"✓ Exported {counts} to {path}", fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@click.command("import", help="load a dump written by export, giving its rows new IDs")
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--format', 'fmt', type=click.Choice(["jsonl", "csv", "parquet"]), help='Default: from the file extension (jsonl otherwise)')
+@click.option('--compress', type=click.Choice(["none", "gzip", "zstd"]), help='Default: from the extension (.gz, .zst)')
+@click.option('--chunk-size', default=10000, show_default=True, type=click.IntRange(min=1), help='Rows per transaction')
+@click.option('--resume', is_flag=True, help='Continue an interrupted import from its checkpoint')
+def import_cmd(path, fmt, compress, chunk_size, resume):
+    try:
+        from db import transfer
+        fmt, compress = transfer.detect_format(path, fmt, compress)
+        counts = run_transfer(transfer.import_store(get_engine(), path, fmt, compress, chunk_size, resume))
+        click.secho(f"✓ Imported {counts} from {path}", fg="green")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+def run_transfer(chunks):
+    """Drain an export/import generator, showing progress on a terminal; returns a summary."""
+    started = time.perf_counter()
+    progress = sys.stderr.isatty()
+    counts = {}
+    for table, rows in chunks:
+        counts[table] = rows
+        if progress:
+            click.echo(f"\r{table}: {rows:,} rows", nl=False, err=True)
+    if progress and counts:
+        click.echo(err=True)
+    elapsed = time.perf_counter() - started
+    nouns = {"contexts": "context", "collections": "collection", "sparks": "spark", "spark_collections": "membership"}
+    summary = ", ".join(plural(counts.get(table, 0), noun) for table, noun in nouns.items())
+    return f"{summary} in {elapsed:.2f}s"
+
+@click.group("daemon", help="run a background server that keeps the database warm for add/list/search/related")
+def daemon_cmd():
+    pass
+
+@daemon_cmd.command("start", help="start the daemon (in the background unless --foreground)")
+@click.option('--foreground', is_flag=True, help='Run in this process instead of detaching')
+@click.option('--workers', default=4, show_default=True, type=click.IntRange(min=1), help='Database worker threads')
+def daemon_start_cmd(foreground, workers):
+    import daemon
+    try:
+        if daemon.request({"op": "ping"}):
+            click.secho(f"✓ Daemon already running on {daemon.socket_path()}", fg="green")
+            return
+        if foreground:
+            click.echo(f"Listening on {daemon.socket_path()}")
+            daemon.serve(workers)
+            return
+
+        import subprocess
+        log_path = os.path.join(os.path.dirname(daemon.socket_path()), "daemon.log")
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, "a") as log:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "daemon", "start", "--foreground", "--workers", str(workers)],
+                stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+            )
+        for _ in range(50):
+            reply = daemon.request({"op": "ping"})
+            if reply:
+                click.secho(f"✓ Daemon started (pid {reply['pid']}) on {daemon.socket_path()}", fg="green")
+                return
+            time.sleep(0.1)
+        click.secho(f"✗ Daemon did not start; see {log_path}", fg="red")
+    except Exception as e:
+        click.secho(f"✗ {str(e)}", fg="red")
+
+@daemon_cmd.command("stop", help="stop the daemon")
+def daemon_stop_cmd():
+    import daemon
+    if daemon.request({"op": "shutdown"}):
+        click.secho("✓ Daemon stopped", fg="green")
+    else:
+        click.secho("Daemon is not running", fg="yellow")
+
+@daemon_cmd.command("status", help="show whether the daemon is running")
+def daemon_status_cmd():
+    import daemon
+    reply = daemon.request({"op": "ping"})
+    if reply:
+        click.secho(f"✓ Running (pid {reply['pid']}) on {daemon.socket_path()}", fg="green")
+    else:
+        click.secho("Daemon is not running", fg="yellow")
+
+@daemon_cmd.command("stats", help="show per-command latency measured by the daemon")
+def daemon_stats_cmd():
+    import daemon
+    stats = daemon.request({"op": "stats"})
+    if not stats:
+        click.secho("Daemon is not running", fg="yellow")
+        return
+    click.echo(f"pid {stats['pid']}, up {stats['uptime_s']:.0f}s, {stats['workers']} workers")
+    if not stats["commands"]:
+        click.echo("No commands served yet")
+    for name, command in sorted(stats["commands"].items()):
+        click.echo(
+            f"{name:<8} {command['count']:>7} calls  {command['errors']} errors  "
+            f"mean {command['mean_ms']:.2f}ms  p50 {command['p50_ms']:.2f}ms  "
+            f"p99 {command['p99_ms']:.2f}ms  max {command['max_ms']:.2f}ms"
+        )
+
 # Add all commands to CLI
 cli.add_command(create_context_cmd)
 cli.add_command(add_spark)
 cli.add_command(list_sparks)
 cli.add_command(collections_cmd)
 cli.add_command(search_sparks_cmd)
+cli.add_command(related_sparks_cmd)
+cli.add_command(dedupe_cmd)
+cli.add_command(stats_cmd)
+cli.add_command(complete_cmd)
 cli.add_command(show_spark)
 cli.add_command(edit_spark)
+cli.add_command(history_cmd)
+cli.add_command(revert_cmd)
 cli.add_command(delete_spark_cmd)
+cli.add_command(undo_cmd)
+cli.add_command(gc_cmd)
+cli.add_command(export_cmd)
+cli.add_command(import_cmd)
+cli.add_command(sync_cmd)
+cli.add_command(db_cmd)
+cli.add_command(daemon_cmd)
 
 if __name__ == "__main__":
-    cli()
\ No newline at end of file
+    cli(complete_var=COMPLETE_VAR)
\ No newline at end of file
@@ -0,0 +1,419 @@
+# daemon.py
+# Optional long-running `spark daemon` that keeps SQLite connections (with
+# their PRAGMAs applied and page cache/mmap warm), the context cache and the
+# FTS index hot, and serves the hot commands over a Unix domain socket.
+#
+# Protocol: the client sends one JSON line, {"op": "run", "argv": [...],
+# "cwd": ..., "database": ..., "pragmas": {...}, "timezone": ...}, and reads
+# JSON lines back: {"out": text, "fg": color} chunks followed by
+# {"exit": code}, or a single {"fallback": true} when the command should run
+# in-process instead.
+#
+# The client half (run_via_daemon) only needs the stdlib, db.storage and the
+# context cache, so cli.py can try it before importing click or SQLAlchemy.
+import json
+import os
+import socket
+import sys
+
+# Commands the daemon serves; everything else always runs in-process
+SUPPORTED_COMMANDS = {"add", "list", "search", "related", "complete"}
+# Options that need the caller's stdin or files, or print click's own output
+LOCAL_OPTIONS = {"--help", "--stdin", "--file", "-f"}
+CONNECT_TIMEOUT = 0.5
+LATENCY_WINDOW = 1000
+
+ANSI_COLORS = {"red": "\x1b[31m", "green": "\x1b[32m", "yellow": "\x1b[33m"}
+ANSI_RESET = "\x1b[0m"
+
+def socket_path():
+    path = os.environ.get("SPARK_DAEMON_SOCKET")
+    if path:
+        return path
+    from utils.context_cache import cache_path
+    return os.path.join(os.path.dirname(cache_path()), "daemon.sock")
+
+def _connect(timeout=CONNECT_TIMEOUT):
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+def request(message):
+    """Send a control message (ping, stats, shutdown) and return the reply, or None if no daemon."""
+    sock = _connect()
+    if sock is None:
+        return None
+    with sock, sock.makefile("rw", encoding="utf-8") as stream:
+        stream.write(json.dumps(message) + "\n")
+        stream.flush()
+        line = stream.readline()
+    return json.loads(line) if line else None
+
+def _resolve_store():
+    """(database path, pragmas) for the current directory, or None if the store isn't SQLite."""
+    from db import storage
+    from utils import load_dot_spark
+
+    dot_spark, dot_config = load_dot_spark()
+    url = storage.get_database_url(dot_config, dot_spark.parent if dot_spark else None)
+    path = storage.sqlite_path(url)
+    if path is None or path == ":memory:":
+        return None
+    return os.path.abspath(path), storage.sqlite_pragmas((dot_config or {}).get("sqlite_profile"))
+
+def run_via_daemon(argv):
+    """Run a CLI command on a running daemon.
+
+    Returns the exit code, or None if the caller should run the command
+    in-process (no daemon, unsupported command or store, or the daemon
+    asked for a fallback).
+    """
+    if os.environ.get("SPARK_NO_DAEMON") or not argv or argv[0] not in SUPPORTED_COMMANDS:
+        return None
+    from db.instrument import trace_setting
+    if trace_setting()[0] or os.environ.get("SPARK_PSTATS"):
+        # Profiling measures the in-process command
+        return None
+    if LOCAL_OPTIONS.intersection(argv) or any(arg.startswith("--file=") for arg in argv):
+        return None
+    try:
+        store = _resolve_store()
+    except Exception:
+        return None
+    if store is None:
+        return None
+    sock = _connect()
+    if sock is None:
+        return None
+
+    database, pragmas = store
+    message = {
+        "op": "run", "argv": argv, "cwd": os.getcwd(), "database": database, "pragmas": pragmas,
+        # Dates are read and shown in the caller's timezone, not the daemon's
+        "timezone": os.environ.get("SPARK_TIMEZONE"),
+    }
+    colorize = sys.stdout.isatty()
+    with sock, sock.makefile("rw", encoding="utf-8") as stream:
+        stream.write(json.dumps(message) + "\n")
+        stream.flush()
+        for line in stream:
+            reply = json.loads(line)
+            if reply.get("fallback"):
+                return None
+            if "out" in reply:
+                try:
+                    sys.stdout.write(_render(reply["out"], reply.get("fg"), colorize) + "\n")
+                except BrokenPipeError:
+                    # The reader went away; closing the socket stops the daemon's query
+                    devnull = os.open(os.devnull, os.O_WRONLY)
+                    os.dup2(devnull, sys.stdout.fileno())
+                    return 0
+            if "exit" in reply:
+                sys.stdout.flush()
+                return reply["exit"]
+    sys.stderr.write("✗ spark daemon closed the connection\n")
+    return 1
+
+def _render(text, fg, colorize):
+    if not colorize:
+        import re
+        return re.sub(r"\x1b\[[0-9;]*m", "", text)
+    if fg in ANSI_COLORS:
+        return f"{ANSI_COLORS[fg]}{text}{ANSI_RESET}"
+    return text
+
+# Server
+
+class _Fallback(Exception):
+    pass
+
+class _ClientGone(Exception):
+    pass
+
+class DaemonServer:
+    def __init__(self, workers=4):
+        import threading
+        from collections import defaultdict, deque
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spark-db")
+        self.local = threading.local()
+        # The context cache is a plain dict shared by all workers
+        self.context_lock = threading.Lock()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.started = None
+        self.stopping = None
+
+    # Connections are per worker thread, per database and PRAGMA profile
+    def connection(self, database, pragmas):
+        from db import lite
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        key = (database, tuple(sorted(pragmas.items())))
+        if key not in connections:
+            connections[key] = lite.connect(database, pragmas=pragmas)
+        return connections[key]
+
+    def run_command(self, message, emit):
+        import click
+        import cli
+        from utils import context_cache
+
+        name, args = message["argv"][0], message["argv"][1:]
+        try:
+            try:
+                params = cli.cli.commands[name].make_context(name, list(args)).params
+            except (click.exceptions.ClickException, click.exceptions.Exit):
+                # Let the in-process CLI print usage errors exactly as it always does
+                raise _Fallback()
+            with self.context_lock:
+                context_cache.refresh()
+            conn = self.connection(message["database"], message["pragmas"])
+            try:
+                code = getattr(self, f"do_{name}")(conn, message, params, emit)
+            except (_Fallback, _ClientGone):
+                raise
+            except Exception as e:
+                self.errors[name] += 1
+                emit({"out": f"✗ {str(e)}", "fg": "red"})
+                code = 0
+            emit({"exit": code})
+        except _Fallback:
+            emit({"fallback": True})
+
+    def do_add(self, conn, message, params, emit):
+        from db import lite
+        from utils import get_current_context_lite
+
+        if params["from_stdin"] or params["from_file"] or not params["content"] or (params["merge"] and not params["dedupe"]):
+            raise _Fallback()
+        with self.context_lock:
+            context_id, dot_config = get_current_context_lite(conn, message["database"], message["cwd"])
+        collection = params["collection"] or dot_config["default_collection"]
+        if params["dedupe"]:
+            import cli
+            from db.dedupe import add_spark as add_unique_spark
+            spark_id, match = add_unique_spark(
+                conn, params["content"], context_id, collection, params["threshold"], params["merge"]
+            )
+            if match:
+                emit({"out": cli.format_duplicate(match, collection if params["merge"] else None), "fg": "yellow"})
+                return 0
+        else:
+            spark_id = lite.add_spark(conn, params["content"], context_id, collection)
+        emit({"out": f"✓ Spark #{spark_id} added successfully", "fg": "green"})
+        return 0
+
+    def do_list(self, conn, message, params, emit):
+        import cli
+        from db.query import local_timezone
+        filters = cli.list_filters(
+            params["collection"], params["today"], params["context"],
+            params["week"], params["since"], params["until"],
+        )
+        sparks = cli.select_sparks_lite(
+            conn, message["database"], params["query"], filters,
+            params["limit"], params["after_id"], params["reverse"],
+            cwd=message["cwd"], timezone=message.get("timezone"), context_lock=self.context_lock,
+        )
+        tz = local_timezone(message.get("timezone"))
+        shown = 0
+        try:
+            while True:
+                rows = sparks.fetchmany(200)
+                if not rows:
+                    break
+                emit({"out": "\n".join(cli.format_spark(spark, tz) for spark in rows)})
+                shown += len(rows)
+        finally:
+            sparks.close()
+        if not shown:
+            emit({"out": "No sparks found", "fg": "yellow"})
+        return 0
+
+    def do_search(self, conn, message, params, emit):
+        import cli
+        from db import lite
+        from utils import get_current_context_lite
+
+        with self.context_lock:
+            context_id = get_current_context_lite(conn, message["database"], message["cwd"])[0]
+        if params["semantic"]:
+            # The model and numpy stay loaded between requests
+            from db import semantic
+            matches = semantic.search(conn, params["query"], limit=params["limit"], context_id=context_id)
+            if not matches:
+                emit({"out": f"No sparks found for '{params['query']}'", "fg": "yellow"})
+            for spark, score in matches:
+                emit({"out": cli.format_match(spark, score)})
+            return 0
+        sparks = lite.search_sparks(conn, context_id, params["query"], limit=params["limit"])
+        if not sparks:
+            emit({"out": f"No sparks found for '{params['query']}'", "fg": "yellow"})
+        for spark in sparks:
+            emit({"out": f"{spark.id}: {cli.highlight(spark.snippet)}"})
+        return 0
+
+    def do_related(self, conn, message, params, emit):
+        import cli
+        from db import semantic
+        from utils import get_current_context_lite
+
+        with self.context_lock:
+            context_id = get_current_context_lite(conn, message["database"], message["cwd"])[0]
+        matches = semantic.related(conn, params["spark_id"], limit=params["limit"], context_id=context_id)
+        if not matches:
+            emit({"out": f"No sparks related to #{params['spark_id']}", "fg": "yellow"})
+        for spark, score in matches:
+            emit({"out": cli.format_match(spark, score)})
+        return 0
+
+    def do_complete(self, conn, message, params, emit):
+        import cli
+        from db import complete
+
+        if params["shell"]:
+            raise _Fallback()
+        if params["collection_names"]:
+            lines = complete.collections(conn, message["database"], params["query"], params["limit"])
+        else:
+            lines = [
+                cli.format_completion_line(*spark)
+                for spark in complete.sparks(conn, message["database"], params["query"], params["limit"])
+            ]
+        if lines:
+            emit({"out": "\n".join(lines)})
+        return 0
+
+    def stats(self):
+        import time
+        commands = {}
+        for name, window in self.latencies.items():
+            ordered = sorted(window)
+            pick = lambda pct: ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * 1000
+            commands[name] = {
+                "count": self.counts[name],
+                "errors": self.errors[name],
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": pick(50),
+                "p99_ms": pick(99),
+                "max_ms": ordered[-1] * 1000,
+            }
+        return {
+            "pid": os.getpid(),
+            "uptime_s": time.time() - self.started,
+            "workers": self.workers,
+            "commands": commands,
+        }
+
+    async def handle_client(self, reader, writer):
+        import asyncio
+        import threading
+        import time
+
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            op = message.get("op")
+            if op == "ping":
+                writer.write(json.dumps({"ok": True, "pid": os.getpid()}).encode() + b"\n")
+            elif op == "stats":
+                writer.write(json.dumps(self.stats()).encode() + b"\n")
+            elif op == "shutdown":
+                writer.write(json.dumps({"ok": True}).encode() + b"\n")
+                self.stopping.set()
+            elif op == "run":
+                await self.handle_run(message, writer, asyncio, threading, time)
+                return
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_run(self, message, writer, asyncio, threading, time):
+        loop = asyncio.get_running_loop()
+        # Bounded queue: a slow reader (e.g. `| less`) pauses the worker instead of buffering rows
+        queue = asyncio.Queue(maxsize=16)
+        client_gone = threading.Event()
+        done = object()
+
+        def emit(reply):
+            if client_gone.is_set():
+                raise _ClientGone()
+            asyncio.run_coroutine_threadsafe(queue.put(reply), loop).result()
+
+        def work():
+            try:
+                self.run_command(message, emit)
+            except _ClientGone:
+                pass
+            finally:
+                asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+        started = time.perf_counter()
+        future = loop.run_in_executor(self.executor, work)
+        while True:
+            reply = await queue.get()
+            if reply is done:
+                break
+            if client_gone.is_set():
+                continue
+            try:
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                client_gone.set()
+        await future
+        name = message["argv"][0]
+        self.counts[name] += 1
+        self.latencies[name].append(time.perf_counter() - started)
+        writer.close()
+
+    async def serve(self, path):
+        import asyncio
+        import signal
+        import time
+
+        self.started = time.time()
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.stopping.set)
+
+        server = await asyncio.start_unix_server(self.handle_client, path=path)
+        os.chmod(path, 0o600)
+        async with server:
+            await self.stopping.wait()
+        self.executor.shutdown(wait=True)
+
+def serve(workers=4):
+    """Run the daemon in the foreground until SIGTERM/SIGINT or a shutdown request."""
+    import asyncio
+
+    path = socket_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        if request({"op": "ping"}):
+            raise RuntimeError(f"spark daemon already running on {path}")
+        os.unlink(path)  # stale socket from a daemon that didn't exit cleanly
+    try:
+        asyncio.run(DaemonServer(workers).serve(path))
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,476 @@
+# complete.py
+# The completion index behind shell completion of spark ids and collection
+# names and `spark complete`: fixed-width (id, collection ids, uid, title)
+# records sorted by id, plus the titles again, case-folded, in a file of
+# their own. Both are memory-mapped and searched in place, so a lookup reads
+# a few pages instead of the store.
+#
+# Id prefixes are binary searches (typing 12 covers 12, 120-129, 1200-1299,
+# ...). Text is searched for in the folded titles from their newest end,
+# stopping at the limit: substrings first, then the query's characters in
+# order ("cchtok" finds "cache session tokens") among the newest
+# FUZZY_WINDOW sparks. Keeping the titles apart from the binary fields means
+# every byte searched is text, and folding them up front spares the
+# searches re.IGNORECASE, which is an order of magnitude slower.
+#
+# There is one pair of files per database next to the context cache. They
+# follow the sync change log like db.semantic and db.dedupe: every lookup
+# first applies the changes logged since the seq in the header. Edits
+# overwrite their record in place, new sparks are appended, and deletes
+# leave a tombstone (found by searching for the uid) until a quarter of the
+# records are tombstones and the files are compacted. A gap in the log, a
+# different database file or an id below the newest one rebuild them from
+# scratch. Lookups hold a shared flock and refreshes an exclusive one, so a
+# lookup never sees a half-applied refresh.
+#
+# SQLite stores only, through db.lite connections.
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+from contextlib import contextmanager
+
+MAGIC = b"SPKC"
+VERSION = 1
+# magic, version, change log seq, database inode, records, tombstones
+HEADER = struct.Struct("<4sIQQII")
+# Collection ids kept per spark (0: empty slot); a tombstone has DELETED in the first
+COLLECTIONS = 3
+DELETED = 0xFFFFFFFF
+# Title bytes; at most TITLE - 1 of text, padded with newlines, so a pattern
+# that can't cross a newline never runs from one title into the next
+TITLE = 48
+# id, collection ids, uid key, title
+RECORD = struct.Struct(f"<I{COLLECTIONS}I16s{TITLE}s")
+UID_OFFSET = 4 + 4 * COLLECTIONS
+LIMIT = 50
+# Titles the scattered-character search covers in its first step back from
+# the newest; each step doubles it
+FIRST_CHUNK = 256
+MAX_CHUNK = 65536
+# Scattered-character matching costs several times a substring search (it
+# restarts at every occurrence of the first character), so it only looks at
+# the newest titles
+FUZZY_WINDOW = 50_000
+# More deletes than this are matched in one pass over the records instead
+# of one search per uid
+FIND_DELETES = 64
+BATCH = 500
+
+def index_path(database):
+    """The records file for `database`; the folded titles sit next to it (see text_path)."""
+    from utils.context_cache import cache_path
+    name = hashlib.blake2b(os.path.abspath(database).encode(), digest_size=8).hexdigest()
+    return os.path.join(os.path.dirname(cache_path()), f"complete-{name}.idx")
+
+def text_path(path):
+    return path[:-len(".idx")] + ".txt"
+
+def uid_key(uid):
+    """16 bytes identifying a spark's uid: the uid itself when it is 32 hex digits."""
+    try:
+        key = bytes.fromhex(uid)
+    except (TypeError, ValueError):
+        key = b""
+    return key if len(key) == 16 else hashlib.blake2b(str(uid).encode(), digest_size=16).digest()
+
+def title(text):
+    text = " ".join(text.split()).encode()[:TITLE - 1]
+    # Cut at a character boundary
+    return text.decode(errors="ignore").encode().ljust(TITLE, b"\n")
+
+def pack(spark_id, uid, content, collection_ids):
+    """(record, folded title) for a spark."""
+    slots = (list(collection_ids) + [0] * COLLECTIONS)[:COLLECTIONS]
+    return RECORD.pack(spark_id, *slots, uid_key(uid), title(content)), title(content.casefold())
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH):
+        yield values[start:start + BATCH]
+
+def _map(file):
+    size = os.fstat(file.fileno()).st_size
+    return (mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None), size
+
+class Index:
+    """Read-only maps of an index's records and folded titles."""
+
+    def __init__(self, file, text_file):
+        self.map, size = _map(file)
+        self.text, text_size = _map(text_file)
+        magic, version, self.seq, self.inode, self.count, self.tombstones = (
+            HEADER.unpack_from(self.map) if size >= HEADER.size else (b"", 0, 0, 0, 0, 0)
+        )
+        self.valid = (
+            magic == MAGIC and version == VERSION
+            and size >= self.offset(self.count) and text_size == self.count * TITLE
+        )
+
+    def close(self):
+        for mapped in (self.map, self.text):
+            if mapped is not None:
+                mapped.close()
+
+    def current(self, state):
+        seq, _, inode = state
+        return self.valid and self.seq == seq and self.inode == inode
+
+    def offset(self, position):
+        return HEADER.size + position * RECORD.size
+
+    def spark_id(self, position):
+        return struct.unpack_from("<I", self.map, self.offset(position))[0]
+
+    def deleted(self, position):
+        return struct.unpack_from("<I", self.map, self.offset(position) + 4)[0] == DELETED
+
+    def record(self, position):
+        start = self.offset(position)
+        return self.map[start:start + RECORD.size]
+
+    def folded(self, position):
+        return self.text[position * TITLE:(position + 1) * TITLE]
+
+    def entry(self, position):
+        spark_id, *slots, _, text = RECORD.unpack_from(self.map, self.offset(position))
+        return spark_id, text.rstrip(b"\n").decode(errors="replace"), [slot for slot in slots if slot]
+
+    def collections(self):
+        """{id: name} from the block after the records."""
+        names = {}
+        for line in self.map[self.offset(self.count):].decode().splitlines():
+            collection_id, _, name = line.partition("\t")
+            names[int(collection_id)] = name
+        return names
+
+    def last_id(self):
+        return self.spark_id(self.count - 1) if self.count else 0
+
+    def bisect(self, spark_id):
+        """The first position whose id is at least `spark_id`."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.spark_id(middle) < spark_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, spark_id):
+        position = self.bisect(spark_id)
+        return position if position < self.count and self.spark_id(position) == spark_id else None
+
+    def find_uids(self, keys):
+        """Positions of the records holding these uid keys."""
+        if len(keys) > FIND_DELETES:
+            return [
+                position for position in range(self.count)
+                if self.map[self.offset(position) + UID_OFFSET:self.offset(position) + UID_OFFSET + 16] in keys
+            ]
+        positions = []
+        end = self.offset(self.count)
+        for key in keys:
+            start = HEADER.size
+            while True:
+                found = self.map.find(key, start, end)
+                if found < 0:
+                    break
+                position, column = divmod(found - HEADER.size, RECORD.size)
+                if column == UID_OFFSET:
+                    positions.append(position)
+                    break
+                start = found + 1
+        return positions
+
+    # Lookups return live positions, newest first
+
+    def newest(self, limit):
+        found = []
+        position = self.count - 1
+        while position >= 0 and len(found) < limit:
+            if not self.deleted(position):
+                found.append(position)
+            position -= 1
+        return found
+
+    def by_id_prefix(self, prefix, limit):
+        """The id `prefix` itself, then ids that start with it, newest first."""
+        value = int(prefix)
+        exact = self.find(value)
+        found = [exact] if exact is not None and not self.deleted(exact) else []
+        ranges = []
+        low, high = value * 10, value * 10 + 9
+        while value and low <= self.last_id():
+            ranges.append((low, high))
+            low, high = low * 10, high * 10 + 9
+        for low, high in reversed(ranges):
+            position = self.bisect(high + 1) - 1
+            first = self.bisect(low)
+            while position >= first and len(found) < limit:
+                if not self.deleted(position):
+                    found.append(position)
+                position -= 1
+        return found[:limit]
+
+    def containing(self, needle, limit):
+        """Positions whose folded title contains `needle`, newest first."""
+        found = []
+        end = self.count * TITLE
+        while len(found) < limit:
+            # rfind's skip-table search beats a regex here and walks back from the newest
+            at = self.text.rfind(needle, 0, end)
+            if at < 0:
+                break
+            position = at // TITLE
+            if not self.deleted(position):
+                found.append(position)
+            end = position * TITLE
+        return found
+
+    def scattered(self, text, limit, seen):
+        """Positions among the newest FUZZY_WINDOW whose folded title has `text`'s characters in order."""
+        # Each gap skips only bytes that can't be the next character, so the
+        # first occurrence is taken and nothing is backtracked
+        parts = [re.escape(text[0].encode())]
+        for character in text[1:]:
+            encoded = character.encode()
+            gap = b"[^\n]*?" if len(encoded) > 1 else b"[^" + re.escape(encoded) + b"\n]*"
+            parts.append(gap + re.escape(encoded))
+        pattern = re.compile(b"".join(parts))
+        found = []
+        floor = max(0, self.count - FUZZY_WINDOW)
+        stop, size = self.count, FIRST_CHUNK
+        while stop > floor and len(found) < limit:
+            first = max(floor, stop - size)
+            chunk = []
+            start, end = first * TITLE, stop * TITLE
+            while True:
+                match = pattern.search(self.text, start, end)
+                if match is None:
+                    break
+                position = match.start() // TITLE
+                chunk.append(position)
+                start = (position + 1) * TITLE
+            found.extend(position for position in reversed(chunk) if position not in seen and not self.deleted(position))
+            stop, size = first, min(size * 2, MAX_CHUNK)
+        return found[:limit]
+
+    def by_text(self, text, limit):
+        text = " ".join(text.casefold().split())
+        found = self.containing(text.encode(), limit)
+        if len(found) < limit and len(text) > 1:
+            found += self.scattered(text, limit - len(found), set(found))
+        return found
+
+# Keeping the files current
+
+def _state(conn, database):
+    # Separate subqueries: SQLite only answers a lone MIN or MAX from the index
+    seq, oldest = conn.execute(
+        "SELECT COALESCE((SELECT MAX(seq) FROM changes), 0), (SELECT MIN(seq) FROM changes)"
+    ).fetchone()
+    return seq, oldest, os.stat(database).st_ino
+
+def _collections_block(conn):
+    rows = conn.execute("SELECT id, name FROM collections ORDER BY name")
+    return "".join(f"{row[0]}\t{' '.join(row[1].split())}\n" for row in rows).encode()
+
+def _header(state, count, tombstones):
+    seq, _, inode = state
+    return HEADER.pack(MAGIC, VERSION, seq, inode, count, tombstones)
+
+def _write(file, text_file, rows, block, state):
+    """Replace both files' contents; the header is only valid once everything else is written."""
+    for opened_file in (file, text_file):
+        opened_file.seek(0)
+        opened_file.truncate()
+    file.write(bytes(HEADER.size))
+    count = 0
+    for record, folded in rows:
+        file.write(record)
+        text_file.write(folded)
+        count += 1
+    file.write(block)
+    text_file.flush()
+    file.seek(0)
+    file.write(_header(state, count, 0))
+    file.flush()
+
+def rebuild(conn, file, text_file, state):
+    sparks = conn.execute("SELECT id, uid, substr(content, 1, 200) FROM sparks WHERE deleted_at IS NULL ORDER BY id")
+    memberships = conn.execute(
+        "SELECT spark_id, collection_id FROM spark_collections ORDER BY spark_id, collection_id"
+    )
+
+    def rows():
+        member = memberships.fetchone()
+        for spark_id, uid, content in sparks:
+            while member is not None and member[0] < spark_id:
+                member = memberships.fetchone()
+            collection_ids = []
+            while member is not None and member[0] == spark_id:
+                collection_ids.append(member[1])
+                member = memberships.fetchone()
+            yield pack(spark_id, uid, content, collection_ids)
+
+    _write(file, text_file, rows(), _collections_block(conn), state)
+
+def _changed_sparks(conn, since, up_to):
+    """({id: (record, folded title)} for sparks added or edited in the log range, uid keys of deleted sparks)."""
+    upserts, deletes, members = set(), set(), set()
+    for table, key, op in conn.execute(
+        "SELECT table_name, row_key, op FROM changes WHERE seq > ? AND seq <= ?", (since, up_to)
+    ):
+        if table == "sparks":
+            (upserts if op == "upsert" else deletes).add(key)
+        elif table == "spark_collections":
+            members.add(int(key.split("/")[0]))
+    rows = {}
+    for column, keys in (("uid", upserts), ("id", members)):
+        for chunk in _chunks(keys):
+            for row in conn.execute(
+                f"SELECT id, uid, substr(content, 1, 200), deleted_at IS NOT NULL FROM sparks "
+                f"WHERE {column} IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ):
+                # Soft deleting is logged as an update
+                if row[3]:
+                    deletes.add(row[1])
+                else:
+                    rows[row[0]] = row[:3]
+    collection_ids = {spark_id: [] for spark_id in rows}
+    for chunk in _chunks(rows):
+        for spark_id, collection_id in conn.execute(
+            "SELECT spark_id, collection_id FROM spark_collections "
+            f"WHERE spark_id IN ({', '.join('?' * len(chunk))}) ORDER BY spark_id, collection_id",
+            chunk,
+        ):
+            collection_ids[spark_id].append(collection_id)
+    packed = {spark_id: pack(spark_id, uid, content, collection_ids[spark_id]) for spark_id, uid, content in rows.values()}
+    return packed, {uid_key(uid) for uid in deletes}
+
+def _is_tombstone(record):
+    return struct.unpack_from("<I", record, 4)[0] == DELETED
+
+def refresh(conn, file, text_file, index, state):
+    """Bring the files up to date with the change log; the caller holds the exclusive lock."""
+    seq, oldest, inode = state
+    if not index.valid or index.inode != inode or index.seq > seq or (oldest is not None and oldest > index.seq + 1):
+        return rebuild(conn, file, text_file, state)
+
+    changed, deletes = _changed_sparks(conn, index.seq, seq)
+    patches = {}
+    for position in index.find_uids(deletes) if deletes else ():
+        record = bytearray(index.record(position))
+        struct.pack_into("<I", record, 4, DELETED)
+        patches[position] = (bytes(record), index.folded(position))
+    appended = []
+    last_id = index.last_id()
+    for spark_id in sorted(changed):
+        position = index.find(spark_id)
+        if position is not None:
+            patches[position] = changed[spark_id]
+        elif spark_id > last_id:
+            appended.append(changed[spark_id])
+            last_id = spark_id
+        else:
+            return rebuild(conn, file, text_file, state)
+
+    tombstones = index.tombstones + sum(
+        _is_tombstone(record) - index.deleted(position) for position, (record, _) in patches.items()
+    )
+    count = index.count + len(appended)
+    block = _collections_block(conn)
+    if tombstones * 4 > count:
+        live = [
+            row for row in (
+                patches.get(position) or (index.record(position), index.folded(position))
+                for position in range(index.count)
+            )
+            if not _is_tombstone(row[0])
+        ]
+        return _write(file, text_file, live + appended, block, state)
+
+    # Invalidate first, so a crash part-way leaves files that get rebuilt
+    file.seek(0)
+    file.write(bytes(HEADER.size))
+    file.flush()
+    for position, (record, folded) in patches.items():
+        file.seek(index.offset(position))
+        file.write(record)
+        text_file.seek(position * TITLE)
+        text_file.write(folded)
+    file.seek(index.offset(index.count))
+    text_file.seek(index.count * TITLE)
+    for record, folded in appended:
+        file.write(record)
+        text_file.write(folded)
+    file.write(block)
+    file.truncate()
+    text_file.flush()
+    file.seek(0)
+    file.write(_header(state, count, tombstones))
+    file.flush()
+
+@contextmanager
+def opened(conn, database):
+    """Yield the up-to-date Index of `database`, under a shared lock."""
+    path = index_path(database)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    flags = os.O_RDWR | os.O_CREAT
+    with open(os.open(path, flags, 0o644), "r+b") as file, open(os.open(text_path(path), flags, 0o644), "r+b") as text_file:
+        # The records file's lock covers both
+        fcntl.flock(file, fcntl.LOCK_SH)
+        state = _state(conn, database)
+        index = Index(file, text_file)
+        if not index.current(state):
+            index.close()
+            fcntl.flock(file, fcntl.LOCK_EX)
+            index = Index(file, text_file)
+            # Another process may have refreshed them while we waited
+            if not index.current(state):
+                refresh(conn, file, text_file, index, state)
+                index.close()
+                index = Index(file, text_file)
+            fcntl.flock(file, fcntl.LOCK_SH)
+        try:
+            yield index
+        finally:
+            index.close()
+
+# Lookups
+
+def sparks(conn, database, incomplete="", limit=LIMIT):
+    """[(id, title, collection names)] for ids starting with `incomplete`, or titles matching it.
+
+    Digits complete ids (the id itself first, then the newest); anything
+    else matches titles, ignoring case, substrings before scattered
+    characters. An empty query gives the newest sparks.
+    """
+    incomplete = incomplete.strip()
+    with opened(conn, database) as index:
+        if not incomplete:
+            positions = index.newest(limit)
+        elif incomplete.isascii() and incomplete.isdigit():
+            positions = index.by_id_prefix(incomplete, limit) if incomplete[0] != "0" else []
+        else:
+            positions = index.by_text(incomplete, limit)
+        names = index.collections() if positions else {}
+        results = []
+        for position in positions:
+            spark_id, text, collection_ids = index.entry(position)
+            results.append((spark_id, text, [names[i] for i in collection_ids if i in names]))
+        return results
+
+def collections(conn, database, incomplete="", limit=LIMIT):
+    """Collection names starting with `incomplete`, then names containing it (ignoring case)."""
+    folded = incomplete.casefold()
+    with opened(conn, database) as index:
+        names = sorted(index.collections().values())
+    starting = [name for name in names if name.casefold().startswith(folded)]
+    containing = [name for name in names if folded in name.casefold() and not name.casefold().startswith(folded)]
+    return (starting + containing)[:limit]
@@ -0,0 +1,328 @@
+# dedupe.py
+# Duplicate and near-duplicate sparks, behind `spark add --dedupe` and
+# `spark dedupe`.
+#
+# Similarity is the Jaccard similarity of the character 5-grams of the
+# normalized content (case, punctuation and whitespace folded), so "Cache
+# auth tokens!" and "cache the auth tokens" score high and a reworded idea
+# still matches. Finding candidates is sub-linear: each spark's MinHash
+# signature (PERMUTATIONS minimums) is cut into BANDS bands, and each band is
+# hashed with the context id into a bucket in spark_lsh. Sparks sharing a
+# bucket are candidates; a new spark only reads its own BANDS buckets and
+# then scores the few candidates exactly. With 8 bands of 3 rows, pairs at
+# 0.7 similarity share a bucket 96% of the time and pairs at 0.3 only 20%.
+#
+# The index follows the sync change log like db.semantic does: it is built
+# on first use, then every check first indexes the sparks added or edited
+# since the previous one. Adds without --dedupe cost nothing extra. Deletes
+# are handled by the spark_lsh_ad trigger.
+#
+# SQLite stores only, through db.lite connections.
+import hashlib
+import re
+import unicodedata
+from functools import lru_cache
+
+from db.lite import deletion_stamp, get_or_create_collection_id, insert_spark
+from db.sync import get_state, last_seq, set_state
+
+PERMUTATIONS = 24
+BANDS = 8
+ROWS = PERMUTATIONS // BANDS
+SHINGLE = 5
+DEFAULT_THRESHOLD = 0.7
+CANDIDATES_PER_BAND = 8
+BATCH = 1000
+# sync_state entry holding the last change log seq indexed
+STATE_KEY = "dedupe_seq"
+NON_WORD = re.compile(r"[\W_]+")
+NO_LIMIT = (1 << 63) - 1
+# Odd 64-bit multiplier for hashing a band into its bucket
+MIX = 0x9E3779B97F4A7C15
+
+# The oldest few sparks in each of a spark's buckets. Bounded per band, so a
+# bucket holding thousands of copies costs the same as one holding two.
+CANDIDATES = " UNION ".join(
+    [
+        "SELECT spark_id FROM (SELECT spark_id FROM spark_lsh WHERE bucket = ? AND spark_id < ? "
+        f"ORDER BY spark_id LIMIT {CANDIDATES_PER_BAND})"
+    ] * BANDS
+)
+
+def normalize(content):
+    text = unicodedata.normalize("NFKC", content).casefold()
+    return " ".join(NON_WORD.sub(" ", text).split())
+
+@lru_cache(maxsize=10_000)
+def shingles(content):
+    text = normalize(content)
+    if len(text) <= SHINGLE:
+        return {text}
+    return {text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+
+def similarity(first, second):
+    """Jaccard similarity of two shingle sets."""
+    return len(first & second) / len(first | second)
+
+@lru_cache(maxsize=200_000)
+def shingle_hash(gram):
+    # Text reuses shingles a lot, so most are looked up rather than hashed
+    return int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=8).digest(), "little")
+
+def signature(grams):
+    """PERMUTATIONS MinHash values by one permutation hashing.
+
+    Each shingle is hashed once and lands in one of PERMUTATIONS bins, which
+    keep their minimum: the same estimator as PERMUTATIONS separate hash
+    functions at 1/PERMUTATIONS of the cost. An empty bin borrows the next
+    filled bin's minimum plus its distance, so similar texts still agree.
+    """
+    # Largest first, so each bin is left holding its smallest hash
+    bins = {
+        hash_value % PERMUTATIONS: hash_value // PERMUTATIONS
+        for hash_value in sorted(map(shingle_hash, grams), reverse=True)
+    }
+    if len(bins) == PERMUTATIONS:
+        return [bins[index] for index in range(PERMUTATIONS)]
+    filled = sorted(bins)
+    minimums = []
+    for index in range(PERMUTATIONS):
+        if index in bins:
+            minimums.append(bins[index])
+        else:
+            source = next((i for i in filled if i > index), filled[0])
+            minimums.append(bins[source] + ((source - index) % PERMUTATIONS << 60))
+    return minimums
+
+def buckets(grams, context_id):
+    """One signed 64-bit bucket per band; the context id keeps contexts apart."""
+    minimums = signature(grams)
+    keys = []
+    for band in range(BANDS):
+        key = ((context_id or 0) * MIX + band) & 0xFFFFFFFFFFFFFFFF
+        for value in minimums[band * ROWS:(band + 1) * ROWS]:
+            key = (key * MIX + value) & 0xFFFFFFFFFFFFFFFF
+        keys.append(key - (1 << 64) if key >= 1 << 63 else key)
+    return keys
+
+# Index
+
+def index_sparks(conn, rows):
+    """(Re)index sparks given as rows of (id, content, context_id); inside the caller's transaction."""
+    conn.executemany("DELETE FROM spark_lsh WHERE spark_id = ?", [(row["id"],) for row in rows])
+    conn.executemany(
+        "INSERT OR IGNORE INTO spark_lsh (bucket, spark_id) VALUES (?, ?)",
+        [
+            (bucket, row["id"])
+            for row in rows
+            for bucket in buckets(shingles(row["content"]), row["context_id"])
+        ],
+    )
+
+def build(conn):
+    """Index every spark, one transaction per BATCH."""
+    up_to = last_seq(conn)
+    conn.execute("DELETE FROM spark_lsh")
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, content, context_id FROM sparks WHERE id > ? AND deleted_at IS NULL ORDER BY id LIMIT ?",
+            (last_id, BATCH),
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            index_sparks(conn, rows)
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            raise e
+        last_id = rows[-1]["id"]
+    # Only now, so an interrupted build starts over instead of looking complete.
+    # Writes made meanwhile are past up_to and get picked up by catch_up.
+    set_state(conn, STATE_KEY, up_to)
+
+def catch_up(conn):
+    """Index the sparks changed since the last call; inside the caller's transaction."""
+    after, up_to = int(get_state(conn, STATE_KEY)), last_seq(conn)
+    if up_to <= after:
+        return
+    # Unary + keeps SQLite on the seq range instead of every sparks entry in
+    # the (table_name, row_key) index
+    uids = [
+        row[0] for row in conn.execute(
+            "SELECT DISTINCT row_key FROM changes WHERE seq > ? AND seq <= ? AND +table_name = 'sparks' AND op = 'upsert'",
+            (after, up_to),
+        )
+    ]
+    for start in range(0, len(uids), 500):
+        chunk = uids[start:start + 500]
+        # Deleted sparks left spark_lsh by trigger and stay out
+        index_sparks(conn, conn.execute(
+            f"SELECT id, content, context_id FROM sparks WHERE uid IN ({', '.join('?' * len(chunk))}) "
+            "AND deleted_at IS NULL", chunk
+        ).fetchall())
+    set_state(conn, STATE_KEY, up_to)
+
+def refresh(conn):
+    """Bring the index up to date with the change log, building it on first use."""
+    if get_state(conn, STATE_KEY) is None:
+        build(conn)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        catch_up(conn)
+        conn.execute("COMMIT")
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
+
+# Matching
+
+def find_matches(conn, grams, keys, threshold, before=NO_LIMIT, skip=()):
+    """[(spark id, similarity)] of indexed sparks older than `before` at least `threshold` similar, best first."""
+    matches = []
+    for row in conn.execute(
+        f"SELECT id, content FROM sparks WHERE id IN ({CANDIDATES})", [value for key in keys for value in (key, before)]
+    ):
+        if row["id"] in skip:
+            continue
+        score = similarity(grams, shingles(row["content"]))
+        if score >= threshold:
+            matches.append((row["id"], score))
+    return sorted(matches, key=lambda match: (-match[1], match[0]))
+
+def _add_unique(conn, content, context_id, collection_name, threshold, merge):
+    grams = shingles(content)
+    keys = buckets(grams, context_id)
+    matches = find_matches(conn, grams, keys, threshold)
+    if matches:
+        if merge:
+            conn.execute(
+                "INSERT OR IGNORE INTO spark_collections (spark_id, collection_id) VALUES (?, ?)",
+                (matches[0][0], get_or_create_collection_id(conn, collection_name)),
+            )
+        return None, matches[0]
+    spark_id = insert_spark(conn, content, context_id, collection_name)
+    conn.executemany("INSERT OR IGNORE INTO spark_lsh (bucket, spark_id) VALUES (?, ?)", [(key, spark_id) for key in keys])
+    return spark_id, None
+
+def add_spark(conn, content, context_id, collection_name, threshold=DEFAULT_THRESHOLD, merge=False):
+    """Add a spark unless it nearly duplicates one in the context.
+
+    Returns (new spark id, None), or (None, (matching spark id, similarity))
+    when it was skipped. With `merge`, a skipped spark's collection is added
+    to the match instead.
+    """
+    refresh(conn)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        catch_up(conn)
+        result = _add_unique(conn, content, context_id, collection_name, threshold, merge)
+        # The spark indexed itself; don't index it again from the change log
+        set_state(conn, STATE_KEY, last_seq(conn))
+        conn.execute("COMMIT")
+        return result
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
+
+def bulk_add_sparks(conn, records, context_id, default_collection, batch_size=1000,
+                    threshold=DEFAULT_THRESHOLD, merge=False):
+    """Like lite.bulk_add_sparks, skipping near-duplicates of existing sparks and of earlier records.
+
+    Yields (total added, [(record number, matching spark id, similarity)])
+    after every committed batch.
+    """
+    refresh(conn)
+    records = iter(records)
+    total = number = 0
+    while True:
+        skipped = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            catch_up(conn)
+            count = 0
+            for content, collection_name in records:
+                number += 1
+                spark_id, match = _add_unique(
+                    conn, content, context_id, collection_name or default_collection, threshold, merge
+                )
+                if match:
+                    skipped.append((number, *match))
+                else:
+                    total += 1
+                count += 1
+                if count == batch_size:
+                    break
+            set_state(conn, STATE_KEY, last_seq(conn))
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            raise e
+        if not count:
+            break
+        yield total, skipped
+
+def find_duplicates(conn, context_id, threshold=DEFAULT_THRESHOLD):
+    """Yield (spark row, original spark id, similarity) for each spark that nearly duplicates an older one.
+
+    Sparks are compared with older sparks in the same context that aren't
+    duplicates themselves, so a chain of copies all point at the first.
+    """
+    refresh(conn)
+    duplicates = set()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, content, created_at FROM sparks WHERE context_id = ? AND id > ? AND deleted_at IS NULL "
+            "ORDER BY id LIMIT ?",
+            (context_id, last_id, BATCH),
+        ).fetchall()
+        if not rows:
+            break
+        keys = {}
+        for row in conn.execute(
+            f"SELECT spark_id, bucket FROM spark_lsh WHERE spark_id IN ({', '.join('?' * len(rows))})",
+            [row["id"] for row in rows],
+        ):
+            keys.setdefault(row["spark_id"], []).append(row["bucket"])
+        for row in rows:
+            grams = shingles(row["content"])
+            spark_keys = keys.get(row["id"])
+            if spark_keys is None or len(spark_keys) != BANDS:
+                # Two bands in one bucket: rare enough to just rehash
+                spark_keys = buckets(grams, context_id)
+            matches = find_matches(conn, grams, spark_keys, threshold, row["id"], duplicates)
+            if matches:
+                duplicates.add(row["id"])
+                yield row, *matches[0]
+        last_id = rows[-1]["id"]
+
+def merge_duplicates(conn, pairs):
+    """Give each original the collections of its duplicates, then delete the duplicates.
+
+    `pairs` are (duplicate id, original id); one transaction per BATCH.
+    Duplicates are soft deleted as one batch, so `spark undo` brings them
+    back. Returns how many sparks were deleted.
+    """
+    pairs = list(pairs)
+    stamp = deletion_stamp()
+    for start in range(0, len(pairs), BATCH):
+        chunk = pairs[start:start + BATCH]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO spark_collections (spark_id, collection_id) "
+                "SELECT ?, collection_id FROM spark_collections WHERE spark_id = ?",
+                [(original, duplicate) for duplicate, original in chunk],
+            )
+            conn.executemany(
+                "UPDATE sparks SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL",
+                [(stamp, duplicate) for duplicate, _ in chunk],
+            )
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            raise e
+    return len(pairs)
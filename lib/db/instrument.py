@@ -0,0 +1,337 @@
+# instrument.py
+# Lightweight SQL statement counting for SQLAlchemy engines and raw sqlite3
+# connections (the db.lite fast path), and the tracer behind `spark --profile`.
+#
+# Nothing here imports sqlite3 or SQLAlchemy at module level: utils imports
+# this module for span(), which must stay free when tracing is off.
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+class QueryCounter:
+    """Collects every SQL statement issued while attached."""
+
+    def __init__(self):
+        self.statements = []
+        self._engines = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, statement):
+        # db.lite issues transaction control explicitly; only count real queries
+        if statement.split(None, 1)[0].upper() in ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE"):
+            return
+        self.statements.append(statement)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record(statement)
+
+    def attach_engine(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        self._engines.append(engine)
+
+    @property
+    def connection_factory(self):
+        """sqlite3.Connection subclass to pass as `factory=` to db.lite.connect.
+
+        sqlite3's own trace callback also reports statements run inside
+        triggers and FTS5 internals, so calls are counted at the Python level.
+        """
+        import sqlite3
+        counter = self
+
+        class CountingConnection(sqlite3.Connection):
+            def execute(self, sql, parameters=()):
+                counter._record(sql)
+                return super().execute(sql, parameters)
+
+            def executemany(self, sql, parameters):
+                counter._record(sql)
+                return super().executemany(sql, parameters)
+
+        return CountingConnection
+
+    def detach(self):
+        from sqlalchemy import event
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute", self._before_cursor_execute)
+        self._engines = []
+
+@contextmanager
+def count_queries(engine=None):
+    counter = QueryCounter()
+    if engine is not None:
+        counter.attach_engine(engine)
+    try:
+        yield counter
+    finally:
+        counter.detach()
+
+# Counters: tallies kept elsewhere (e.g. helpers.identity_cache hits and
+# misses), listed by `spark --profile` and readable by embedders
+
+_counters = {}
+
+def register_counters(name, source):
+    """Report `source()`, a dict of counts, under `name` in counters()."""
+    _counters[name] = source
+
+def counters():
+    return {name: source() for name, source in _counters.items()}
+
+# Tracing
+
+_tracer = None
+_NO_SPAN = nullcontext()
+
+# Deeper imports are folded into their parent's span to keep traces readable
+MAX_IMPORT_DEPTH = 3
+
+def active_tracer():
+    return _tracer
+
+def span(name, category="phase", **args):
+    """Time a block under the active tracer; a shared no-op when tracing is off."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, category, **args)
+
+def trace_setting():
+    """(tracing, trace file or None) from SPARK_TRACE.
+
+    Unset, empty and "0" are off; 1/true/yes trace like --profile and any
+    other value is the file to save the trace to.
+    """
+    value = os.environ.get("SPARK_TRACE", "")
+    if value in ("", "0"):
+        return False, None
+    return True, None if value.lower() in ("1", "true", "yes") else value
+
+def start_tracing(origin=None):
+    global _tracer
+    _tracer = Tracer(origin)
+    _tracer.trace_imports()
+    return _tracer
+
+def stop_tracing():
+    global _tracer
+    if _tracer is not None:
+        _tracer.stop_import_tracing()
+    _tracer = None
+
+class Tracer:
+    """Records phases, imports and SQL statements as Chrome trace events.
+
+    Events use the trace-event format ("ph": "X" complete events with
+    microsecond timestamps), so a saved trace opens in chrome://tracing or
+    https://ui.perfetto.dev. `origin` is the perf_counter() value all
+    timestamps are relative to, normally when the CLI module started loading.
+    """
+
+    def __init__(self, origin=None):
+        self.origin = time.perf_counter() if origin is None else origin
+        self.events = []
+        self.profiler = None
+        self._original_import = None
+        self._import_depth = 0
+
+    def add_span(self, name, category, start, end, **args):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": args,
+        }
+        self.events.append(event)
+        return event
+
+    @contextmanager
+    def span(self, name, category="phase", **args):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add_span(name, category, start, time.perf_counter(), **args)
+
+    def record_sql(self, statement, start, end, rows=None):
+        name = " ".join(statement.split())
+        return self.add_span(name[:80], "sql", start, end, statement=name, rows=rows)
+
+    # Imports: wrap __import__ so first-time imports (the lazy ones inside
+    # commands, like SQLAlchemy or PyYAML) show up as spans
+
+    def trace_imports(self):
+        import builtins
+        self._original_import = original = builtins.__import__
+        tracer = self
+
+        def traced_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level or name in sys.modules or tracer._import_depth >= MAX_IMPORT_DEPTH:
+                return original(name, globals, locals, fromlist, level)
+            tracer._import_depth += 1
+            start = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                tracer._import_depth -= 1
+                tracer.add_span(f"import {name}", "import", start, time.perf_counter(), depth=tracer._import_depth)
+
+        builtins.__import__ = traced_import
+
+    def stop_import_tracing(self):
+        if self._original_import is not None:
+            import builtins
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    # SQL: SQLAlchemy engine events for the ORM, a sqlite3 connection
+    # subclass for db.lite
+
+    def attach_engine(self, engine):
+        from sqlalchemy import event
+        tracer = self
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("spark_trace_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            start = conn.info["spark_trace_start"].pop()
+            # DBAPIs report -1 when the count isn't known up front (SQLite SELECTs)
+            rows = cursor.rowcount if cursor.rowcount >= 0 else None
+            tracer.record_sql(statement, start, time.perf_counter(), rows)
+
+    @property
+    def connection_factory(self):
+        """sqlite3.Connection subclass for db.lite.connect that traces every statement.
+
+        Cursors count rows as they are fetched, so streamed results (list)
+        report the rows actually read, not just the time to the first one.
+        """
+        import sqlite3
+        tracer = self
+
+        class TracingCursor(sqlite3.Cursor):
+            event = None
+
+            def _traced(self, method, sql, parameters):
+                start = time.perf_counter()
+                result = method(sql, parameters)
+                self.event = tracer.record_sql(sql, start, time.perf_counter(), rows=self.rowcount if self.rowcount >= 0 else 0)
+                return result
+
+            def execute(self, sql, parameters=()):
+                return self._traced(super().execute, sql, parameters)
+
+            def executemany(self, sql, parameters):
+                return self._traced(super().executemany, sql, parameters)
+
+            def _count(self, rows):
+                if self.event is not None:
+                    self.event["args"]["rows"] += rows
+
+            def fetchone(self):
+                row = super().fetchone()
+                self._count(row is not None)
+                return row
+
+            def fetchmany(self, size=None):
+                rows = super().fetchmany(self.arraysize if size is None else size)
+                self._count(len(rows))
+                return rows
+
+            def fetchall(self):
+                rows = super().fetchall()
+                self._count(len(rows))
+                return rows
+
+            def __next__(self):
+                row = super().__next__()
+                self._count(1)
+                return row
+
+        class TracingConnection(sqlite3.Connection):
+            def cursor(self, factory=TracingCursor):
+                return super().cursor(factory)
+
+            def execute(self, sql, parameters=()):
+                return self.cursor().execute(sql, parameters)
+
+            def executemany(self, sql, parameters):
+                return self.cursor().executemany(sql, parameters)
+
+        return TracingConnection
+
+    # cProfile
+
+    def start_profiler(self):
+        import cProfile
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profiler(self, path):
+        """Stop cProfile and dump its stats (readable with pstats) to `path`."""
+        self.profiler.disable()
+        self.profiler.dump_stats(path)
+
+    # Output
+
+    def write_chrome_trace(self, path):
+        import json
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, trace_file)
+
+    def self_times(self):
+        """Time spent in each event excluding the events nested inside it, in seconds."""
+        ordered = sorted(self.events, key=lambda event: (event["ts"], -event["dur"]))
+        children = [0.0] * len(ordered)
+        stack = []
+        for index, event in enumerate(ordered):
+            while stack and ordered[stack[-1]]["ts"] + ordered[stack[-1]]["dur"] <= event["ts"]:
+                stack.pop()
+            if stack:
+                children[stack[-1]] += event["dur"]
+            stack.append(index)
+        return [(event, max(event["dur"] - child, 0) / 1e6) for event, child in zip(ordered, children)]
+
+    def summary(self, slowest=5):
+        """Human-readable breakdown of where the time went."""
+        by_category = {}
+        for event, seconds in self.self_times():
+            by_category[event["cat"]] = by_category.get(event["cat"], 0.0) + seconds
+        total = max((event["ts"] + event["dur"] for event in self.events), default=0) / 1e6
+        statements = [event for event in self.events if event["cat"] == "sql"]
+        rows = sum(event["args"]["rows"] or 0 for event in statements)
+
+        labels = {
+            "startup": "startup (module imports)",
+            "import": "lazy imports",
+            "config": ".spark and context",
+            "setup": "engine and session setup",
+            "sql": f"sql ({len(statements)} statements, {rows} rows)",
+            "command": "command (python, ORM, output)",
+        }
+        lines = [f"Total {total * 1000:.1f} ms"]
+        for category, label in labels.items():
+            if category in by_category:
+                lines.append(f"  {label:36} {by_category.pop(category) * 1000:8.1f} ms")
+        for category, seconds in sorted(by_category.items()):
+            lines.append(f"  {category:36} {seconds * 1000:8.1f} ms")
+        for name, counts in counters().items():
+            lines.append(f"  {name:36} " + ", ".join(f"{key} {value}" for key, value in counts.items()))
+        if statements:
+            lines.append("Slowest statements:")
+            for event in sorted(statements, key=lambda event: -event["dur"])[:slowest]:
+                rows = "?" if event["args"]["rows"] is None else event["args"]["rows"]
+                lines.append(f"  {event['dur'] / 1000:8.2f} ms {rows:>7} rows  {event['name']}")
+        return "\n".join(lines)
@@ -0,0 +1,255 @@
+# lite.py
+# Thin sqlite3 data-access layer for the hot commands (add, list, search).
+# It deliberately avoids importing SQLAlchemy so a one-shot CLI call only
+# pays for the stdlib sqlite3 module. Only used when the configured store is
+# SQLite (see db.storage); other backends go through helpers.py.
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+# Markers wrapped around matched terms in search snippets
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+SPARK_COLUMNS = "sparks.id, sparks.content, sparks.created_at, sparks.updated_at, sparks.context_id"
+
+class Row(sqlite3.Row):
+    """sqlite3.Row with attribute access, so callers can treat rows like ORM objects."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except IndexError:
+            raise AttributeError(name)
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+sqlite3.register_converter("DATETIME", _parse_datetime)
+
+def connect(path, factory=sqlite3.Connection, pragmas=None):
+    # isolation_level=None: transactions are opened explicitly with BEGIN so
+    # each command commits exactly once.
+    conn = sqlite3.connect(
+        path, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None, factory=factory
+    )
+    conn.row_factory = Row
+    for name, value in (pragmas or {}).items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+def build_fts_query(search_term):
+    """Turn user input into a safe FTS5 MATCH expression.
+
+    Bare words are quoted so punctuation can't break the query syntax,
+    a trailing '*' keeps prefix matching and "double quoted" text is
+    matched as a phrase. Terms are AND-ed together.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', search_term):
+        if phrase.strip():
+            terms.append('"' + phrase.replace('"', '""') + '"')
+        elif word:
+            is_prefix = word.endswith("*")
+            word = word.strip('*"')
+            if word:
+                terms.append('"' + word.replace('"', '""') + '"' + ("*" if is_prefix else ""))
+    return " ".join(terms)
+
+def new_uid():
+    """Spark uid in the shape the sparks_uid_ai trigger makes: time-ordered hex."""
+    return f"{time.time_ns() // 1000:014x}{os.urandom(9).hex()}"
+
+def deletion_stamp():
+    """UTC now for sparks.deleted_at, to the microsecond and in SQLAlchemy's DateTime format."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+# Contexts
+def get_context_id_by_working_dir(conn, working_dir):
+    row = conn.execute(
+        "SELECT id FROM contexts WHERE working_directory = ?", (working_dir,)
+    ).fetchone()
+    return row["id"] if row else None
+
+def get_or_create_context_id(conn, working_dir, project_name):
+    context_id = get_context_id_by_working_dir(conn, working_dir)
+    if context_id is None:
+        conn.execute(
+            "INSERT OR IGNORE INTO contexts (working_directory, project_name) VALUES (?, ?)",
+            (working_dir, project_name),
+        )
+        context_id = get_context_id_by_working_dir(conn, working_dir)
+    return context_id
+
+# Collections
+def get_or_create_collection_id(conn, name):
+    conn.execute("INSERT OR IGNORE INTO collections (name) VALUES (?)", (name,))
+    return conn.execute("SELECT id FROM collections WHERE name = ?", (name,)).fetchone()["id"]
+
+def get_collection_id(conn, name):
+    row = conn.execute("SELECT id FROM collections WHERE name = ?", (name,)).fetchone()
+    return row["id"] if row else None
+
+# Sparks
+def insert_spark(conn, content, context_id, collection_name):
+    """Insert a spark and its collection membership; the caller owns the transaction."""
+    spark_id = conn.execute(
+        "INSERT INTO sparks (content, context_id, uid) VALUES (?, ?, ?)", (content, context_id, new_uid())
+    ).lastrowid
+    collection_id = get_or_create_collection_id(conn, collection_name)
+    conn.execute(
+        "INSERT OR IGNORE INTO spark_collections (spark_id, collection_id) VALUES (?, ?)",
+        (spark_id, collection_id),
+    )
+    return spark_id
+
+def add_spark(conn, content, context_id, collection_name):
+    """Insert a spark and its collection membership in a single transaction."""
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        spark_id = insert_spark(conn, content, context_id, collection_name)
+        conn.execute("COMMIT")
+        return spark_id
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
+
+def bulk_add_sparks(conn, records, context_id, default_collection, batch_size=1000):
+    """Insert (content, collection_name) records with executemany, one transaction per batch.
+
+    `records` may be any iterable, so input is consumed as a stream. Spark ids
+    are assigned up front while the write lock is held, which lets the
+    memberships go in with a second executemany instead of a row-at-a-time
+    lastrowid round trip. Yields the running total after every committed batch.
+    """
+    collection_ids = {}
+    records = iter(records)
+    total = 0
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM sparks").fetchone()[0]
+            spark_rows = []
+            membership_rows = []
+            for offset, (content, collection_name) in enumerate(batch):
+                name = collection_name or default_collection
+                if name not in collection_ids:
+                    collection_ids[name] = get_or_create_collection_id(conn, name)
+                spark_rows.append((next_id + offset, content, context_id, new_uid()))
+                membership_rows.append((next_id + offset, collection_ids[name]))
+            conn.executemany(
+                "INSERT INTO sparks (id, content, context_id, uid) VALUES (?, ?, ?, ?)", spark_rows
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO spark_collections (spark_id, collection_id) VALUES (?, ?)",
+                membership_rows,
+            )
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            raise e
+        total += len(batch)
+        yield total
+
+def get_sparks_by_context(conn, context_id, after_id=None, limit=None, reverse=False):
+    """Stream a context's sparks in creation order using keyset pagination.
+
+    Returns the cursor itself so rows are produced one at a time straight off
+    the (context_id, created_at) index; nothing is materialized up front.
+    """
+    op, direction = ("<", "DESC") if reverse else (">", "ASC")
+    sql = f"SELECT {SPARK_COLUMNS} FROM sparks WHERE context_id = ? AND deleted_at IS NULL"
+    params = [context_id]
+    if after_id is not None:
+        sql += f" AND (created_at, id) {op} (SELECT created_at, id FROM sparks WHERE id = ?)"
+        params.append(after_id)
+    sql += f" ORDER BY created_at {direction}, id {direction} LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    return conn.execute(sql, params)
+
+def get_sparks_by_collection(conn, collection_id, after_id=None, limit=None, reverse=False):
+    op, direction = ("<", "DESC") if reverse else (">", "ASC")
+    sql = (
+        f"SELECT {SPARK_COLUMNS} FROM spark_collections "
+        "JOIN sparks ON sparks.id = spark_collections.spark_id "
+        "WHERE spark_collections.collection_id = ? AND sparks.deleted_at IS NULL"
+    )
+    params = [collection_id]
+    if after_id is not None:
+        sql += f" AND spark_collections.spark_id {op} ?"
+        params.append(after_id)
+    sql += f" ORDER BY spark_collections.spark_id {direction} LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    return conn.execute(sql, params)
+
+def get_sparks_from_today(conn, context_id, limit=None, reverse=False, timezone=None):
+    """Sparks created since local midnight: a range seek on ix_sparks_context_id_created_at."""
+    from db.query import date_bounds, local_timezone
+    start, end = date_bounds("today")(local_timezone(timezone))
+    direction = "DESC" if reverse else "ASC"
+    return conn.execute(
+        f"SELECT {SPARK_COLUMNS} FROM sparks "
+        "WHERE context_id = ? AND created_at >= ? AND created_at < ? AND deleted_at IS NULL "
+        f"ORDER BY created_at {direction}, id {direction} LIMIT ?",
+        (context_id, start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S"), -1 if limit is None else limit),
+    )
+
+def query_sparks(conn, plan, context_id=None, after_id=None, limit=None, reverse=False, timezone=None):
+    """Cursor over a compiled `list` query (a db.query.Plan); streams like get_sparks_by_context."""
+    sql, params = plan.statement(context_id, after_id, limit, reverse, timezone)
+    return conn.execute(sql, params)
+
+def search_sparks(conn, context_id, search_term, limit=50):
+    # Deleted sparks leave sparks_fts (triggers), so they can't match
+    fts_query = build_fts_query(search_term)
+    if not fts_query:
+        return []
+    return conn.execute(
+        "SELECT sparks.id, sparks.content, "
+        "snippet(sparks_fts, 0, ?, ?, '...', 16) AS snippet, "
+        "bm25(sparks_fts) AS rank "
+        "FROM sparks_fts JOIN sparks ON sparks.id = sparks_fts.rowid "
+        "WHERE sparks_fts MATCH ? AND sparks.context_id = ? "
+        "ORDER BY rank LIMIT ?",
+        (HIGHLIGHT_START, HIGHLIGHT_END, fts_query, context_id, limit),
+    ).fetchall()
+
+# Maintenance
+def checkpoint(conn, mode="TRUNCATE"):
+    """Copy the WAL back into the database file; returns (busy, wal_pages, checkpointed)."""
+    return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+def analyze(conn):
+    conn.execute("ANALYZE")
+
+def optimize(conn):
+    conn.execute("PRAGMA optimize")
+    conn.execute("INSERT INTO sparks_fts(sparks_fts) VALUES ('optimize')")
+
+def vacuum(conn, full=False):
+    """Return free pages to the filesystem.
+
+    Incremental vacuum needs auto_vacuum=INCREMENTAL, which only takes effect
+    after one full VACUUM; that happens automatically the first time.
+    """
+    if full or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+
+def database_stats(conn):
+    pragma = lambda name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+    return {
+        "journal_mode": pragma("journal_mode"),
+        "page_size": pragma("page_size"),
+        "page_count": pragma("page_count"),
+        "freelist_count": pragma("freelist_count"),
+        "auto_vacuum": {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}[pragma("auto_vacuum")],
+    }
@@ -19,6 +19,22 @@ if config.config_file_name is not None:
 from models import Base
 target_metadata = Base.metadata
 
+# Migrate the same database the CLI run from here would use (SPARK_DATABASE_URL,
+# then database_url in the nearest .spark, then lib/db/spark_store.db) unless a
+# caller passes one in explicitly.
+database_url = config.attributes.get("database_url")
+if not database_url:
+    import os
+    import sys
+    LIB_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if LIB_DIR not in sys.path:
+        sys.path.append(LIB_DIR)
+    from storage import get_database_url
+    from utils import load_dot_spark
+    dot_spark, dot_config = load_dot_spark()
+    database_url = get_database_url(dot_config, dot_spark.parent if dot_spark else None)
+config.set_main_option("sqlalchemy.url", database_url.replace("%", "%%"))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
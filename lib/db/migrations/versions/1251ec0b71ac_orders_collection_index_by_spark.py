@@ -0,0 +1,30 @@
+"""orders the collection membership index by spark id
+
+Revision ID: 1251ec0b71ac
+Revises: 5c91e31653f0
+Create Date: 2026-10-18 11:41:05.873214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1251ec0b71ac'
+down_revision: Union[str, None] = '5c91e31653f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # (collection_id, spark_id) lets collection listings stream in id order
+    # and page with spark_id > ? without a sort step
+    op.drop_index('ix_spark_collections_collection_id', table_name='spark_collections')
+    op.create_index('ix_spark_collections_collection_id_spark_id', 'spark_collections', ['collection_id', 'spark_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_spark_collections_collection_id_spark_id', table_name='spark_collections')
+    op.create_index('ix_spark_collections_collection_id', 'spark_collections', ['collection_id'], unique=False)
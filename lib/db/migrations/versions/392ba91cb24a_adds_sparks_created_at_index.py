@@ -0,0 +1,28 @@
+"""adds a created_at index for date ranges across every context
+
+Revision ID: 392ba91cb24a
+Revises: 8983d5e820cd
+Create Date: 2026-10-18 16:12:40.274118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '392ba91cb24a'
+down_revision: Union[str, None] = '8983d5e820cd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ix_sparks_context_id_created_at serves ranges within one context;
+    # `context:* created:...` needs created_at leading
+    op.create_index('ix_sparks_created_at', 'sparks', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sparks_created_at', table_name='sparks')
@@ -0,0 +1,44 @@
+"""creates the MinHash LSH index for near-duplicate sparks
+
+Revision ID: 500f1700168d
+Revises: 5a0c1394d081
+Create Date: 2026-10-18 14:41:52.306114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '500f1700168d'
+down_revision: Union[str, None] = '5a0c1394d081'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Clustered by bucket, so the oldest sparks in a bucket are one range scan
+    op.create_table(
+        'spark_lsh',
+        sa.Column('bucket', sa.BigInteger(), nullable=False),
+        sa.Column('spark_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket', 'spark_id'),
+        sqlite_with_rowid=False,
+    )
+    op.create_index('ix_spark_lsh_spark_id', 'spark_lsh', ['spark_id'], unique=False)
+    if op.get_bind().dialect.name == "sqlite":
+        # Edits reach the index through the change log; deletes can't wait for it
+        op.execute(
+            "CREATE TRIGGER spark_lsh_ad AFTER DELETE ON sparks BEGIN "
+            "DELETE FROM spark_lsh WHERE spark_id = old.id; "
+            "END"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TRIGGER IF EXISTS spark_lsh_ad")
+    op.drop_index('ix_spark_lsh_spark_id', table_name='spark_lsh')
+    op.drop_table('spark_lsh')
@@ -0,0 +1,259 @@
+"""adds soft delete (sparks.deleted_at) and cascading deletes of memberships
+
+Revision ID: 509327c54661
+Revises: c9315638fe6e
+Create Date: 2026-10-18 17:48:33.905216
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '509327c54661'
+down_revision: Union[str, None] = 'c9315638fe6e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# A tombstoned spark (deleted_at set) leaves the FTS index, the vector and
+# LSH indexes and the stats at once, as if it had been deleted; restoring it
+# puts it back. `spark gc` later deletes the row for real, which then has
+# nothing left to undo. The stats triggers below are the 8983d5e820cd ones
+# with every bound limited to live sparks; soft=False rebuilds those.
+
+MEMBERSHIPS = "SELECT collection_id FROM spark_collections WHERE spark_id = {row}.id"
+
+
+def context_added(row):
+    return (
+        "INSERT INTO context_stats (context_id, sparks, first_at, last_at) "
+        f"SELECT {row}.context_id, 1, {row}.created_at, {row}.created_at WHERE {row}.context_id IS NOT NULL "
+        "ON CONFLICT (context_id) DO UPDATE SET sparks = sparks + 1, "
+        "first_at = MIN(first_at, excluded.first_at), last_at = MAX(last_at, excluded.last_at); "
+        "INSERT INTO spark_daily (context_id, day, sparks) "
+        f"SELECT {row}.context_id, date({row}.created_at), 1 WHERE {row}.context_id IS NOT NULL "
+        "ON CONFLICT (context_id, day) DO UPDATE SET sparks = sparks + 1; "
+    )
+
+
+def context_removed(row, live):
+    bounds = f"FROM sparks WHERE sparks.context_id = {row}.context_id{live}"
+    return (
+        "UPDATE context_stats SET sparks = sparks - 1, "
+        f"first_at = CASE WHEN {row}.created_at > first_at THEN first_at ELSE (SELECT MIN(sparks.created_at) {bounds}) END, "
+        f"last_at = CASE WHEN {row}.created_at < last_at THEN last_at ELSE (SELECT MAX(sparks.created_at) {bounds}) END "
+        f"WHERE context_id = {row}.context_id; "
+        f"DELETE FROM context_stats WHERE context_id = {row}.context_id AND sparks <= 0; "
+        f"UPDATE spark_daily SET sparks = sparks - 1 WHERE context_id = {row}.context_id AND day = date({row}.created_at); "
+        f"DELETE FROM spark_daily WHERE context_id = {row}.context_id AND day = date({row}.created_at) AND sparks <= 0; "
+    )
+
+
+def collection_bounds(collection_id, live):
+    members = (
+        "FROM spark_collections JOIN sparks ON sparks.id = spark_collections.spark_id "
+        f"WHERE spark_collections.collection_id = {collection_id}{live}"
+    )
+    return f"(SELECT MIN(sparks.created_at) {members})", f"(SELECT MAX(sparks.created_at) {members})"
+
+
+def collection_removed(collection_id, created_at, condition, live):
+    first, last = collection_bounds(collection_id, live)
+    return (
+        "UPDATE collection_stats SET sparks = sparks - 1, "
+        f"first_at = CASE WHEN {created_at} > first_at THEN first_at ELSE {first} END, "
+        f"last_at = CASE WHEN {created_at} < last_at THEN last_at ELSE {last} END "
+        f"WHERE {condition}; "
+        f"DELETE FROM collection_stats WHERE {condition} AND sparks <= 0; "
+    )
+
+
+def collections_added(row):
+    return (
+        "INSERT INTO collection_stats (collection_id, sparks, first_at, last_at) "
+        f"SELECT collection_id, 1, {row}.created_at, {row}.created_at FROM spark_collections WHERE spark_id = {row}.id "
+        "ON CONFLICT (collection_id) DO UPDATE SET sparks = sparks + 1, "
+        "first_at = MIN(first_at, excluded.first_at), last_at = MAX(last_at, excluded.last_at); "
+    )
+
+
+def triggers(soft):
+    live = " AND sparks.deleted_at IS NULL" if soft else ""
+    first, last = collection_bounds("collection_stats.collection_id", live)
+    memberships = f"collection_id IN ({MEMBERSHIPS.format(row='old')})"
+    definitions = {
+        "sparks_stats_ai": (
+            "AFTER INSERT ON sparks " + ("WHEN new.deleted_at IS NULL " if soft else "")
+            + "BEGIN " + context_added("new") + "END"
+        ),
+        "sparks_stats_ad": (
+            "AFTER DELETE ON sparks " + ("WHEN old.deleted_at IS NULL " if soft else "")
+            + "BEGIN " + context_removed("old", live)
+            # With cascading deletes the memberships are gone by the time AFTER
+            # DELETE triggers run, so sparks_stats_bd counts them out instead
+            + ("" if soft else collection_removed("collection_stats.collection_id", "old.created_at", memberships, live))
+            + "END"
+        ),
+        "sparks_stats_au": (
+            "AFTER UPDATE OF context_id, created_at ON sparks "
+            + ("WHEN old.deleted_at IS NULL AND new.deleted_at IS NULL AND (" if soft else "WHEN ")
+            + "old.context_id IS NOT new.context_id OR old.created_at IS NOT new.created_at"
+            + (") BEGIN " if soft else " BEGIN ")
+            + context_removed("old", live) + context_added("new")
+            + f"UPDATE collection_stats SET first_at = {first}, last_at = {last} "
+            f"WHERE collection_id IN ({MEMBERSHIPS.format(row='new')}); "
+            "END"
+        ),
+        "spark_collections_stats_ai": (
+            "AFTER INSERT ON spark_collections BEGIN "
+            "INSERT INTO collection_stats (collection_id, sparks, first_at, last_at) "
+            f"SELECT new.collection_id, 1, created_at, created_at FROM sparks WHERE id = new.spark_id{live} "
+            "ON CONFLICT (collection_id) DO UPDATE SET sparks = sparks + 1, "
+            "first_at = MIN(first_at, excluded.first_at), last_at = MAX(last_at, excluded.last_at); "
+            "END"
+        ),
+        "spark_collections_stats_ad": (
+            "AFTER DELETE ON spark_collections BEGIN "
+            + collection_removed(
+                "old.collection_id", "(SELECT created_at FROM sparks WHERE id = old.spark_id)",
+                f"collection_id = old.collection_id AND EXISTS (SELECT 1 FROM sparks WHERE id = old.spark_id{live})",
+                live,
+            )
+            + "END"
+        ),
+        "sparks_fts_ad": (
+            "AFTER DELETE ON sparks BEGIN "
+            "INSERT INTO sparks_fts(sparks_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+            "END"
+        ),
+        "sparks_fts_au": (
+            "AFTER UPDATE OF content ON sparks BEGIN "
+            "INSERT INTO sparks_fts(sparks_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+            "INSERT INTO sparks_fts(rowid, content) VALUES (new.id, new.content); "
+            "END"
+        ),
+    }
+    if not soft:
+        return definitions
+
+    tombstoned = "AFTER UPDATE OF deleted_at ON sparks WHEN old.deleted_at IS NULL AND new.deleted_at IS NOT NULL BEGIN "
+    definitions.update({
+        "sparks_stats_bd": (
+            "BEFORE DELETE ON sparks WHEN old.deleted_at IS NULL BEGIN "
+            + collection_removed(
+                "collection_stats.collection_id", "old.created_at", memberships, f"{live} AND sparks.id <> old.id"
+            )
+            + "END"
+        ),
+        "sparks_stats_tombstone": (
+            tombstoned + context_removed("old", live)
+            + collection_removed("collection_stats.collection_id", "old.created_at", memberships, live)
+            + "END"
+        ),
+        "sparks_stats_restore": (
+            "AFTER UPDATE OF deleted_at ON sparks WHEN old.deleted_at IS NOT NULL AND new.deleted_at IS NULL BEGIN "
+            + context_added("new") + collections_added("new") + "END"
+        ),
+        # External content: only rows the index holds may be deleted from it
+        "sparks_fts_ad": (
+            "AFTER DELETE ON sparks WHEN old.deleted_at IS NULL BEGIN "
+            "INSERT INTO sparks_fts(sparks_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+            "END"
+        ),
+        "sparks_fts_au": (
+            "AFTER UPDATE OF content, deleted_at ON sparks BEGIN "
+            "INSERT INTO sparks_fts(sparks_fts, rowid, content) "
+            "SELECT 'delete', old.id, old.content WHERE old.deleted_at IS NULL; "
+            "INSERT INTO sparks_fts(rowid, content) SELECT new.id, new.content WHERE new.deleted_at IS NULL; "
+            "END"
+        ),
+        # Restores reach these indexes through the change log, like edits
+        "spark_vectors_au": tombstoned + "DELETE FROM spark_vectors WHERE spark_id = old.id; END",
+        "spark_lsh_au": tombstoned + "DELETE FROM spark_lsh WHERE spark_id = old.id; END",
+    })
+    return definitions
+
+
+def memberships_table(ondelete):
+    return sa.Table(
+        'spark_collections', sa.MetaData(),
+        sa.Column('spark_id', sa.Integer(), sa.ForeignKey('sparks.id', ondelete=ondelete), nullable=False),
+        sa.Column('collection_id', sa.Integer(), sa.ForeignKey('collections.id', ondelete=ondelete), nullable=False),
+        sa.PrimaryKeyConstraint('spark_id', 'collection_id', name='pk_spark_collections'),
+        sa.Index('ix_spark_collections_collection_id_spark_id', 'collection_id', 'spark_id'),
+    )
+
+
+def rebuild_memberships(ondelete, replaced):
+    """Recreate spark_collections with `ondelete` foreign keys, keeping the triggers not in `replaced`."""
+    bind = op.get_bind()
+    # Triggers on the table go with it, and SQLite won't rename a table into
+    # place while other tables' triggers refer to the missing name
+    dropped = bind.execute(sa.text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+        "AND (tbl_name = 'spark_collections' OR sql LIKE '%spark_collections%')"
+    )).all()
+    for name, _ in dropped:
+        op.execute(f"DROP TRIGGER {name}")
+    with op.batch_alter_table('spark_collections', recreate='always', copy_from=memberships_table(ondelete)):
+        pass
+    for name, sql in dropped:
+        if name not in replaced:
+            op.execute(sql)
+
+
+def replace_triggers(old, new):
+    for name in old:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for name, body in new.items():
+        op.execute(f"CREATE TRIGGER {name} {body}")
+
+
+def upgrade() -> None:
+    op.add_column('sparks', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    # Only tombstones are indexed: gc and undo find them without touching live rows
+    op.create_index(
+        'ix_sparks_deleted_at', 'sparks', ['deleted_at'], unique=False,
+        sqlite_where=sa.text('deleted_at IS NOT NULL'), postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+    # Memberships and revisions of sparks or collections deleted while
+    # foreign keys weren't enforced would fail the new constraints
+    op.execute(
+        "DELETE FROM spark_collections WHERE spark_id NOT IN (SELECT id FROM sparks) "
+        "OR collection_id NOT IN (SELECT id FROM collections)"
+    )
+    op.execute("DELETE FROM spark_revisions WHERE spark_id NOT IN (SELECT id FROM sparks)")
+
+    if op.get_bind().dialect.name != "sqlite":
+        for column, parent in (('spark_id', 'sparks'), ('collection_id', 'collections')):
+            op.drop_constraint(f'spark_collections_{column}_fkey', 'spark_collections', type_='foreignkey')
+            op.create_foreign_key(
+                f'spark_collections_{column}_fkey', 'spark_collections', parent, [column], ['id'], ondelete='CASCADE'
+            )
+        return
+
+    new = triggers(soft=True)
+    rebuild_memberships('CASCADE', new)
+    replace_triggers(triggers(soft=False), new)
+
+
+def downgrade() -> None:
+    # Without deleted_at, tombstones would come back to life
+    op.execute("DELETE FROM sparks WHERE deleted_at IS NOT NULL")
+    if op.get_bind().dialect.name != "sqlite":
+        for column, parent in (('spark_id', 'sparks'), ('collection_id', 'collections')):
+            op.drop_constraint(f'spark_collections_{column}_fkey', 'spark_collections', type_='foreignkey')
+            op.create_foreign_key(f'spark_collections_{column}_fkey', 'spark_collections', parent, [column], ['id'])
+        op.drop_index('ix_sparks_deleted_at', table_name='sparks')
+        op.drop_column('sparks', 'deleted_at')
+        return
+
+    old = triggers(soft=False)
+    rebuild_memberships(None, old)
+    replace_triggers(triggers(soft=True), old)
+    op.drop_index('ix_sparks_deleted_at', table_name='sparks')
+    # Native DROP COLUMN; batch mode would rebuild sparks and lose its triggers
+    op.execute("ALTER TABLE sparks DROP COLUMN deleted_at")
@@ -0,0 +1,116 @@
+"""adds the sync change log and spark uids
+
+Revision ID: 51881d439225
+Revises: 1251ec0b71ac
+Create Date: 2026-10-18 12:02:37.518220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '51881d439225'
+down_revision: Union[str, None] = '1251ec0b71ac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Millisecond precision, so edits in the same second still order correctly
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+# Microseconds since the epoch, then random bits (db.lite.new_uid makes the
+# same shape). Time-ordered uids land at the right-hand end of ix_sparks_uid
+# and the change log index instead of at random pages, which keeps bulk
+# inserts close to their speed without the log.
+NEW_UID = (
+    "printf('%014x', CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER)) "
+    "|| lower(hex(randomblob(9)))"
+)
+
+# (trigger, event, table, WHEN condition, row key expression, op)
+CHANGE_TRIGGERS = (
+    ("sparks_changes_ai", "INSERT", "sparks", "new.uid IS NOT NULL", "new.uid", "upsert"),
+    ("sparks_changes_au", "UPDATE", "sparks", "new.uid IS NOT NULL", "new.uid", "upsert"),
+    ("sparks_changes_ad", "DELETE", "sparks", "old.uid IS NOT NULL", "old.uid", "delete"),
+    ("collections_changes_ai", "INSERT", "collections", "1", "new.name", "upsert"),
+    ("collections_changes_au", "UPDATE", "collections", "1", "new.name", "upsert"),
+    ("collections_changes_ad", "DELETE", "collections", "1", "old.name", "delete"),
+    # Local ids keep this trigger cheap; db.sync translates them to
+    # "<spark uid>/<collection name>" when it pushes
+    ("spark_collections_changes_ai", "INSERT", "spark_collections", "1", "new.spark_id || '/' || new.collection_id", "upsert"),
+    ("spark_collections_changes_ad", "DELETE", "spark_collections", "1", "old.spark_id || '/' || old.collection_id", "delete"),
+)
+
+
+def upgrade() -> None:
+    op.add_column('sparks', sa.Column('uid', sa.Text(), nullable=True))
+    op.create_table(
+        'changes',
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('table_name', sa.Text(), nullable=False),
+        sa.Column('row_key', sa.Text(), nullable=False),
+        sa.Column('op', sa.Text(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.Column('origin', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('seq'),
+        sqlite_autoincrement=True,
+    )
+    op.create_index('ix_changes_table_name_row_key', 'changes', ['table_name', 'row_key'], unique=False)
+    op.create_table(
+        'sync_state',
+        sa.Column('name', sa.Text(), nullable=False),
+        sa.Column('value', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+    if op.get_bind().dialect.name != "sqlite":
+        # Sync itself is SQLite-only, but keep every spark globally identifiable
+        op.execute("UPDATE sparks SET uid = md5(random()::text || clock_timestamp()::text || id::text)")
+        op.alter_column('sparks', 'uid', server_default=sa.text("md5(random()::text || clock_timestamp()::text)"))
+        op.create_index('ix_sparks_uid', 'sparks', ['uid'], unique=True)
+        return
+
+    # SQLite can't add a column with a non-constant default, so new sparks get
+    # their uid from a trigger instead. Its UPDATE is what logs the insert.
+    op.execute(f"UPDATE sparks SET uid = {NEW_UID}")
+    op.create_index('ix_sparks_uid', 'sparks', ['uid'], unique=True)
+    op.execute(
+        "CREATE TRIGGER sparks_uid_ai AFTER INSERT ON sparks WHEN new.uid IS NULL BEGIN "
+        f"UPDATE sparks SET uid = {NEW_UID} WHERE id = new.id; "
+        "END"
+    )
+    for name, event, table, condition, key, change in CHANGE_TRIGGERS:
+        op.execute(
+            f"CREATE TRIGGER {name} AFTER {event} ON {table} WHEN {condition} BEGIN "
+            f"INSERT INTO changes (table_name, row_key, op, changed_at) VALUES ('{table}', {key}, '{change}', {NOW}); "
+            "END"
+        )
+
+    # Existing rows count as changes, so the first sync pushes them
+    op.execute(
+        "INSERT INTO changes (table_name, row_key, op, changed_at) "
+        "SELECT 'collections', name, 'upsert', COALESCE(updated_at, created_at, CURRENT_TIMESTAMP) FROM collections ORDER BY id"
+    )
+    op.execute(
+        "INSERT INTO changes (table_name, row_key, op, changed_at) "
+        "SELECT 'sparks', uid, 'upsert', COALESCE(updated_at, created_at) FROM sparks ORDER BY id"
+    )
+    op.execute(
+        "INSERT INTO changes (table_name, row_key, op, changed_at) "
+        "SELECT 'spark_collections', spark_id || '/' || collection_id, 'upsert', sparks.created_at "
+        "FROM spark_collections JOIN sparks ON sparks.id = spark_collections.spark_id"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TRIGGER IF EXISTS sparks_uid_ai")
+        for name, *_ in CHANGE_TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.drop_table('sync_state')
+    op.drop_index('ix_changes_table_name_row_key', table_name='changes')
+    op.drop_table('changes')
+    op.drop_index('ix_sparks_uid', table_name='sparks')
+    # Not batch mode: recreating sparks would drop the full-text triggers
+    op.execute("ALTER TABLE sparks DROP COLUMN uid")
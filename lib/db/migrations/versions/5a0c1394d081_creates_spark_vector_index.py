@@ -0,0 +1,53 @@
+"""creates the spark vector index tables
+
+Revision ID: 5a0c1394d081
+Revises: 51881d439225
+Create Date: 2026-10-18 13:26:09.447120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a0c1394d081'
+down_revision: Union[str, None] = '51881d439225'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Clustered by inverted list, so probing a list reads neighbouring pages
+    op.create_table(
+        'spark_vectors',
+        sa.Column('list_id', sa.Integer(), nullable=False),
+        sa.Column('spark_id', sa.Integer(), nullable=False),
+        sa.Column('context_id', sa.Integer(), nullable=True),
+        sa.Column('vector', sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint('list_id', 'spark_id'),
+        sqlite_with_rowid=False,
+    )
+    op.create_index('ix_spark_vectors_spark_id', 'spark_vectors', ['spark_id'], unique=True)
+    op.create_table(
+        'vector_index',
+        sa.Column('name', sa.Text(), nullable=False),
+        sa.Column('value', sa.LargeBinary(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    if op.get_bind().dialect.name == "sqlite":
+        # Edits reach the index through the change log; deletes can't wait for it
+        op.execute(
+            "CREATE TRIGGER spark_vectors_ad AFTER DELETE ON sparks BEGIN "
+            "DELETE FROM spark_vectors WHERE spark_id = old.id; "
+            "END"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TRIGGER IF EXISTS spark_vectors_ad")
+    op.drop_table('vector_index')
+    op.drop_index('ix_spark_vectors_spark_id', table_name='spark_vectors')
+    op.drop_table('spark_vectors')
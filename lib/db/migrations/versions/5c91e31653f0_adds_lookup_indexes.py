@@ -0,0 +1,74 @@
+"""adds lookup indexes and join table primary key
+
+Revision ID: 5c91e31653f0
+Revises: 750bf6b4925d
+Create Date: 2026-10-18 10:03:17.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c91e31653f0'
+down_revision: Union[str, None] = '750bf6b4925d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Collapse duplicates onto the oldest row so the unique indexes can be built
+    op.execute(
+        "UPDATE sparks SET context_id = ("
+        "SELECT MIN(c2.id) FROM contexts c1 JOIN contexts c2 "
+        "ON c1.working_directory = c2.working_directory WHERE c1.id = sparks.context_id) "
+        "WHERE context_id IS NOT NULL"
+    )
+    op.execute(
+        "DELETE FROM contexts WHERE id NOT IN "
+        "(SELECT MIN(id) FROM contexts GROUP BY working_directory)"
+    )
+    op.execute(
+        "UPDATE spark_collections SET collection_id = ("
+        "SELECT MIN(c2.id) FROM collections c1 JOIN collections c2 "
+        "ON c1.name = c2.name WHERE c1.id = spark_collections.collection_id)"
+    )
+    op.execute(
+        "DELETE FROM collections WHERE id NOT IN "
+        "(SELECT MIN(id) FROM collections GROUP BY name)"
+    )
+    # Rebuild the join table from its distinct complete rows (portable, unlike rowid/ctid)
+    op.execute(
+        "CREATE TABLE spark_collections_dedup AS SELECT DISTINCT spark_id, collection_id "
+        "FROM spark_collections WHERE spark_id IS NOT NULL AND collection_id IS NOT NULL"
+    )
+    op.execute("DELETE FROM spark_collections")
+    op.execute(
+        "INSERT INTO spark_collections (spark_id, collection_id) "
+        "SELECT spark_id, collection_id FROM spark_collections_dedup"
+    )
+    op.execute("DROP TABLE spark_collections_dedup")
+
+    op.create_index('ix_contexts_working_directory', 'contexts', ['working_directory'], unique=True)
+    op.create_index('ix_collections_name', 'collections', ['name'], unique=True)
+    op.create_index('ix_sparks_context_id_created_at', 'sparks', ['context_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('spark_collections') as batch_op:
+        batch_op.alter_column('spark_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('collection_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('pk_spark_collections', ['spark_id', 'collection_id'])
+    op.create_index('ix_spark_collections_collection_id', 'spark_collections', ['collection_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_spark_collections_collection_id', table_name='spark_collections')
+    with op.batch_alter_table('spark_collections') as batch_op:
+        batch_op.drop_constraint('pk_spark_collections', type_='primary')
+        batch_op.alter_column('spark_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('collection_id', existing_type=sa.Integer(), nullable=True)
+
+    op.drop_index('ix_sparks_context_id_created_at', table_name='sparks')
+    op.drop_index('ix_collections_name', table_name='collections')
+    op.drop_index('ix_contexts_working_directory', table_name='contexts')
@@ -0,0 +1,62 @@
+"""creates sparks full-text index
+
+Revision ID: 750bf6b4925d
+Revises: 9fb704dad91b
+Create Date: 2026-10-18 09:12:41.204113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '750bf6b4925d'
+down_revision: Union[str, None] = '9fb704dad91b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        # PostgreSQL searches with to_tsvector/to_tsquery; index the expression
+        op.execute("CREATE INDEX ix_sparks_content_tsv ON sparks USING gin (to_tsvector('simple', content))")
+        return
+
+    # External-content FTS5 table: the text lives in sparks, the index only
+    # stores tokens, so the triggers below keep the two in step.
+    op.execute(
+        "CREATE VIRTUAL TABLE sparks_fts USING fts5("
+        "content, content='sparks', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    op.execute(
+        "CREATE TRIGGER sparks_fts_ai AFTER INSERT ON sparks BEGIN "
+        "INSERT INTO sparks_fts(rowid, content) VALUES (new.id, new.content); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER sparks_fts_ad AFTER DELETE ON sparks BEGIN "
+        "INSERT INTO sparks_fts(sparks_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER sparks_fts_au AFTER UPDATE OF content ON sparks BEGIN "
+        "INSERT INTO sparks_fts(sparks_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO sparks_fts(rowid, content) VALUES (new.id, new.content); "
+        "END"
+    )
+    # Backfill the index from the rows that already exist
+    op.execute("INSERT INTO sparks_fts(sparks_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        op.execute("DROP INDEX IF EXISTS ix_sparks_content_tsv")
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS sparks_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS sparks_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS sparks_fts_ai")
+    op.execute("DROP TABLE IF EXISTS sparks_fts")
@@ -0,0 +1,160 @@
+"""adds materialized per-context, per-collection and daily spark stats
+
+Revision ID: 8983d5e820cd
+Revises: 500f1700168d
+Create Date: 2026-10-18 15:37:20.118532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8983d5e820cd'
+down_revision: Union[str, None] = '500f1700168d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def context_added(row):
+    return (
+        "INSERT INTO context_stats (context_id, sparks, first_at, last_at) "
+        f"SELECT {row}.context_id, 1, {row}.created_at, {row}.created_at WHERE {row}.context_id IS NOT NULL "
+        "ON CONFLICT (context_id) DO UPDATE SET sparks = sparks + 1, "
+        "first_at = MIN(first_at, excluded.first_at), last_at = MAX(last_at, excluded.last_at); "
+        "INSERT INTO spark_daily (context_id, day, sparks) "
+        f"SELECT {row}.context_id, date({row}.created_at), 1 WHERE {row}.context_id IS NOT NULL "
+        "ON CONFLICT (context_id, day) DO UPDATE SET sparks = sparks + 1; "
+    )
+
+
+def context_removed(row):
+    # Bounds are looked up again (an index seek) only when the row held one
+    bounds = f"FROM sparks WHERE sparks.context_id = {row}.context_id"
+    return (
+        "UPDATE context_stats SET sparks = sparks - 1, "
+        f"first_at = CASE WHEN {row}.created_at > first_at THEN first_at ELSE (SELECT MIN(sparks.created_at) {bounds}) END, "
+        f"last_at = CASE WHEN {row}.created_at < last_at THEN last_at ELSE (SELECT MAX(sparks.created_at) {bounds}) END "
+        f"WHERE context_id = {row}.context_id; "
+        f"DELETE FROM context_stats WHERE context_id = {row}.context_id AND sparks <= 0; "
+        f"UPDATE spark_daily SET sparks = sparks - 1 WHERE context_id = {row}.context_id AND day = date({row}.created_at); "
+        f"DELETE FROM spark_daily WHERE context_id = {row}.context_id AND day = date({row}.created_at) AND sparks <= 0; "
+    )
+
+
+def collection_bounds(collection_id):
+    members = (
+        "FROM spark_collections JOIN sparks ON sparks.id = spark_collections.spark_id "
+        f"WHERE spark_collections.collection_id = {collection_id}"
+    )
+    return f"(SELECT MIN(sparks.created_at) {members})", f"(SELECT MAX(sparks.created_at) {members})"
+
+
+def collection_removed(collection_id, created_at, condition):
+    first, last = collection_bounds(collection_id)
+    return (
+        "UPDATE collection_stats SET sparks = sparks - 1, "
+        f"first_at = CASE WHEN {created_at} > first_at THEN first_at ELSE {first} END, "
+        f"last_at = CASE WHEN {created_at} < last_at THEN last_at ELSE {last} END "
+        f"WHERE {condition}; "
+        f"DELETE FROM collection_stats WHERE {condition} AND sparks <= 0; "
+    )
+
+
+FIRST, LAST = collection_bounds("collection_stats.collection_id")
+
+# A collection counts the memberships whose spark exists, whichever of the
+# two rows is deleted first
+TRIGGERS = {
+    "sparks_stats_ai": "AFTER INSERT ON sparks BEGIN " + context_added("new") + "END",
+    "sparks_stats_ad": (
+        "AFTER DELETE ON sparks BEGIN " + context_removed("old")
+        + collection_removed(
+            "collection_stats.collection_id", "old.created_at",
+            "collection_id IN (SELECT collection_id FROM spark_collections WHERE spark_id = old.id)",
+        )
+        + "END"
+    ),
+    "sparks_stats_au": (
+        "AFTER UPDATE OF context_id, created_at ON sparks "
+        "WHEN old.context_id IS NOT new.context_id OR old.created_at IS NOT new.created_at BEGIN "
+        + context_removed("old") + context_added("new")
+        + f"UPDATE collection_stats SET first_at = {FIRST}, last_at = {LAST} "
+        "WHERE collection_id IN (SELECT collection_id FROM spark_collections WHERE spark_id = new.id); "
+        "END"
+    ),
+    "spark_collections_stats_ai": (
+        "AFTER INSERT ON spark_collections BEGIN "
+        "INSERT INTO collection_stats (collection_id, sparks, first_at, last_at) "
+        "SELECT new.collection_id, 1, created_at, created_at FROM sparks WHERE id = new.spark_id "
+        "ON CONFLICT (collection_id) DO UPDATE SET sparks = sparks + 1, "
+        "first_at = MIN(first_at, excluded.first_at), last_at = MAX(last_at, excluded.last_at); "
+        "END"
+    ),
+    "spark_collections_stats_ad": (
+        "AFTER DELETE ON spark_collections BEGIN "
+        + collection_removed(
+            "old.collection_id", "(SELECT created_at FROM sparks WHERE id = old.spark_id)",
+            "collection_id = old.collection_id AND EXISTS (SELECT 1 FROM sparks WHERE id = old.spark_id)",
+        )
+        + "END"
+    ),
+    "collections_stats_ad": "AFTER DELETE ON collections BEGIN DELETE FROM collection_stats WHERE collection_id = old.id; END",
+}
+
+
+def upgrade() -> None:
+    op.create_table(
+        'context_stats',
+        sa.Column('context_id', sa.Integer(), nullable=False),
+        sa.Column('sparks', sa.Integer(), nullable=False),
+        sa.Column('first_at', sa.DateTime(), nullable=True),
+        sa.Column('last_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('context_id'),
+    )
+    op.create_table(
+        'collection_stats',
+        sa.Column('collection_id', sa.Integer(), nullable=False),
+        sa.Column('sparks', sa.Integer(), nullable=False),
+        sa.Column('first_at', sa.DateTime(), nullable=True),
+        sa.Column('last_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('collection_id'),
+    )
+    op.create_table(
+        'spark_daily',
+        sa.Column('context_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('sparks', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('context_id', 'day'),
+        sqlite_with_rowid=False,
+    )
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    for name, body in TRIGGERS.items():
+        op.execute(f"CREATE TRIGGER {name} {body}")
+    # Same queries as db.stats.rebuild
+    op.execute(
+        "INSERT INTO context_stats SELECT context_id, COUNT(*), MIN(created_at), MAX(created_at) "
+        "FROM sparks WHERE context_id IS NOT NULL GROUP BY context_id"
+    )
+    op.execute(
+        "INSERT INTO collection_stats SELECT collection_id, COUNT(*), MIN(sparks.created_at), MAX(sparks.created_at) "
+        "FROM spark_collections JOIN sparks ON sparks.id = spark_collections.spark_id "
+        "WHERE collection_id IN (SELECT id FROM collections) GROUP BY collection_id"
+    )
+    op.execute(
+        "INSERT INTO spark_daily SELECT context_id, date(created_at), COUNT(*) "
+        "FROM sparks WHERE context_id IS NOT NULL GROUP BY context_id, date(created_at)"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        for name in TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.drop_table('spark_daily')
+    op.drop_table('collection_stats')
+    op.drop_table('context_stats')
@@ -0,0 +1,46 @@
+"""creates spark_revisions for the edit history of sparks
+
+Revision ID: c9315638fe6e
+Revises: 392ba91cb24a
+Create Date: 2026-10-18 17:05:12.481907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9315638fe6e'
+down_revision: Union[str, None] = '392ba91cb24a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Clustered by spark, so a spark's history is one range scan
+    op.create_table(
+        'spark_revisions',
+        sa.Column('spark_id', sa.Integer(), nullable=False),
+        sa.Column('rev', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.Column('snapshot', sa.Boolean(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['spark_id'], ['sparks.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('spark_id', 'rev'),
+        sqlite_with_rowid=False,
+    )
+    if op.get_bind().dialect.name == "sqlite":
+        # SQLite doesn't enforce the foreign key unless asked to
+        op.execute(
+            "CREATE TRIGGER spark_revisions_ad AFTER DELETE ON sparks BEGIN "
+            "DELETE FROM spark_revisions WHERE spark_id = old.id; "
+            "END"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TRIGGER IF EXISTS spark_revisions_ad")
+    op.drop_table('spark_revisions')
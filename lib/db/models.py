@@ -1,5 +1,5 @@
-from sqlalchemy import func
-from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey, Table
+from sqlalchemy import func, text
+from sqlalchemy import Column, Integer, BigInteger, Boolean, Text, Date, DateTime, LargeBinary, ForeignKey, Table, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 
@@ -8,37 +8,133 @@ Base = declarative_base()
 spark_collection = Table(
     "spark_collections",
     Base.metadata,
-    Column("spark_id", Integer(), ForeignKey("sparks.id")),
-    Column("collection_id", Integer(), ForeignKey("collections.id"))
+    Column("spark_id", Integer(), ForeignKey("sparks.id", ondelete="CASCADE"), primary_key=True),
+    Column("collection_id", Integer(), ForeignKey("collections.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_spark_collections_collection_id_spark_id", "collection_id", "spark_id")
 )
 
 class Context(Base):
     __tablename__ = "contexts"
 
     id = Column(Integer(), primary_key=True)
-    working_directory = Column(Text(), nullable=False)
+    working_directory = Column(Text(), nullable=False, unique=True, index=True)
     project_name = Column(Text())
     created_at = Column(DateTime(), server_default=func.now())
 
 class Spark(Base):
     __tablename__ = "sparks"
+    __table_args__ = (
+        Index("ix_sparks_context_id_created_at", "context_id", "created_at"),
+        Index("ix_sparks_created_at", "created_at"),
+        Index(
+            "ix_sparks_deleted_at", "deleted_at",
+            sqlite_where=text("deleted_at IS NOT NULL"), postgresql_where=text("deleted_at IS NOT NULL"),
+        ),
+    )
 
     id = Column(Integer(), primary_key=True)
     content = Column(Text(), nullable=False)
     created_at = Column(DateTime(), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(), onupdate=func.now())
     context_id = Column(Integer(), ForeignKey("contexts.id"))
+    # Identifies the spark across synced replicas; assigned by the database
+    uid = Column(Text(), index=True, unique=True)
+    # Set by `spark delete`; the row stays (and can be restored) until `spark gc`
+    deleted_at = Column(DateTime())
 
     context = relationship("Context", backref=backref("spark"))
     collections = relationship("Collection", secondary=spark_collection, back_populates="sparks")
 
+class SparkRevision(Base):
+    """One version of an edited spark: a full snapshot or a delta against the one before (see db.revisions)."""
+    __tablename__ = "spark_revisions"
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+    spark_id = Column(Integer(), ForeignKey("sparks.id", ondelete="CASCADE"), primary_key=True)
+    rev = Column(Integer(), primary_key=True)
+    created_at = Column(DateTime(), server_default=func.now(), nullable=False)
+    snapshot = Column(Boolean(), nullable=False)
+    data = Column(LargeBinary(), nullable=False)
+
 class Collection(Base):
     __tablename__ = "collections"
 
     id = Column(Integer(), primary_key=True)
-    name = Column(Text(), nullable=False)
+    name = Column(Text(), nullable=False, unique=True, index=True)
     description = Column(Text())
     created_at = Column(DateTime(), server_default=func.now())
     updated_at = Column(DateTime(), onupdate=func.now())
 
-    sparks = relationship("Spark", secondary=spark_collection, back_populates="collections")
\ No newline at end of file
+    sparks = relationship("Spark", secondary=spark_collection, back_populates="collections")
+
+class Change(Base):
+    """One row of the sync change log, written by triggers (see db.sync)."""
+    __tablename__ = "changes"
+    __table_args__ = (
+        Index("ix_changes_table_name_row_key", "table_name", "row_key"),
+        {"sqlite_autoincrement": True},
+    )
+
+    seq = Column(Integer(), primary_key=True)
+    table_name = Column(Text(), nullable=False)
+    row_key = Column(Text(), nullable=False)
+    op = Column(Text(), nullable=False)
+    changed_at = Column(DateTime(), server_default=func.now(), nullable=False)
+    # Replica the change was pulled from; NULL for changes made here
+    origin = Column(Text())
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    name = Column(Text(), primary_key=True)
+    value = Column(Text())
+
+class SparkVector(Base):
+    """Quantized embedding of a spark, filed under its IVF list (see db.semantic)."""
+    __tablename__ = "spark_vectors"
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+    list_id = Column(Integer(), primary_key=True)
+    spark_id = Column(Integer(), primary_key=True, index=True, unique=True)
+    context_id = Column(Integer())
+    vector = Column(LargeBinary(), nullable=False)
+
+class VectorIndex(Base):
+    __tablename__ = "vector_index"
+
+    name = Column(Text(), primary_key=True)
+    value = Column(LargeBinary())
+
+class SparkLSH(Base):
+    """One MinHash LSH band bucket of a spark (see db.dedupe)."""
+    __tablename__ = "spark_lsh"
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+    bucket = Column(BigInteger(), primary_key=True)
+    spark_id = Column(Integer(), primary_key=True, index=True)
+
+class ContextStats(Base):
+    """Spark count and first/last created_at per context, kept by triggers (see db.stats)."""
+    __tablename__ = "context_stats"
+
+    context_id = Column(Integer(), primary_key=True)
+    sparks = Column(Integer(), nullable=False)
+    first_at = Column(DateTime())
+    last_at = Column(DateTime())
+
+class CollectionStats(Base):
+    __tablename__ = "collection_stats"
+
+    collection_id = Column(Integer(), primary_key=True)
+    sparks = Column(Integer(), nullable=False)
+    first_at = Column(DateTime())
+    last_at = Column(DateTime())
+
+class SparkDaily(Base):
+    """Sparks created per context and day."""
+    __tablename__ = "spark_daily"
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+    context_id = Column(Integer(), primary_key=True)
+    day = Column(Date(), primary_key=True)
+    sparks = Column(Integer(), nullable=False)
\ No newline at end of file
@@ -0,0 +1,471 @@
+# query.py
+# The filter language behind `spark list`, compiled to a single SQL query.
+#
+#   collection:bugs AND created>2026-01-01 AND text:auth
+#   (collection:bugs OR collection:perf) -text:wontfix sort:-created limit:20
+#
+# Terms are field:value (or field>value, >=, <, <=, =, != for created, updated
+# and id), bare words and "quoted phrases" (full-text match), combined with
+# AND (also implied by juxtaposition), OR, NOT / a leading '-', and
+# parentheses. sort:, order: and limit: set the ordering and page size.
+#
+# Every term becomes a WHERE fragment over indexed columns or an IN
+# (subquery) on an indexed table, so nothing is filtered in Python. Plans are
+# cached per (expression, dialect); values that depend on the clock or the
+# timezone, like created:today, are resolved when the plan is bound, not
+# when it's cached.
+#
+# Dates are read in the local timezone (SPARK_TIMEZONE, else the system's)
+# and turned into half-open [start, end) UTC bounds, the form timestamps are
+# stored in, so date filters are range scans on ix_sparks_context_id_created_at
+# (or ix_sparks_created_at across contexts) whatever the store's size.
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+FIELDS = {
+    "collection": "collection", "c": "collection", "in": "collection",
+    "context": "context", "ctx": "context", "dir": "context",
+    "project": "project",
+    "text": "text",
+    "created": "created", "date": "created",
+    "updated": "updated",
+    "id": "id",
+}
+DIRECTIVES = ("sort", "order", "limit")
+SORT_KEYS = {
+    "created": "sparks.created_at",
+    "id": "sparks.id",
+    "updated": "COALESCE(sparks.updated_at, sparks.created_at)",
+}
+TERM = re.compile(r"^(-?)([A-Za-z_]+)(>=|<=|!=|:|=|>|<)(.*)$", re.S)
+SPARK_COLUMNS = "sparks.id, sparks.content, sparks.created_at, sparks.updated_at, sparks.context_id"
+
+class QueryError(ValueError):
+    pass
+
+# Parsing
+
+def tokenize(expression):
+    """Split into '(' / ')' and terms; "quoted" sections may hold spaces and parens."""
+    tokens, i = [], 0
+    while i < len(expression):
+        char = expression[i]
+        if char.isspace():
+            i += 1
+        elif char in "()":
+            tokens.append(char)
+            i += 1
+        else:
+            start = i
+            while i < len(expression) and not expression[i].isspace() and expression[i] not in "()":
+                if expression[i] == '"':
+                    end = expression.find('"', i + 1)
+                    if end < 0:
+                        raise QueryError("Unterminated quote")
+                    i = end
+                i += 1
+            tokens.append(expression[start:i])
+    return tokens
+
+def _unquote(value):
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+def _term(token):
+    """Node for one token: ('term', field, op, value), possibly wrapped in ('not', ...).
+
+    Unknown field names are not errors; "foo:bar" is searched as text.
+    """
+    match = TERM.match(token)
+    if match and (match.group(2).lower() in FIELDS or match.group(2).lower() in DIRECTIVES):
+        negated, field, op, value = match.groups()
+        field, value = field.lower(), _unquote(value)
+        if field in DIRECTIVES:
+            if negated or op != ":":
+                raise QueryError(f"Use {field}:value")
+            return ("directive", field, value)
+        node = ("term", FIELDS[field], op, value)
+        return ("not", node) if negated else node
+    if token.startswith("-") and len(token) > 1:
+        return ("not", ("term", "text", ":", token[1:]))
+    return ("term", "text", ":", token)
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == "OR":
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() not in (None, ")", "OR"):
+            if self.peek() == "AND":
+                self.take()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not(self):
+        if self.peek() == "NOT":
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.take()
+        if token is None or token in ("AND", "OR", ")"):
+            raise QueryError(f"Expected a term, got {token or 'end of query'}")
+        if token == "(":
+            node = self.parse_or()
+            if self.take() != ")":
+                raise QueryError("Missing ')'")
+            return node
+        return _term(token)
+
+def parse(expression):
+    """Parse into (tree or None, {directive: value}); directives must be top-level terms."""
+    tokens = tokenize(expression)
+    if not tokens:
+        return None, {}
+    parser = _Parser(tokens)
+    tree = parser.parse_or()
+    if parser.peek() is not None:
+        raise QueryError(f"Unexpected '{parser.peek()}'")
+
+    top = tree[1] if tree[0] == "and" else [tree]
+    directives = {node[1]: node[2] for node in top if node[0] == "directive"}
+    nodes = [node for node in top if node[0] != "directive"]
+    if any(_has_directive(node) for node in nodes):
+        raise QueryError("sort:, order: and limit: can't be inside OR, NOT or parentheses")
+    tree = None if not nodes else nodes[0] if len(nodes) == 1 else ("and", nodes)
+    return tree, directives
+
+def _has_directive(node):
+    if node[0] == "directive":
+        return True
+    if node[0] in ("and", "or"):
+        return any(_has_directive(child) for child in node[1])
+    if node[0] == "not":
+        return _has_directive(node[1])
+    return False
+
+# Values
+
+def build_tsquery(search_term):
+    """PostgreSQL counterpart of db.lite.build_fts_query: prefix* and "phrase" terms, AND-ed."""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', search_term):
+        if phrase:
+            words = re.findall(r"\w+", phrase)
+            if words:
+                terms.append("(" + " <-> ".join(words) + ")")
+        elif word:
+            words = re.findall(r"\w+", word)
+            if words:
+                suffix = ":*" if word.endswith("*") else ""
+                terms.append(" & ".join(words[:-1] + [words[-1] + suffix]))
+    return " & ".join(terms)
+
+RELATIVE = re.compile(r"^(\d+)([hdw])$")
+DATE_FORMATS = (
+    ("%Y-%m-%dT%H:%M:%S", timedelta(seconds=1)),
+    ("%Y-%m-%d %H:%M:%S", timedelta(seconds=1)),
+    ("%Y-%m-%dT%H:%M", timedelta(minutes=1)),
+    ("%Y-%m-%d", timedelta(days=1)),
+)
+
+def now():
+    # Stored timestamps are UTC (CURRENT_TIMESTAMP / func.now())
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+def local_timezone(name=None):
+    """The zone dates are read in: `name`, else SPARK_TIMEZONE, else None (the system's)."""
+    name = name or os.environ.get("SPARK_TIMEZONE")
+    if not name:
+        return None
+    from zoneinfo import ZoneInfo
+    try:
+        return ZoneInfo(name)
+    except (KeyError, ValueError, OSError):
+        raise QueryError(f"Unknown timezone '{name}' (use an IANA name like Europe/Berlin)")
+
+def to_utc(local, tz=None):
+    """Naive wall-clock time in `tz` (None: the system zone) as naive UTC."""
+    aware = local.replace(tzinfo=tz) if tz else local.astimezone()
+    return aware.astimezone(timezone.utc).replace(tzinfo=None)
+
+def to_local(stored, tz=None):
+    """Naive UTC timestamp as naive wall-clock time in `tz` (None: the system zone)."""
+    return stored.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
+
+def local_midnight(tz=None):
+    return datetime.now(tz).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+
+def date_bounds(value):
+    """Return a function of the timezone giving the UTC [start, end) interval `value` denotes.
+
+    Dates cover their whole local day (or month/year for 2026-01 / 2026),
+    "today" and "yesterday" are days, "week" is the week so far from Monday,
+    and 3h/7d/2w run from that long ago until now. Days are shifted to UTC
+    at their own midnights, so a DST change shortens or lengthens them.
+    """
+    value = value.lower()
+    if value in ("today", "yesterday", "week"):
+        def bounds(tz=None):
+            start, length = local_midnight(tz), timedelta(days=1)
+            if value == "yesterday":
+                start -= length
+            elif value == "week":
+                start, length = start - timedelta(days=start.weekday()), timedelta(weeks=1)
+            return to_utc(start, tz), to_utc(start + length, tz)
+        return bounds
+    match = RELATIVE.match(value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        delta = {"h": timedelta(hours=amount), "d": timedelta(days=amount), "w": timedelta(weeks=amount)}[unit]
+        def bounds(tz=None):
+            # Through the current second: bounds are bound as whole seconds
+            end = now() + timedelta(seconds=1)
+            return end - delta, end
+        return bounds
+    for pattern, length in DATE_FORMATS:
+        try:
+            start = datetime.strptime(value.upper() if "t" in value else value, pattern)
+        except ValueError:
+            continue
+        return lambda tz=None: (to_utc(start, tz), to_utc(start + length, tz))
+    if re.match(r"^\d{4}-\d{2}$", value):
+        year, month = map(int, value.split("-"))
+        start = datetime(year, month, 1)
+        end = datetime(year + month // 12, month % 12 + 1, 1)
+        return lambda tz=None: (to_utc(start, tz), to_utc(end, tz))
+    if re.match(r"^\d{4}$", value):
+        start, end = datetime(int(value), 1, 1), datetime(int(value) + 1, 1, 1)
+        return lambda tz=None: (to_utc(start, tz), to_utc(end, tz))
+    raise QueryError(f"Invalid date '{value}' (use YYYY-MM-DD, today, yesterday, week or 7d/12h/2w)")
+
+# Compiling
+
+class _Compiler:
+    def __init__(self, dialect):
+        self.dialect = dialect
+        self.params = {}
+        self.deferred = {}
+        self.uses_context = False
+        self.scoped = True
+
+    def param(self, value):
+        name = f"p{len(self.params) + len(self.deferred)}"
+        self.params[name] = value
+        return f":{name}"
+
+    def deferred_param(self, resolve):
+        name = f"p{len(self.params) + len(self.deferred)}"
+        self.deferred[name] = resolve
+        return f":{name}"
+
+    def compile(self, node):
+        kind = node[0]
+        if kind == "and":
+            return "(" + " AND ".join(self.compile(child) for child in node[1]) + ")"
+        if kind == "or":
+            return "(" + " OR ".join(self.compile(child) for child in node[1]) + ")"
+        if kind == "not":
+            return f"NOT {self.compile(node[1])}"
+        _, field, op, value = node
+        return getattr(self, f"compile_{field}")(op, value)
+
+    def _equality(self, field, op, fragment):
+        if op not in (":", "=", "!="):
+            raise QueryError(f"{field}: only supports ':' and '!='")
+        return f"NOT {fragment}" if op == "!=" else fragment
+
+    def compile_collection(self, op, value):
+        # IN (subquery) lands on ix_spark_collections_collection_id_spark_id
+        fragment = (
+            "sparks.id IN (SELECT spark_collections.spark_id FROM spark_collections "
+            "JOIN collections ON collections.id = spark_collections.collection_id "
+            f"WHERE collections.name = {self.param(value)})"
+        )
+        return self._equality("collection", op, fragment)
+
+    def compile_context(self, op, value):
+        self.scoped = False
+        if value in ("*", "all"):
+            return self._equality("context", op, "1 = 1")
+        if value == ".":
+            self.uses_context = True
+            return self._equality("context", op, "sparks.context_id = :current_context")
+        import os
+        path = os.path.expanduser(value).rstrip("/") or "/"
+        fragment = f"sparks.context_id IN (SELECT id FROM contexts WHERE working_directory = {self.param(path)})"
+        return self._equality("context", op, fragment)
+
+    def compile_project(self, op, value):
+        self.scoped = False
+        fragment = f"sparks.context_id IN (SELECT id FROM contexts WHERE project_name = {self.param(value)})"
+        return self._equality("project", op, fragment)
+
+    def compile_text(self, op, value):
+        if self.dialect == "sqlite":
+            from db.lite import build_fts_query
+            fts_query = build_fts_query(value)
+            if not fts_query:
+                raise QueryError(f"Nothing to search for in '{value}'")
+            fragment = f"sparks.id IN (SELECT rowid FROM sparks_fts WHERE sparks_fts MATCH {self.param(fts_query)})"
+        else:
+            ts_query = build_tsquery(value)
+            if not ts_query:
+                raise QueryError(f"Nothing to search for in '{value}'")
+            # Matches the expression indexed by ix_sparks_content_tsv
+            fragment = f"to_tsvector('simple', sparks.content) @@ to_tsquery('simple', {self.param(ts_query)})"
+        return self._equality("text", op, fragment)
+
+    def compile_id(self, op, value):
+        def number(text):
+            if not text.isdigit():
+                raise QueryError(f"Invalid spark ID '{text}'")
+            return int(text)
+        if op in (":", "=") and ".." in value:
+            low, high = value.split("..", 1)
+            bounds = []
+            if low:
+                bounds.append(f"sparks.id >= {self.param(number(low))}")
+            if high:
+                bounds.append(f"sparks.id <= {self.param(number(high))}")
+            return "(" + " AND ".join(bounds or ["1 = 1"]) + ")"
+        sql_op = {":": "=", "=": "="}.get(op, op)
+        return f"sparks.id {sql_op} {self.param(number(value))}"
+
+    def compile_created(self, op, value, column="sparks.created_at"):
+        # Compared with, 7d is the instant it starts at: created>7d is newer than that
+        end = lambda value: 0 if RELATIVE.match(value.lower()) else 1
+        if op in (":", "=") and ".." in value:
+            low, high = value.split("..", 1)
+            bounds = []
+            if low:
+                bounds.append(f"{column} >= {self.bound(low, 0)}")
+            if high:
+                bounds.append(f"{column} < {self.bound(high, end(high))}")
+            return "(" + " AND ".join(bounds or ["1 = 1"]) + ")"
+        # Half-open intervals: created>2026-01-01 means after that whole day
+        if op in (":", "="):
+            return f"({column} >= {self.bound(value, 0)} AND {column} < {self.bound(value, 1)})"
+        if op == "!=":
+            return f"NOT ({column} >= {self.bound(value, 0)} AND {column} < {self.bound(value, 1)})"
+        if op == ">":
+            return f"{column} >= {self.bound(value, end(value))}"
+        if op == ">=":
+            return f"{column} >= {self.bound(value, 0)}"
+        if op == "<":
+            return f"{column} < {self.bound(value, 0)}"
+        return f"{column} < {self.bound(value, end(value))}"
+
+    def compile_updated(self, op, value):
+        return self.compile_created(op, value, column="sparks.updated_at")
+
+    def bound(self, value, side):
+        bounds = date_bounds(value)
+        return self.deferred_param(lambda tz: bounds(tz)[side])
+
+class Plan:
+    """A compiled `list` query; statement() binds the per-run values."""
+
+    def __init__(self, dialect, where, params, deferred, scoped, uses_context, sort, descending, limit):
+        self.dialect = dialect
+        self.where = where
+        self.params = params
+        self.deferred = deferred
+        self.scoped = scoped
+        self.needs_context = scoped or uses_context
+        self.sort = sort
+        self.descending = descending
+        self.limit = limit
+
+    def statement(self, context_id=None, after_id=None, limit=None, reverse=False, timezone=None):
+        """Return (sql, params) with :named placeholders (sqlite3 and SQLAlchemy text() both take them).
+
+        Dates are read in `timezone` (an IANA name), else in local_timezone().
+        """
+        params = dict(self.params)
+        tz = local_timezone(timezone) if self.deferred else None
+        for name, resolve in self.deferred.items():
+            value = resolve(tz)
+            params[name] = value.strftime("%Y-%m-%d %H:%M:%S") if self.dialect == "sqlite" else value
+        # Deleted sparks (tombstones awaiting `spark gc`) never show up
+        criteria = ([self.where] if self.where else []) + ["sparks.deleted_at IS NULL"]
+        if self.needs_context:
+            if context_id is None:
+                raise QueryError("This query needs the current context")
+            params["current_context"] = context_id
+        if self.scoped:
+            criteria.append("sparks.context_id = :current_context")
+
+        descending = self.descending != reverse
+        op, direction = ("<", "DESC") if descending else (">", "ASC")
+        key = SORT_KEYS[self.sort]
+        if after_id is not None:
+            if self.sort == "id":
+                criteria.append(f"sparks.id {op} :after_id")
+            else:
+                # Keyset pagination on (sort key, id), seeded from the last row shown
+                criteria.append(
+                    f"({key}, sparks.id) {op} (SELECT {key}, sparks.id FROM sparks WHERE sparks.id = :after_id)"
+                )
+            params["after_id"] = after_id
+
+        sql = f"SELECT {SPARK_COLUMNS} FROM sparks WHERE " + " AND ".join(criteria)
+        sql += f" ORDER BY {key} {direction}" + ("" if self.sort == "id" else f", sparks.id {direction}")
+        limit = self.limit if limit is None else limit
+        if limit is not None:
+            sql += " LIMIT :limit"
+            params["limit"] = limit
+        return sql, params
+
+@lru_cache(maxsize=256)
+def compile_query(expression, dialect="sqlite", filters=()):
+    """Parse and plan `expression` for `dialect` ("sqlite" or "postgresql").
+
+    `filters` are extra expressions AND-ed with the whole of `expression`
+    (a tuple, so plans stay cacheable), e.g. from `list --collection`.
+    """
+    tree, directives = parse(expression or "")
+    nodes = [tree] if tree else []
+    for extra in filters:
+        extra_tree, extra_directives = parse(extra)
+        nodes.extend([extra_tree] if extra_tree else [])
+        directives = {**extra_directives, **directives}
+    tree = None if not nodes else nodes[0] if len(nodes) == 1 else ("and", nodes)
+    compiler = _Compiler(dialect)
+    where = compiler.compile(tree) if tree else None
+
+    sort = directives.get("sort", "created").lower()
+    descending = sort.startswith("-")
+    sort = sort.lstrip("-")
+    if sort not in SORT_KEYS:
+        raise QueryError(f"Unknown sort '{sort}' (choose from {', '.join(SORT_KEYS)})")
+    order = directives.get("order", "desc" if descending else "asc").lower()
+    if order not in ("asc", "desc"):
+        raise QueryError("order: must be asc or desc")
+    limit = directives.get("limit")
+    if limit is not None and not limit.isdigit():
+        raise QueryError(f"Invalid limit '{limit}'")
+
+    return Plan(
+        dialect, where, compiler.params, compiler.deferred, compiler.scoped, compiler.uses_context,
+        sort, order == "desc", None if limit is None else int(limit),
+    )
@@ -0,0 +1,197 @@
+# revisions.py
+# Edit history of sparks, kept in spark_revisions as compressed deltas.
+#
+# A spark gets revisions on its first edit: r1 is the text it had until then
+# and every edit appends the new text as the next revision, so the newest
+# revision matches sparks.content. Most rows are deltas against the revision
+# before them: copy runs of the previous text and inserted text, found by
+# diffing words rather than characters (difflib is quadratic in the worst
+# case), and only between the common prefix and suffix, deflated when that
+# makes them smaller. A full snapshot starts a new chain once the deltas
+# since the last one add up to more than the snapshot would take, or after
+# CHAIN deltas, so rebuilding any revision reads at most one snapshot plus a
+# bounded run of small rows (the revlog rule).
+#
+# Edits that bypass update_spark (sync, raw SQL) leave no revision. The next
+# recorded edit notices that the newest revision no longer matches and files
+# the text it finds first, so the chain always ends at the current content.
+#
+# Works on both backends through the ORM session; deleting a spark deletes
+# its revisions (a trigger on SQLite, ON DELETE CASCADE on PostgreSQL).
+import re
+import zlib
+
+from sqlalchemy import func, insert, select
+
+from db.models import Spark, SparkRevision
+
+# Deltas between two snapshots, at most
+CHAIN = 16
+
+STORED, DEFLATED = b"\x00", b"\x01"
+# Words and punctuation with the whitespace after them
+TOKEN = re.compile(r"\w+\s*|[^\w\s]\s*|\s+")
+
+def _varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def pack(payload):
+    """Deflate `payload` (raw, no header) when that saves space; the first byte says which."""
+    deflater = zlib.compressobj(9, zlib.DEFLATED, -15)
+    deflated = deflater.compress(payload) + deflater.flush()
+    return DEFLATED + deflated if len(deflated) < len(payload) else STORED + payload
+
+def unpack(data):
+    data = bytes(data)
+    return zlib.decompress(data[1:], -15) if data[:1] == DEFLATED else data[1:]
+
+def diff(old, new):
+    """Delta turning `old` into `new`: varint ops, (length << 1) then an offset into
+    `old` to copy, or (byte length << 1 | 1) then UTF-8 text to insert."""
+    from difflib import SequenceMatcher
+
+    # Only the part between the common prefix and suffix is diffed; most
+    # edits touch one place, and this keeps difflib off long texts
+    start, limit = 0, min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    old_tokens = TOKEN.findall(old, start, len(old) - end)
+    new_tokens = TOKEN.findall(new, start, len(new) - end)
+    starts = [start]
+    for token in old_tokens:
+        starts.append(starts[-1] + len(token))
+    out, pending = bytearray(), []
+
+    def copy(offset, length):
+        if length:
+            _varint(length << 1, out)
+            _varint(offset, out)
+
+    def flush():
+        if pending:
+            text = "".join(pending).encode()
+            _varint(len(text) << 1 | 1, out)
+            out.extend(text)
+            pending.clear()
+
+    copy(0, start)
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            flush()
+            copy(starts[i1], starts[i2] - starts[i1])
+        elif j2 > j1:
+            pending.extend(new_tokens[j1:j2])
+    flush()
+    copy(len(old) - end, end)
+    return bytes(out)
+
+def patch(old, delta):
+    parts, position = [], 0
+    while position < len(delta):
+        op, position = _read_varint(delta, position)
+        if op & 1:
+            end = position + (op >> 1)
+            parts.append(delta[position:end].decode())
+            position = end
+        else:
+            offset, position = _read_varint(delta, position)
+            parts.append(old[offset:offset + (op >> 1)])
+    return "".join(parts)
+
+def _chain(session, spark_id, rev=None):
+    """Rows from the snapshot at or before `rev` (default: the newest) up to `rev`."""
+    upto = [SparkRevision.spark_id == spark_id]
+    if rev is not None:
+        upto.append(SparkRevision.rev <= rev)
+    base = select(func.max(SparkRevision.rev)).where(*upto, SparkRevision.snapshot.is_(True)).scalar_subquery()
+    return session.execute(
+        select(SparkRevision.rev, SparkRevision.snapshot, SparkRevision.data)
+        .where(*upto, SparkRevision.rev >= base).order_by(SparkRevision.rev)
+    ).all()
+
+def _replay(rows):
+    """Text of the last row of a chain, with the bytes of the deltas after its snapshot."""
+    text, delta_bytes = None, 0
+    for row in rows:
+        if row.snapshot:
+            text, delta_bytes = unpack(row.data).decode(), 0
+        else:
+            text = patch(text, unpack(row.data))
+            delta_bytes += len(row.data)
+    return text, delta_bytes
+
+def content_at(session, spark_id, rev):
+    """Text of revision `rev` of the spark, or None if it has no such revision."""
+    rows = _chain(session, spark_id, rev)
+    if not rows or rows[-1].rev != rev:
+        return None
+    return _replay(rows)[0]
+
+def latest(session, spark_id):
+    """Number of the spark's newest revision; 0 if it was never edited."""
+    return session.execute(select(func.max(SparkRevision.rev)).where(SparkRevision.spark_id == spark_id)).scalar() or 0
+
+def history(session, spark_id):
+    """[(rev, created_at, text)] oldest first, rebuilt in one pass over the spark's revisions."""
+    rows = session.execute(
+        select(SparkRevision.rev, SparkRevision.created_at, SparkRevision.snapshot, SparkRevision.data)
+        .where(SparkRevision.spark_id == spark_id).order_by(SparkRevision.rev)
+    ).all()
+    revisions, text = [], None
+    for row in rows:
+        text = unpack(row.data).decode() if row.snapshot else patch(text, unpack(row.data))
+        revisions.append((row.rev, row.created_at, text))
+    return revisions
+
+def record(session, spark_id, content):
+    """File `content` as the spark's next revision, before the caller saves it.
+
+    Adds r1 with the current text first if the spark has no revisions yet (or
+    if it was edited without one since), and leaves committing to the caller.
+    """
+    # From the database: the identity cache may hold an older text
+    spark = session.execute(
+        select(Spark.content, Spark.created_at, Spark.updated_at).where(Spark.id == spark_id)
+    ).one()
+    rows = _chain(session, spark_id)
+    rev = rows[-1].rev if rows else 0
+    text, delta_bytes = _replay(rows) if rows else (None, 0)
+    chain = sum(1 for row in rows if not row.snapshot)
+    values = []
+    for at, new in ((spark.updated_at or spark.created_at, spark.content), (None, content)):
+        if new == text:
+            continue
+        rev += 1
+        snapshot = pack(new.encode())
+        delta = pack(diff(text, new)) if text is not None and chain < CHAIN else None
+        if delta is None or delta_bytes + len(delta) > len(snapshot):
+            values.append({"spark_id": spark_id, "rev": rev, "snapshot": True, "data": snapshot})
+            chain = delta_bytes = 0
+        else:
+            values.append({"spark_id": spark_id, "rev": rev, "snapshot": False, "data": delta})
+            chain += 1
+            delta_bytes += len(delta)
+        if at is not None:
+            values[-1]["created_at"] = at
+        text = new
+    for row in values:
+        # One statement per row: created_at is only given for the catch-up revision
+        session.execute(insert(SparkRevision).values(**row))
+    return rev
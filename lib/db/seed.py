@@ -0,0 +1,135 @@
+# seed.py
+# Deterministic synthetic data for benchmarks and local testing. The same
+# arguments and seed always produce the same rows (ids, contents, timestamps
+# and collection memberships), so timings from different runs and branches
+# are comparable.
+#
+#   python lib/db/seed.py --sparks 100000 --contexts 10 --collections 50 --fanout 2
+#
+# Seeds the database spark would use from the current directory (see
+# storage.get_database_url); the tables must exist and be empty.
+import random
+from datetime import datetime, timedelta
+
+BASE_TIME = datetime(2026, 1, 1)
+
+WORDS = (
+    "refactor cache query index parser token stream async worker queue retry timeout "
+    "config logging metrics trace schema migration rollback commit branch merge review "
+    "deploy docker build release bug fix crash leak latency throughput benchmark profile "
+    "memory cpu disk network socket server client api endpoint auth session cookie "
+    "search ranking snippet highlight export import sync backup restore vector embed"
+).split()
+
+def parse_size(value):
+    """'100k' -> 100000, '1m' -> 1000000; plain integers pass through."""
+    value = str(value).lower().replace("_", "")
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+def spark_content(rng, min_words=4, max_words=16):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+def generate(sparks, contexts=1, collections=5, fanout=1, days=365, seed=0, working_directory=None):
+    """Yield ("contexts" | "collections" | "sparks" | "spark_collections", row) pairs.
+
+    Context 1 uses `working_directory` when given, so commands run from that
+    directory see the seeded sparks. Each spark belongs to `fanout` distinct
+    collections; timestamps increase with the id and span `days` days.
+    """
+    rng = random.Random(seed)
+    fanout = min(fanout, collections)
+
+    for context_id in range(1, contexts + 1):
+        directory = working_directory if context_id == 1 and working_directory else f"/bench/project-{context_id}"
+        yield "contexts", {
+            "id": context_id, "working_directory": directory,
+            "project_name": f"project-{context_id}", "created_at": BASE_TIME,
+        }
+    for collection_id in range(1, collections + 1):
+        yield "collections", {"id": collection_id, "name": f"collection-{collection_id}", "created_at": BASE_TIME}
+
+    step = timedelta(days=days) / max(sparks, 1)
+    for spark_id in range(1, sparks + 1):
+        yield "sparks", {
+            "id": spark_id,
+            "content": spark_content(rng),
+            "created_at": BASE_TIME + step * spark_id,
+            "context_id": rng.randint(1, contexts),
+        }
+        for collection_id in rng.sample(range(1, collections + 1), fanout):
+            yield "spark_collections", {"spark_id": spark_id, "collection_id": collection_id}
+
+def seed(engine, sparks, contexts=1, collections=5, fanout=1, days=365, seed=0, working_directory=None, batch_size=5000):
+    """Insert generate(...) into the database behind `engine`; returns row counts per table."""
+    from db.models import Context, Spark, Collection, spark_collection
+
+    tables = {
+        "contexts": Context.__table__,
+        "collections": Collection.__table__,
+        "sparks": Spark.__table__,
+        "spark_collections": spark_collection,
+    }
+    batches = {name: [] for name in tables}
+    counts = dict.fromkeys(tables, 0)
+
+    def flush(connection, name):
+        if batches[name]:
+            connection.execute(tables[name].insert(), batches[name])
+            counts[name] += len(batches[name])
+            batches[name] = []
+
+    rows = generate(sparks, contexts, collections, fanout, days, seed, working_directory)
+    with engine.begin() as connection:
+        for name, row in rows:
+            batches[name].append(row)
+            if len(batches[name]) >= batch_size:
+                # Parents first, so foreign keys always point at inserted rows
+                for pending in ("contexts", "collections", "sparks", "spark_collections"):
+                    flush(connection, pending)
+        for name in ("contexts", "collections", "sparks", "spark_collections"):
+            flush(connection, name)
+        if engine.dialect.name == "postgresql":
+            # Explicit ids leave the sequences behind; move them past the seeded rows
+            for name in ("contexts", "collections", "sparks"):
+                connection.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE(MAX(id), 1)) FROM {name}"
+                )
+    return counts
+
+def main(argv=None):
+    import argparse
+    import os
+    import time
+    from db import storage
+    from utils import load_dot_spark
+
+    parser = argparse.ArgumentParser(description="Fill an empty spark database with synthetic sparks")
+    parser.add_argument("--sparks", default="1k", help="number of sparks, e.g. 1000, 100k or 1m")
+    parser.add_argument("--contexts", type=int, default=1)
+    parser.add_argument("--collections", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=1, help="collections per spark")
+    parser.add_argument("--days", type=int, default=365, help="time span of created_at")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--working-directory", default=os.getcwd(), help="directory of the first context")
+    parser.add_argument("--database-url", help="defaults to the URL spark resolves for this directory")
+    args = parser.parse_args(argv)
+
+    dot_spark, dot_config = load_dot_spark()
+    url = args.database_url or storage.get_database_url(dot_config, dot_spark.parent if dot_spark else None)
+    engine = storage.create_engine(url)
+    started = time.perf_counter()
+    counts = seed(
+        engine, parse_size(args.sparks), args.contexts, args.collections, args.fanout,
+        args.days, args.seed, args.working_directory,
+    )
+    elapsed = time.perf_counter() - started
+    print(", ".join(f"{count} {name}" for name, count in counts.items()) + f" in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
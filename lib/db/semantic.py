@@ -0,0 +1,444 @@
+# semantic.py
+# "Related sparks": a local vector index that finds ideas phrased
+# differently, behind `spark related` and `spark search --semantic`.
+#
+# Embeddings are LSA over hashed TF-IDF. Words and their character trigrams
+# are hashed into HASH_BUCKETS counts (so "caching" and "cache" share most
+# features), weighted by IDF and projected to DIMENSIONS with a truncated SVD
+# fitted on a sample of the store. Sparks whose words tend to appear together
+# land close to each other even without a word in common. Vectors are unit
+# length and stored as int8 in spark_vectors.
+#
+# Search is approximate, with an inverted file (IVF): k-means splits the
+# vectors into ~sqrt(N) lists, and a query only reads the lists whose
+# centroids are closest to it, so it scans a small, fixed share of the store.
+# spark_vectors is clustered by list, so each probed list is a range scan.
+#
+# The index follows add and edit through the sync change log: each query
+# first embeds the sparks changed since the previous one, and deletes are
+# handled by the spark_vectors_ad trigger. The model (IDF weights, the
+# projection, the centroids) is refitted once the store has doubled since
+# it was trained.
+#
+# Needs numpy. SQLite stores only, through db.lite connections.
+import io
+import json
+import math
+import re
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+from db.lite import SPARK_COLUMNS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HASH_BUCKETS = 4096
+DIMENSIONS = 128
+TRIGRAM_WEIGHT = 0.4
+# Extra random directions for the randomized SVD; improves its accuracy
+OVERSAMPLE = 10
+SAMPLE_SIZE = 20_000
+KMEANS_ITERATIONS = 8
+MIN_PROBES = 8
+# A query probes at least 1/PROBE_SHARE of the lists
+PROBE_SHARE = 64
+EMBED_BATCH = 1000
+WORD_CACHE_SIZE = 200_000
+WRITE_BATCH = 5000
+TOKEN = re.compile(r"\w+")
+
+def require_numpy():
+    if np is None:
+        raise ValueError("Semantic search needs numpy (pip install numpy)")
+
+class Model:
+    def __init__(self, meta, weights, centroids):
+        self.meta = meta
+        # HASH_BUCKETS x dimensions: IDF times the SVD projection
+        self.weights = weights
+        self.centroids = centroids
+        # Projected vector of every word seen so far; real notes reuse a
+        # small vocabulary, so most words are hashed and projected once
+        self.words = {}
+
+    def word_vector(self, word):
+        vector = self.words.get(word)
+        if vector is None:
+            if len(self.words) >= WORD_CACHE_SIZE:
+                self.words.clear()
+            buckets, weights = word_features(word)
+            vector = self.words[word] = weights @ self.weights[buckets]
+        return vector
+
+# Embedding
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def word_features(word):
+    """(hash buckets, weights) for a word and its character trigrams.
+
+    Trigrams of "<word>" let "caching" and "cache" share most features.
+    """
+    padded = f"<{word}>"
+    grams = [word] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+    features = {}
+    for position, gram in enumerate(grams):
+        digest = zlib.crc32(gram.encode())
+        # A sign bit from the same hash makes bucket collisions cancel out on average
+        weight = (1.0 if position == 0 else TRIGRAM_WEIGHT) * (1.0 if digest & 0x80000000 else -1.0)
+        bucket = digest % HASH_BUCKETS
+        features[bucket] = features.get(bucket, 0.0) + weight
+    return (
+        np.fromiter(features.keys(), dtype=np.int64, count=len(features)),
+        np.fromiter(features.values(), dtype=np.float32, count=len(features)),
+    )
+
+def term_counts(text):
+    """[(word, weight)]: sublinear term frequency, so the tenth "cache" matters less than the first."""
+    return [(word, math.log1p(count)) for word, count in Counter(TOKEN.findall(text.lower())).items()]
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def embed(model, texts):
+    """Unit vectors (len(texts) x dimensions, float32) for `texts`."""
+    vectors = np.zeros((len(texts), model.weights.shape[1]), dtype=np.float32)
+    for start in range(0, len(texts), EMBED_BATCH):
+        docs = [term_counts(text) for text in texts[start:start + EMBED_BATCH]]
+        lengths = np.array([len(terms) for terms in docs])
+        if not lengths.any():
+            continue
+        # Sum the weighted word vectors per document
+        rows = np.stack([model.word_vector(word) for terms in docs for word, _ in terms])
+        rows *= np.fromiter((weight for terms in docs for _, weight in terms), dtype=np.float32, count=len(rows))[:, None]
+        present = np.flatnonzero(lengths)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        vectors[start + present] = np.add.reduceat(rows, offsets[present])
+    return _normalize(vectors)
+
+def record_dtype(dimensions):
+    # One spark_vectors.vector blob: the factor that turns code . query into
+    # a cosine, then the int8 code. One column keeps the scan cheap.
+    return np.dtype([("scale", "<f4"), ("code", "i1", (dimensions,))])
+
+def quantize(vectors):
+    """Records of record_dtype for unit `vectors`."""
+    peak = np.abs(vectors).max(axis=1, keepdims=True)
+    peak[peak == 0] = 1
+    records = np.zeros(len(vectors), dtype=record_dtype(vectors.shape[1]))
+    records["code"] = np.round(vectors / peak * 127)
+    norms = np.linalg.norm(records["code"].astype(np.float32), axis=1)
+    records["scale"] = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return records
+
+# Training
+
+def doc_features(text):
+    """(hash buckets, weights) for `text`; a bucket can repeat."""
+    terms = term_counts(text)
+    if not terms:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    features = [word_features(word) for word, _ in terms]
+    return (
+        np.concatenate([buckets for buckets, _ in features]),
+        np.concatenate([weights * weight for (_, weights), (_, weight) in zip(features, terms)]),
+    )
+
+def _dense(docs, idf):
+    matrix = np.zeros((len(docs), HASH_BUCKETS), dtype=np.float32)
+    rows = np.repeat(np.arange(len(docs)), [len(buckets) for buckets, _ in docs])
+    buckets = np.concatenate([buckets for buckets, _ in docs])
+    weights = np.concatenate([weights for _, weights in docs])
+    np.add.at(matrix, (rows, buckets), weights * idf[buckets])
+    return matrix
+
+def fit(texts, seed=0):
+    """Fit the IDF weights and the LSA projection on `texts`; returns the weights matrix.
+
+    Randomized SVD (Halko et al.) with one power iteration, streaming the
+    sample through dense chunks of EMBED_BATCH documents so memory stays
+    at a few chunks' worth however large the sample is.
+    """
+    rng = np.random.default_rng(seed)
+    docs = [doc_features(text) for text in texts]
+    frequency = np.zeros(HASH_BUCKETS, dtype=np.float32)
+    for buckets, _ in docs:
+        frequency[np.unique(buckets)] += 1
+    idf = (np.log((1 + len(docs)) / (1 + frequency)) + 1).astype(np.float32)
+
+    def chunks():
+        for start in range(0, len(docs), EMBED_BATCH):
+            yield start, _dense(docs[start:start + EMBED_BATCH], idf)
+
+    def times(right):
+        # X @ right
+        return np.vstack([matrix @ right for _, matrix in chunks()])
+
+    def transposed_times(left):
+        # X.T @ left
+        total = np.zeros((HASH_BUCKETS, left.shape[1]), dtype=np.float32)
+        for start, matrix in chunks():
+            total += matrix.T @ left[start:start + len(matrix)]
+        return total
+
+    rank = min(DIMENSIONS, len(docs))
+    basis = np.linalg.qr(times(rng.standard_normal((HASH_BUCKETS, rank + OVERSAMPLE)).astype(np.float32)))[0]
+    basis = np.linalg.qr(times(transposed_times(basis)))[0]
+    _, _, components = np.linalg.svd(transposed_times(basis).T, full_matrices=False)
+    return (idf[:, None] * components[:rank].T).astype(np.float32)
+
+def assign_lists(vectors, centroids):
+    return np.concatenate([
+        np.argmax(vectors[start:start + EMBED_BATCH] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), EMBED_BATCH)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+def train_lists(vectors, lists, seed=0):
+    """Spherical k-means centroids for `lists` inverted lists."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign_lists(vectors, centroids), vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # An emptied list keeps its old centroid
+        centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+    return centroids.astype(np.float32)
+
+# Storage
+
+_models = {}
+
+def _array_blob(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+def _get(conn, name):
+    row = conn.execute("SELECT value FROM vector_index WHERE name = ?", (name,)).fetchone()
+    return row["value"] if row else None
+
+def _put(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO vector_index (name, value) VALUES (?, ?)", (name, value))
+
+def load_meta(conn):
+    value = _get(conn, "meta")
+    return json.loads(value) if value else None
+
+def save_meta(conn, meta):
+    _put(conn, "meta", json.dumps(meta).encode())
+
+def load_model(conn, meta):
+    """The stored model, cached per database file until it is refitted."""
+    database = conn.execute("PRAGMA database_list").fetchone()["file"]
+    cached = _models.get(database)
+    if cached is None or cached.meta["generation"] != meta["generation"]:
+        if meta["trained_on"] == 0:
+            cached = Model(meta, None, None)
+        else:
+            load = lambda name: np.load(io.BytesIO(_get(conn, name)), allow_pickle=False)
+            cached = Model(meta, load("weights"), load("centroids"))
+        _models[database] = cached
+    cached.meta = meta
+    return cached
+
+def _last_seq(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+def store_vectors(conn, model, rows):
+    """Embed and (re)file sparks given as rows of (id, content, context_id)."""
+    vectors = embed(model, [row["content"] for row in rows])
+    records = quantize(vectors)
+    lists = assign_lists(vectors, model.centroids)
+    conn.executemany("DELETE FROM spark_vectors WHERE spark_id = ?", [(row["id"],) for row in rows])
+    conn.executemany(
+        "INSERT INTO spark_vectors (list_id, spark_id, context_id, vector) VALUES (?, ?, ?, ?)",
+        [
+            (int(list_id), row["id"], row["context_id"], record.tobytes())
+            for row, list_id, record in zip(rows, lists, records)
+        ],
+    )
+
+def rebuild(conn, seed=0):
+    """Refit the model on a sample of the store and re-embed every spark."""
+    require_numpy()
+    up_to = _last_seq(conn)
+    total = conn.execute("SELECT COUNT(*) FROM sparks WHERE deleted_at IS NULL").fetchone()[0]
+    sample = [
+        row["content"] for row in conn.execute(
+            "SELECT content FROM sparks WHERE id IN (SELECT id FROM sparks WHERE deleted_at IS NULL ORDER BY RANDOM() LIMIT ?)",
+            (SAMPLE_SIZE,),
+        )
+    ]
+    previous = load_meta(conn)
+    meta = {
+        "trained_on": total, "seq": up_to, "added": 0,
+        "generation": (previous["generation"] + 1) if previous else 1,
+    }
+    model = Model(meta, None, None)
+    if sample:
+        model.weights = fit(sample, seed)
+        vectors = embed(model, sample)
+        # ~sqrt(N) lists balances centroid scoring against list scanning;
+        # keep enough sample points per list for k-means to place it
+        lists = max(1, min(int(math.sqrt(total)), len(sample) // 16))
+        model.centroids = train_lists(vectors, lists, seed)
+        meta["lists"] = lists
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM spark_vectors")
+        if sample:
+            _put(conn, "weights", _array_blob(model.weights))
+            _put(conn, "centroids", _array_blob(model.centroids))
+        save_meta(conn, meta)
+        conn.execute("COMMIT")
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
+    _models.pop(conn.execute("PRAGMA database_list").fetchone()["file"], None)
+    if not sample:
+        return model
+
+    # Separate transactions, so writers aren't locked out for the whole rebuild
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, content, context_id FROM sparks WHERE id > ? AND deleted_at IS NULL ORDER BY id LIMIT ?",
+            (last_id, WRITE_BATCH),
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            store_vectors(conn, model, rows)
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            raise e
+        last_id = rows[-1]["id"]
+    return model
+
+def refresh(conn):
+    """Bring the index up to date with the change log; returns the model.
+
+    Costs nothing when no spark changed since the last call, and time
+    proportional to the changed sparks otherwise.
+    """
+    require_numpy()
+    meta = load_meta(conn)
+    up_to = _last_seq(conn)
+    if meta is None:
+        return rebuild(conn)
+    if up_to <= meta["seq"]:
+        return load_model(conn, meta)
+
+    # Unary + keeps SQLite on the seq range instead of every sparks entry in
+    # the (table_name, row_key) index
+    changed = "FROM changes WHERE seq > ? AND seq <= ? AND +table_name = 'sparks' AND op = 'upsert'"
+    pending = conn.execute(f"SELECT COUNT(DISTINCT row_key) {changed}", (meta["seq"], up_to)).fetchone()[0]
+    if meta["added"] + pending >= max(meta["trained_on"], 1):
+        # The store has doubled since the model was fitted
+        return rebuild(conn)
+
+    model = load_model(conn, meta)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if load_meta(conn)["seq"] >= up_to:
+            # Another process (or daemon worker) got here first
+            conn.execute("COMMIT")
+            return model
+        uids = [row[0] for row in conn.execute(f"SELECT DISTINCT row_key {changed}", (meta["seq"], up_to))]
+        for start in range(0, len(uids), 500):
+            chunk = uids[start:start + 500]
+            # Deleting a spark is an update too; its vector is already gone (trigger)
+            rows = conn.execute(
+                f"SELECT id, content, context_id FROM sparks WHERE uid IN ({', '.join('?' * len(chunk))}) "
+                "AND deleted_at IS NULL", chunk
+            ).fetchall()
+            if rows:
+                store_vectors(conn, model, rows)
+        meta.update(seq=up_to, added=meta["added"] + pending)
+        save_meta(conn, meta)
+        conn.execute("COMMIT")
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
+    return model
+
+# Search
+
+def nearest(conn, model, vector, limit, context_id=None, exclude=None):
+    """[(spark id, cosine)] of the approximate `limit` nearest neighbours of `vector`."""
+    if model.centroids is None:
+        return []
+    order = np.argsort(-(model.centroids @ vector))
+    probes = max(MIN_PROBES, len(order) // PROBE_SHARE)
+    dtype = record_dtype(len(vector))
+    # Plain tuples: the scan is the bulk of a query and Row costs per row
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    ids, scores = [], []
+    found = probed = 0
+    # Widen the probe when the closest lists hold too few candidates (small
+    # stores, or a context filter that rules most of them out)
+    while probed < len(order) and found < limit + 1:
+        lists = [int(list_id) for list_id in order[probed:probed + probes]]
+        probed += probes
+        query = (
+            f"SELECT spark_id, vector FROM spark_vectors WHERE list_id IN ({', '.join('?' * len(lists))})"
+        )
+        params = lists
+        if context_id is not None:
+            query += " AND context_id = ?"
+            params = lists + [context_id]
+        rows = cursor.execute(query, params).fetchall()
+        if not rows:
+            continue
+        records = np.frombuffer(b"".join(row[1] for row in rows), dtype=dtype)
+        ids.append(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)))
+        scores.append((records["code"] @ vector) * records["scale"])
+        found += len(rows)
+        probes *= 2
+
+    if not ids:
+        return []
+    ids, scores = np.concatenate(ids), np.concatenate(scores)
+    if exclude is not None:
+        scores[ids == exclude] = -np.inf
+    top = np.argpartition(-scores, min(limit, len(scores)) - 1)[:limit]
+    top = top[np.argsort(-scores[top])]
+    return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+def _with_sparks(conn, matches):
+    if not matches:
+        return []
+    ids = [spark_id for spark_id, _ in matches]
+    sparks = {
+        spark["id"]: spark for spark in conn.execute(
+            f"SELECT {SPARK_COLUMNS} FROM sparks WHERE id IN ({', '.join('?' * len(ids))}) AND deleted_at IS NULL", ids
+        )
+    }
+    return [(sparks[spark_id], score) for spark_id, score in matches if spark_id in sparks]
+
+def search(conn, text, limit=10, context_id=None):
+    """[(spark row, cosine)] for the sparks closest in meaning to `text`."""
+    model = refresh(conn)
+    if model.weights is None:
+        return []
+    return _with_sparks(conn, nearest(conn, model, embed(model, [text])[0], limit, context_id))
+
+def related(conn, spark_id, limit=10, context_id=None):
+    """[(spark row, cosine)] for the sparks closest in meaning to spark `spark_id`."""
+    model = refresh(conn)
+    row = conn.execute("SELECT vector FROM spark_vectors WHERE spark_id = ?", (spark_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"Spark with ID {spark_id} not found")
+    record = np.frombuffer(row["vector"], dtype=record_dtype(model.centroids.shape[1]))[0]
+    vector = record["code"].astype(np.float32) * record["scale"]
+    return _with_sparks(conn, nearest(conn, model, vector, limit, context_id, exclude=spark_id))
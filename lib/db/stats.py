@@ -0,0 +1,84 @@
+# stats.py
+# Summary tables behind `spark stats`: per-context and per-collection spark
+# counts with the first/last created_at, and sparks per context and day.
+#
+# Triggers (see the 8983d5e820cd and 509327c54661 migrations) keep them
+# current on every insert, delete or restore, context or timestamp change
+# and membership change, counting live sparks only, so
+# reading them costs the same however many sparks there are. `rebuild`
+# recomputes them from the base tables in one pass and reports the rows it
+# had to correct, which should be none.
+#
+# Uses sqlite3 directly, like db.lite; the connection must come from
+# lite.connect (isolation_level=None, explicit transactions).
+from datetime import datetime, timedelta, timezone
+
+# table -> query producing its full contents, columns in table order
+REBUILDS = {
+    "context_stats": (
+        "SELECT context_id, COUNT(*), MIN(created_at), MAX(created_at) "
+        "FROM sparks WHERE context_id IS NOT NULL AND deleted_at IS NULL GROUP BY context_id"
+    ),
+    "collection_stats": (
+        "SELECT collection_id, COUNT(*), MIN(sparks.created_at), MAX(sparks.created_at) "
+        "FROM spark_collections JOIN sparks ON sparks.id = spark_collections.spark_id "
+        "WHERE collection_id IN (SELECT id FROM collections) AND sparks.deleted_at IS NULL GROUP BY collection_id"
+    ),
+    "spark_daily": (
+        "SELECT context_id, date(created_at), COUNT(*) "
+        "FROM sparks WHERE context_id IS NOT NULL AND deleted_at IS NULL GROUP BY context_id, date(created_at)"
+    ),
+}
+
+def context_stats(conn):
+    """One row per context with sparks, busiest first."""
+    return conn.execute(
+        "SELECT context_stats.*, contexts.project_name, contexts.working_directory FROM context_stats "
+        "LEFT JOIN contexts ON contexts.id = context_stats.context_id ORDER BY sparks DESC, context_id"
+    ).fetchall()
+
+def collection_stats(conn):
+    """One row per collection, by name; empty collections have 0 sparks and no dates."""
+    return conn.execute(
+        "SELECT collections.id AS collection_id, collections.name, COALESCE(collection_stats.sparks, 0) AS sparks, "
+        "collection_stats.first_at, collection_stats.last_at FROM collections "
+        "LEFT JOIN collection_stats ON collection_stats.collection_id = collections.id ORDER BY collections.name"
+    ).fetchall()
+
+def daily(conn, context_id, days=14, today=None):
+    """(day, sparks) for the last `days` days up to `today`, including days without sparks.
+
+    Days are UTC dates, like the created_at timestamps they count.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    first = today - timedelta(days=days - 1)
+    counts = {
+        str(day): sparks for day, sparks in conn.execute(
+            "SELECT day, sparks FROM spark_daily WHERE context_id = ? AND day BETWEEN ? AND ?",
+            (context_id, first.isoformat(), today.isoformat()),
+        )
+    }
+    return [(day, counts.get(day.isoformat(), 0)) for day in (first + timedelta(days=i) for i in range(days))]
+
+def rebuild(conn):
+    """Recompute every summary table; returns {table: rows that were wrong or missing}."""
+    drift = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, query in REBUILDS.items():
+            conn.execute("DROP TABLE IF EXISTS temp.fresh_stats")
+            conn.execute(f"CREATE TEMP TABLE fresh_stats AS {query}")
+            # Rows only on one side of the comparison, either way round
+            drift[table] = conn.execute(
+                f"SELECT (SELECT COUNT(*) FROM (SELECT * FROM {table} EXCEPT SELECT * FROM temp.fresh_stats)) "
+                f"+ (SELECT COUNT(*) FROM (SELECT * FROM temp.fresh_stats EXCEPT SELECT * FROM {table}))"
+            ).fetchone()[0]
+            if drift[table]:
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(f"INSERT INTO {table} SELECT * FROM temp.fresh_stats")
+            conn.execute("DROP TABLE temp.fresh_stats")
+        conn.execute("COMMIT")
+        return drift
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
@@ -0,0 +1,167 @@
+# storage.py
+# Storage configuration: which database URL to use and how to build the engine.
+#
+# The URL comes from, in order:
+#   1. the SPARK_DATABASE_URL environment variable
+#   2. a `database_url` key in the project's .spark file
+#   3. lib/db/spark_store.db next to this module
+#
+# Any SQLAlchemy URL works; SQLite and PostgreSQL are the supported backends.
+import os
+
+DB_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(DB_DIR, 'spark_store.db')}"
+
+# Pool tuning, overridable per deployment
+POOL_SIZE = int(os.environ.get("SPARK_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.environ.get("SPARK_MAX_OVERFLOW", 10))
+POOL_RECYCLE = int(os.environ.get("SPARK_POOL_RECYCLE", 1800))
+QUERY_CACHE_SIZE = int(os.environ.get("SPARK_QUERY_CACHE_SIZE", 1200))
+
+# PRAGMAs applied to every new SQLite connection. "tuned" suits several
+# processes (developers, git hooks) writing to one file: WAL lets readers run
+# alongside the writer, synchronous=NORMAL is durable across crashes in WAL
+# mode and skips most fsyncs, and busy_timeout waits for locks instead of
+# failing with "database is locked". "default" leaves SQLite's settings alone.
+SQLITE_PROFILES = {
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -20000,  # negative = KiB, so ~20 MB
+        "temp_store": "MEMORY",
+    },
+    "default": {},
+}
+DEFAULT_SQLITE_PROFILE = "tuned"
+# Applied under every profile: SQLite leaves foreign keys unenforced unless
+# asked, and memberships rely on ON DELETE CASCADE
+SQLITE_REQUIRED_PRAGMAS = {"foreign_keys": "ON"}
+
+# asyncio drivers used by create_async_engine, per backend
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+psycopg"}
+
+def get_database_url(dot_config=None, base_dir=None):
+    """Resolve the database URL from the environment, then .spark, then the default.
+
+    Relative SQLite paths in .spark are taken relative to `base_dir` (the
+    directory holding the .spark file) rather than the process cwd.
+    """
+    url = os.environ.get("SPARK_DATABASE_URL")
+    if not url and dot_config:
+        url = dot_config.get("database_url")
+        if url and base_dir:
+            url = _anchor_sqlite_url(url, base_dir)
+    return url or DEFAULT_DATABASE_URL
+
+def _anchor_sqlite_url(url, base_dir):
+    prefix = "sqlite:///"
+    if url.startswith(prefix):
+        path = url[len(prefix):]
+        if path and path != ":memory:" and not os.path.isabs(path):
+            return prefix + os.path.join(base_dir, path)
+    return url
+
+def sqlite_path(url):
+    """Return the database file for a sqlite:/// URL, or None for other backends."""
+    for prefix in ("sqlite:///", "sqlite+pysqlite:///", "sqlite+aiosqlite:///"):
+        if url.startswith(prefix):
+            path = url[len(prefix):].split("?", 1)[0]
+            return path or ":memory:"
+    return None
+
+def sqlite_pragmas(profile=None):
+    """PRAGMAs for `profile` (or SPARK_SQLITE_PROFILE), plus SPARK_SQLITE_PRAGMAS overrides.
+
+    Overrides are comma separated, e.g. SPARK_SQLITE_PRAGMAS="mmap_size=0,cache_size=-8000".
+    """
+    profile = profile or os.environ.get("SPARK_SQLITE_PROFILE") or DEFAULT_SQLITE_PROFILE
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile '{profile}' (choose from {', '.join(SQLITE_PROFILES)})")
+    pragmas = {**SQLITE_REQUIRED_PRAGMAS, **SQLITE_PROFILES[profile]}
+    for item in os.environ.get("SPARK_SQLITE_PRAGMAS", "").split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            pragmas[name.strip()] = value.strip()
+    return pragmas
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def engine_options(url):
+    """Pool and statement-cache settings for the backend behind `url`."""
+    options = {
+        "pool_pre_ping": True,
+        # Size of SQLAlchemy's compiled-statement cache, shared by the pool
+        "query_cache_size": QUERY_CACHE_SIZE,
+    }
+    if sqlite_path(url) not in (None, ":memory:"):
+        # File-backed SQLite pools connections too (QueuePool), but each is
+        # cheap, so only keep a few around
+        options.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+    elif sqlite_path(url) is None:
+        options.update(
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_recycle=POOL_RECYCLE,
+            pool_use_lifo=True,
+        )
+    return options
+
+def create_engine(url=None, pragmas=None, **overrides):
+    """Build an engine for `url`; SQLite connections get `pragmas` (default: sqlite_pragmas())."""
+    from sqlalchemy import create_engine as sa_create_engine, event
+    url = url or get_database_url()
+    options = engine_options(url)
+    options.update(overrides)
+    engine = sa_create_engine(url, **options)
+
+    if sqlite_path(url) is not None:
+        pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+    return engine
+
+def async_database_url(url):
+    """`url` with its backend's asyncio driver, e.g. sqlite:///x.db -> sqlite+aiosqlite:///x.db."""
+    scheme, rest = url.split("://", 1)
+    if scheme in ASYNC_DRIVERS.values():
+        return url
+    backend = scheme.split("+", 1)[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver for '{scheme}' URLs (supported: {', '.join(ASYNC_DRIVERS)})")
+    return f"{ASYNC_DRIVERS[backend]}://{rest}"
+
+def create_async_engine(url=None, pragmas=None, **overrides):
+    """asyncio counterpart of create_engine: aiosqlite for SQLite, psycopg's async mode for PostgreSQL."""
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import create_async_engine as sa_create_async_engine
+    url = async_database_url(url or get_database_url())
+    if sqlite_path(url) is not None:
+        try:
+            import aiosqlite  # noqa: F401
+        except ImportError:
+            raise ValueError("Async SQLite stores need the aiosqlite package (pip install aiosqlite)")
+    options = engine_options(url)
+    options.update(overrides)
+    engine = sa_create_async_engine(url, **options)
+
+    if sqlite_path(url) is not None:
+        pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+        # Pool events fire on the sync engine underneath, with an adapted
+        # connection that runs the PRAGMAs through aiosqlite
+        @event.listens_for(engine.sync_engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+    return engine
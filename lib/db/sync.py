@@ -0,0 +1,306 @@
+# sync.py
+# Incremental sync between SQLite spark stores (replicas), through a shared
+# directory: a network share, a synced folder or a USB stick.
+#
+# Triggers on sparks, collections and spark_collections append every local
+# change to the `changes` log (see the 51881d439225 migration). `push` turns
+# the log entries since the last push into a delta file under
+# <dir>/<replica id>/; `pull` applies the delta files other replicas wrote
+# since the last pull. Neither step looks at rows that didn't change, so a
+# sync costs the same on a 100-spark store as on a 10-million-spark one.
+#
+# Rows are matched across replicas by a key that is the same everywhere:
+# the spark's uid, the collection's name, and "<spark uid>/<collection name>"
+# for memberships (logged locally by ids, translated on push). Conflicts are
+# last writer wins on updated_at (deletions and membership changes use the
+# time they happened); ties go to the replica with the larger id so every
+# replica settles on the same row. A soft deleted spark travels as a delete
+# stamped with its deleted_at and is soft deleted on the other side too, so
+# `spark undo` on any replica (a newer upsert) brings it back everywhere.
+#
+# Uses sqlite3 directly, like db.lite; the connection must come from
+# lite.connect (isolation_level=None, explicit transactions).
+import json
+import os
+import uuid
+from datetime import datetime
+
+from db.lite import get_collection_id, get_or_create_collection_id, get_or_create_context_id
+
+# Parents first, so a membership never arrives before its spark or collection
+TABLES = ("collections", "sparks", "spark_collections")
+
+def get_state(conn, name, default=None):
+    row = conn.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return row["value"] if row else default
+
+def set_state(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, str(value)))
+
+def replica_id(conn):
+    """This store's id, created on first use."""
+    value = get_state(conn, "replica_id")
+    if value is None:
+        value = uuid.uuid4().hex
+        set_state(conn, "replica_id", value)
+    return value
+
+def _text(value):
+    # Datetimes travel in the format SQLite stores them in
+    return str(value) if isinstance(value, datetime) else value
+
+def _time(value):
+    return value if isinstance(value, datetime) or value is None else datetime.fromisoformat(value)
+
+def last_seq(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+# Push
+
+def _payload(conn, table, key, op, changed_at):
+    record = {"table": table, "key": key, "op": op, "at": _text(changed_at)}
+    if table == "spark_collections":
+        # Logged by local ids; a spark or collection deleted since then
+        # travels as its own delete, which takes its memberships with it
+        spark_id, collection_id = key.split("/")
+        row = conn.execute(
+            "SELECT sparks.uid, collections.name FROM sparks, collections "
+            "WHERE sparks.id = ? AND collections.id = ?",
+            (int(spark_id), int(collection_id)),
+        ).fetchone()
+        if row is None:
+            return None
+        record["key"] = f"{row['uid']}/{row['name']}"
+        return record
+    if op == "delete":
+        return record
+    if table == "sparks":
+        row = conn.execute(
+            "SELECT sparks.content, sparks.created_at, sparks.updated_at, sparks.deleted_at, "
+            "contexts.working_directory, contexts.project_name "
+            "FROM sparks LEFT JOIN contexts ON contexts.id = sparks.context_id WHERE sparks.uid = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        if row["deleted_at"] is not None:
+            return {**record, "op": "delete", "at": _text(row["deleted_at"])}
+        record["row"] = {
+            "content": row["content"],
+            "created_at": _text(row["created_at"]),
+            "updated_at": _text(row["updated_at"]),
+            "working_directory": row["working_directory"],
+            "project_name": row["project_name"],
+        }
+        record["at"] = _text(row["updated_at"] or row["created_at"])
+    else:
+        row = conn.execute(
+            "SELECT description, created_at, updated_at FROM collections WHERE name = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        record["row"] = {
+            "description": row["description"],
+            "created_at": _text(row["created_at"]),
+            "updated_at": _text(row["updated_at"]),
+        }
+        record["at"] = _text(row["updated_at"] or row["created_at"]) or record["at"]
+    return record
+
+def collect_changes(conn, after_seq, up_to_seq):
+    """Yield one record per row changed locally in (after_seq, up_to_seq], parents first.
+
+    Several changes to the same row collapse into its latest state, so a
+    spark edited ten times since the last push travels once.
+    """
+    for table in TABLES:
+        # SQLite returns the bare columns from the row holding MAX(seq)
+        changes = conn.execute(
+            "SELECT row_key, op, changed_at, MAX(seq) AS seq FROM changes "
+            "WHERE seq > ? AND seq <= ? AND table_name = ? AND origin IS NULL "
+            "GROUP BY row_key ORDER BY seq",
+            (after_seq, up_to_seq, table),
+        )
+        for change in changes:
+            record = _payload(conn, table, change["row_key"], change["op"], change["changed_at"])
+            if record is not None:
+                yield record
+
+def push(conn, directory):
+    """Write local changes since the last push to <directory>/<replica id>/; returns how many."""
+    conn.execute("BEGIN")
+    try:
+        me = replica_id(conn)
+        after_seq = int(get_state(conn, "pushed_seq", 0))
+        up_to_seq = last_seq(conn)
+        count = 0
+        if up_to_seq > after_seq:
+            outbox = os.path.join(directory, me)
+            os.makedirs(outbox, exist_ok=True)
+            path = os.path.join(outbox, f"{after_seq + 1:012d}-{up_to_seq:012d}.jsonl")
+            # Write-then-rename, so peers never read a half-written delta
+            with open(path + ".tmp", "w", encoding="utf-8") as delta:
+                for record in collect_changes(conn, after_seq, up_to_seq):
+                    delta.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    count += 1
+            if count:
+                os.replace(path + ".tmp", path)
+            else:
+                os.remove(path + ".tmp")
+            set_state(conn, "pushed_seq", up_to_seq)
+        conn.execute("COMMIT")
+        return count
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
+
+# Pull
+
+def _local_version(conn, table, key, row):
+    """Time of the last local write to the row: its deleted_at or updated_at, else the last logged change."""
+    if row is not None:
+        return _time(row["deleted_at"] or row["updated_at"] or row["created_at"])
+    logged = conn.execute(
+        "SELECT MAX(changed_at) FROM changes WHERE table_name = ? AND row_key = ?", (table, key)
+    ).fetchone()[0]
+    return _time(logged)
+
+def apply_change(conn, record, wins_ties):
+    """Apply one pulled record unless the local row was written later; returns True if applied."""
+    table, key, op, row = record["table"], record["key"], record["op"], record.get("row")
+    local_key = key
+    if table == "sparks":
+        local = conn.execute(
+            "SELECT id, created_at, updated_at, deleted_at FROM sparks WHERE uid = ?", (key,)
+        ).fetchone()
+    elif table == "collections":
+        local = conn.execute(
+            "SELECT id, created_at, updated_at, NULL AS deleted_at FROM collections WHERE name = ?", (key,)
+        ).fetchone()
+    else:
+        local = None
+        spark_uid, _, name = key.partition("/")
+        spark = conn.execute("SELECT id FROM sparks WHERE uid = ?", (spark_uid,)).fetchone()
+        if spark is None:
+            # Deleted here after the peer linked it
+            return False
+        collection_id = get_collection_id(conn, name)
+        local_key = f"{spark['id']}/{collection_id}"
+
+    version, remote = _local_version(conn, table, local_key, local), _time(record["at"])
+    if version is not None and (remote < version or (remote == version and not wins_ties)):
+        return False
+
+    if table == "sparks":
+        if op == "delete":
+            # Soft, like a local delete; memberships stay for an undo
+            if local is not None:
+                conn.execute(
+                    "UPDATE sparks SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL", (record["at"], local["id"])
+                )
+            return True
+        context_id = None
+        if row["working_directory"]:
+            context_id = get_or_create_context_id(conn, row["working_directory"], row["project_name"])
+        values = (row["content"], row["created_at"], row["updated_at"], context_id)
+        if local is None:
+            conn.execute(
+                "INSERT INTO sparks (content, created_at, updated_at, context_id, uid) VALUES (?, ?, ?, ?, ?)",
+                values + (key,),
+            )
+        else:
+            conn.execute(
+                "UPDATE sparks SET content = ?, created_at = ?, updated_at = ?, context_id = ?, deleted_at = NULL "
+                "WHERE id = ?",
+                values + (local["id"],),
+            )
+    elif table == "collections":
+        if op == "delete":
+            if local is not None:
+                conn.execute("DELETE FROM spark_collections WHERE collection_id = ?", (local["id"],))
+                conn.execute("DELETE FROM collections WHERE id = ?", (local["id"],))
+            return True
+        values = (row["description"], row["created_at"], row["updated_at"])
+        if local is None:
+            conn.execute(
+                "INSERT INTO collections (description, created_at, updated_at, name) VALUES (?, ?, ?, ?)",
+                values + (key,),
+            )
+        else:
+            conn.execute(
+                "UPDATE collections SET description = ?, created_at = ?, updated_at = ? WHERE id = ?",
+                values + (local["id"],),
+            )
+    else:
+        if op == "delete":
+            conn.execute(
+                "DELETE FROM spark_collections WHERE spark_id = ? AND collection_id = ?",
+                (spark["id"], collection_id),
+            )
+        else:
+            conn.execute(
+                "INSERT OR IGNORE INTO spark_collections (spark_id, collection_id) VALUES (?, ?)",
+                (spark["id"], get_or_create_collection_id(conn, name)),
+            )
+    return True
+
+def apply_delta(conn, path, peer, me):
+    """Apply one delta file in a single transaction; returns (applied, skipped)."""
+    applied = skipped = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        with open(path, encoding="utf-8") as delta:
+            for line in delta:
+                record = json.loads(line)
+                before = last_seq(conn)
+                if apply_change(conn, record, wins_ties=peer > me):
+                    applied += 1
+                    # The triggers logged the change as if made here: tag it with
+                    # its origin so it isn't pushed back, and with the peer's time
+                    # so later conflicts compare against when it really happened
+                    conn.execute(
+                        "UPDATE changes SET origin = ?, changed_at = ? WHERE seq > ?",
+                        (peer, record["at"], before),
+                    )
+                else:
+                    skipped += 1
+        set_state(conn, f"peer:{peer}", _delta_range(path)[1])
+        conn.execute("COMMIT")
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        raise e
+    return applied, skipped
+
+def _delta_range(path):
+    first, last = os.path.basename(path).split(".")[0].split("-")
+    return int(first), int(last)
+
+def pending_deltas(conn, directory, me):
+    """Yield (peer, path) for every delta file not pulled yet, oldest first per peer."""
+    if not os.path.isdir(directory):
+        return
+    for peer in sorted(os.listdir(directory)):
+        inbox = os.path.join(directory, peer)
+        if peer == me or not os.path.isdir(inbox):
+            continue
+        pulled = int(get_state(conn, f"peer:{peer}", 0))
+        for name in sorted(os.listdir(inbox)):
+            if name.endswith(".jsonl") and _delta_range(name)[1] > pulled:
+                yield peer, os.path.join(inbox, name)
+
+def pull(conn, directory):
+    """Apply other replicas' new delta files; returns (files, applied, skipped)."""
+    me = replica_id(conn)
+    files = applied = skipped = 0
+    for peer, path in pending_deltas(conn, directory, me):
+        file_applied, file_skipped = apply_delta(conn, path, peer, me)
+        files += 1
+        applied += file_applied
+        skipped += file_skipped
+    return files, applied, skipped
+
+def sync(conn, directory):
+    """Pull, then push; returns a dict of counts."""
+    files, applied, skipped = pull(conn, directory)
+    pushed = push(conn, directory)
+    return {"pushed": pushed, "files": files, "applied": applied, "skipped": skipped}
@@ -0,0 +1,563 @@
+# transfer.py
+# Streaming export and import of a whole spark store: contexts, collections,
+# sparks and their collection memberships.
+#
+# Formats:
+#   jsonl    one JSON object per line, {"table": "sparks", "id": ..., ...}
+#   csv      one file, a "table" column plus the union of every table's columns
+#   parquet  a directory with one Parquet file per table and a manifest.json
+#            (needs the optional pyarrow package)
+#
+# jsonl and csv can be gzip or zstd compressed (zstd needs the optional
+# zstandard package). Every dump starts with a manifest: format version and
+# per-table row counts, which import uses to reserve spark ids up front.
+#
+# Both directions read and write `chunk_size` rows at a time, so memory stays
+# flat however large the store is, and record their position in a checkpoint
+# file next to the dump after every chunk. An interrupted run continues from
+# there with resume=True instead of starting over.
+import csv
+import io
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+FORMAT_NAME = "spark-export"
+# 2: sparks carry their uid, so an imported store syncs with its source
+FORMAT_VERSION = 2
+FORMATS = ("jsonl", "csv", "parquet")
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# Parents first, so every foreign key points at an already imported row
+TABLES = ("contexts", "collections", "sparks", "spark_collections")
+COLUMNS = {
+    "contexts": ("id", "working_directory", "project_name", "created_at"),
+    "collections": ("id", "name", "description", "created_at", "updated_at"),
+    "sparks": ("id", "uid", "content", "created_at", "updated_at", "context_id"),
+    "spark_collections": ("spark_id", "collection_id"),
+}
+CSV_COLUMNS = ("table",) + tuple(dict.fromkeys(c for columns in COLUMNS.values() for c in columns))
+INTEGER_COLUMNS = {"id", "context_id", "spark_id", "collection_id"}
+DATETIME_COLUMNS = {"created_at", "updated_at"}
+# CSV has no NULL; an empty cell is NULL except in these NOT NULL text columns
+REQUIRED_TEXT_COLUMNS = {"working_directory", "name", "content"}
+
+
+def detect_format(path, fmt=None, compression=None):
+    """Fill in (format, compression) from the file name when not given.
+
+    "dump.jsonl.gz" -> ("jsonl", "gzip"), "dump.csv" -> ("csv", "none"),
+    a directory or "*.parquet" -> ("parquet", "none").
+    """
+    name = os.path.basename(path.rstrip(os.sep)).lower()
+    for method, extension in COMPRESSIONS.items():
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            compression = compression or method
+    compression = compression or "none"
+    if fmt is None:
+        if name.endswith(".csv"):
+            fmt = "csv"
+        elif name.endswith(".parquet") or os.path.isdir(path):
+            fmt = "parquet"
+        else:
+            fmt = "jsonl"
+    if fmt == "parquet" and compression not in ("none", *COMPRESSIONS):
+        raise ValueError(f"Unknown compression '{compression}'")
+    return fmt, compression
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("The parquet format needs the pyarrow package (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+def check_dependencies(fmt, compression):
+    """Fail before touching any file when an optional package is missing."""
+    if fmt == "parquet":
+        _pyarrow()
+    elif compression == "zstd":
+        _zstandard()
+
+def open_stream(path, mode, compression="none"):
+    """Text stream over `path` ("rb", "wb" or "ab" underneath).
+
+    Appending starts a new gzip member / zstd frame; readers of both formats
+    treat concatenated members as one stream, which is what lets an export
+    resume by appending to a truncated file.
+    """
+    if compression == "gzip":
+        import gzip
+        raw = gzip.open(path, mode)
+    elif compression == "zstd":
+        zstandard = _zstandard()
+        if mode == "rb":
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+        else:
+            raw = zstandard.ZstdCompressor().stream_writer(open(path, mode))
+    elif compression == "none":
+        raw = open(path, mode)
+    else:
+        raise ValueError(f"Unknown compression '{compression}'")
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+def checkpoint_path(path, operation):
+    return f"{path.rstrip(os.sep)}.{operation}-checkpoint"
+
+def load_checkpoint(path, operation):
+    try:
+        with open(checkpoint_path(path, operation)) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+
+def save_checkpoint(path, operation, state):
+    # Write-then-rename, so a crash never leaves a half-written checkpoint
+    target = checkpoint_path(path, operation)
+    with open(target + ".tmp", "w") as checkpoint_file:
+        json.dump(state, checkpoint_file)
+    os.replace(target + ".tmp", target)
+
+def remove_checkpoint(path, operation):
+    try:
+        os.remove(checkpoint_path(path, operation))
+    except FileNotFoundError:
+        pass
+
+def _tables():
+    from db.models import Context, Collection, Spark, spark_collection
+    return {
+        "contexts": Context.__table__,
+        "collections": Collection.__table__,
+        "sparks": Spark.__table__,
+        "spark_collections": spark_collection,
+    }
+
+def _exported(table):
+    """WHERE criteria for the rows of `table` that go in a dump: deleted sparks stay behind."""
+    from sqlalchemy import select
+
+    if table.name == "sparks":
+        return [table.c.deleted_at.is_(None)]
+    if table.name == "spark_collections":
+        sparks = _tables()["sparks"]
+        return [table.c.spark_id.in_(select(sparks.c.id).where(sparks.c.deleted_at.is_(None)))]
+    return []
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _decode(row):
+    decoded = {}
+    for name, value in row.items():
+        if value is None or value == "":
+            value = "" if name in REQUIRED_TEXT_COLUMNS else None
+        elif name in INTEGER_COLUMNS and not isinstance(value, int):
+            value = int(value)
+        elif name in DATETIME_COLUMNS and not isinstance(value, datetime):
+            value = datetime.fromisoformat(value)
+        decoded[name] = value
+    return decoded
+
+def _resumed_progress(state):
+    # Report what earlier runs already did, so totals cover the whole transfer
+    for table in TABLES:
+        if state["rows"][table]:
+            yield table, state["rows"][table]
+
+# Export
+
+@contextmanager
+def snapshot(engine):
+    """Connection whose reads all see one consistent state of the store."""
+    with engine.connect() as connection:
+        if engine.dialect.name == "sqlite":
+            # pysqlite only opens a transaction before writes; without one each
+            # chunk would read whatever had been committed in between
+            connection.exec_driver_sql("BEGIN")
+        else:
+            connection.execution_options(isolation_level="REPEATABLE READ")
+        yield connection
+
+def read_chunks(connection, table, chunk_size, after=None):
+    """Yield lists of row dicts in primary key order, starting after the key `after`.
+
+    Keyset pagination: each chunk is one indexed range query, so the cost
+    per chunk doesn't grow with how far into the table the export is.
+    """
+    from sqlalchemy import select, tuple_
+
+    keys = list(table.primary_key.columns)
+    while True:
+        statement = select(table).where(*_exported(table)).order_by(*keys).limit(chunk_size)
+        if after is not None:
+            statement = statement.where(tuple_(*keys) > tuple_(*after) if len(keys) > 1 else keys[0] > after[0])
+        rows = [dict(row) for row in connection.execute(statement).mappings()]
+        if not rows:
+            return
+        yield rows
+        after = [rows[-1][key.name] for key in keys]
+
+def build_manifest(connection):
+    from sqlalchemy import select, func
+
+    tables = _tables()
+    sparks = tables["sparks"]
+    low, high = connection.execute(
+        select(func.min(sparks.c.id), func.max(sparks.c.id)).where(*_exported(sparks))
+    ).one()
+    return {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+        "rows": {
+            name: connection.scalar(select(func.count()).select_from(table).where(*_exported(table)))
+            for name, table in tables.items()
+        },
+        "spark_ids": [low, high],
+    }
+
+def write_rows(stream, fmt, table, rows):
+    columns = COLUMNS[table]
+    if fmt == "jsonl":
+        stream.writelines(
+            json.dumps({"table": table, **{c: _encode(row[c]) for c in columns}}, ensure_ascii=False) + "\n"
+            for row in rows
+        )
+    else:
+        csv.writer(stream).writerows(
+            [table if c == "table" else _encode(row.get(c)) for c in CSV_COLUMNS] for row in rows
+        )
+
+def export_store(engine, path, fmt="jsonl", compression="none", chunk_size=10_000, resume=False):
+    """Stream every table to `path`; yields (table, rows exported so far) per chunk.
+
+    With resume=True an interrupted export continues from its checkpoint:
+    the file is cut back to the last completed chunk and appended to.
+    """
+    check_dependencies(fmt, compression)
+    state = load_checkpoint(path, "export") if resume else None
+    if state and (state["format"], state["compression"]) != (fmt, compression):
+        raise ValueError(
+            f"The interrupted export of {path} was {state['format']}/{state['compression']}; "
+            f"resume it with the same format and compression"
+        )
+
+    with snapshot(engine) as connection:
+        if state is None:
+            manifest = build_manifest(connection)
+            state = {
+                "format": fmt, "compression": compression, "manifest": manifest,
+                "table": TABLES[0], "after": None, "rows": dict.fromkeys(TABLES, 0), "offset": 0,
+            }
+            if fmt == "parquet":
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, "manifest.json"), "w") as manifest_file:
+                    json.dump(manifest, manifest_file, indent=2)
+            else:
+                with open_stream(path, "wb", compression) as stream:
+                    if fmt == "csv":
+                        writer = csv.writer(stream)
+                        writer.writerow(CSV_COLUMNS)
+                        writer.writerow([
+                            "manifest" if c == "table" else json.dumps(manifest) if c == "content" else ""
+                            for c in CSV_COLUMNS
+                        ])
+                    else:
+                        stream.write(json.dumps({"table": "manifest", **manifest}) + "\n")
+                state["offset"] = os.path.getsize(path)
+            save_checkpoint(path, "export", state)
+        else:
+            if fmt != "parquet":
+                # Drop anything written after the last checkpoint
+                with open(path, "r+b") as raw:
+                    raw.truncate(state["offset"])
+            yield from _resumed_progress(state)
+
+        tables = _tables()
+        for table in TABLES[TABLES.index(state["table"]):]:
+            if table != state["table"]:
+                state.update(table=table, after=None)
+            if fmt == "parquet":
+                yield from _export_parquet(connection, path, compression, table, tables[table], state, chunk_size)
+                continue
+            for rows in read_chunks(connection, tables[table], chunk_size, state["after"]):
+                with open_stream(path, "ab", compression) as stream:
+                    write_rows(stream, fmt, table, rows)
+                state["after"] = [rows[-1][key.name] for key in tables[table].primary_key.columns]
+                state["rows"][table] += len(rows)
+                state["offset"] = os.path.getsize(path)
+                save_checkpoint(path, "export", state)
+                yield table, state["rows"][table]
+    remove_checkpoint(path, "export")
+
+def _parquet_schema(table):
+    pyarrow, _ = _pyarrow()
+    types = {name: pyarrow.int64() for name in INTEGER_COLUMNS}
+    types.update({name: pyarrow.timestamp("us") for name in DATETIME_COLUMNS})
+    return pyarrow.schema([(name, types.get(name, pyarrow.string())) for name in COLUMNS[table]])
+
+def _export_parquet(connection, path, compression, name, table, state, chunk_size):
+    # A Parquet file can't be appended to once closed, so a resumed export
+    # rewrites the table it stopped in; finished tables are kept
+    if state.get("done") == name:
+        return
+    pyarrow, parquet = _pyarrow()
+    schema = _parquet_schema(name)
+    state["rows"][name] = 0
+    with parquet.ParquetWriter(
+        os.path.join(path, f"{name}.parquet"), schema,
+        compression="none" if compression == "none" else compression,
+    ) as writer:
+        for rows in read_chunks(connection, table, chunk_size):
+            # One row group per chunk, which is also the unit import reads back
+            writer.write_table(pyarrow.Table.from_pylist(rows, schema=schema))
+            state["rows"][name] += len(rows)
+            yield name, state["rows"][name]
+    state["done"] = name
+    save_checkpoint(path, "export", state)
+
+# Import
+
+def read_records(path, fmt, compression="none", chunk_size=10_000):
+    """Yield ("manifest", manifest) and then (table, row) for every row in a dump."""
+    if fmt == "parquet":
+        _, parquet = _pyarrow()
+        with open(os.path.join(path, "manifest.json")) as manifest_file:
+            yield "manifest", json.load(manifest_file)
+        for table in TABLES:
+            dump = parquet.ParquetFile(os.path.join(path, f"{table}.parquet"))
+            for batch in dump.iter_batches(batch_size=chunk_size):
+                for row in batch.to_pylist():
+                    yield table, row
+        return
+
+    with open_stream(path, "rb", compression) as stream:
+        if fmt == "csv":
+            reader = csv.reader(stream)
+            header = next(reader, None)
+            for line_number, values in enumerate(reader, start=2):
+                record = dict(zip(header, values))
+                table = record.pop("table", None)
+                if table == "manifest":
+                    yield table, json.loads(record["content"])
+                elif table in COLUMNS:
+                    yield table, {c: record.get(c) for c in COLUMNS[table]}
+                else:
+                    raise ValueError(f"Line {line_number}: unknown table '{table}'")
+            return
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+            table = record.pop("table", None)
+            if table is None:
+                raise ValueError(f"Line {line_number}: not a spark export record")
+            if table != "manifest" and table not in COLUMNS:
+                raise ValueError(f"Line {line_number}: unknown table '{table}'")
+            yield table, record
+
+def _insert(connection, table):
+    # Same as helpers.dialect_insert, for a Core connection
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def reserve_spark_ids(connection, low, high):
+    """Claim a block of spark ids for an import; returns (offset, placeholder id or None).
+
+    Old ids low..high become low+offset..high+offset, all above every
+    existing spark, so sparks keep their relative order and memberships can
+    be remapped by arithmetic instead of a lookup table the size of the
+    dump. The block is fenced off from concurrent `add`s: on PostgreSQL by
+    moving the sequence past it, on SQLite by a placeholder row just above it
+    (new rowids are max(rowid) + 1) that finish_import deletes. The
+    placeholder is born deleted, with no context or content, so no read,
+    stats table, FTS index or `spark gc` sees it, and its change log entry
+    is dropped before anything can sync it.
+    """
+    from sqlalchemy import select, func, literal, text
+    from db.lite import deletion_stamp, new_uid
+
+    sparks = _tables()["sparks"]
+    span = high - low + 1
+    if connection.dialect.name == "postgresql":
+        start = connection.scalar(text("SELECT nextval(pg_get_serial_sequence('sparks', 'id'))"))
+        connection.execute(
+            text("SELECT setval(pg_get_serial_sequence('sparks', 'id'), :top)"), {"top": start + span}
+        )
+        return start - low, None
+    # One statement, so no other writer can slip in between reading max(id) and claiming it
+    uid = new_uid()
+    connection.execute(
+        sparks.insert().from_select(
+            ["id", "content", "uid", "deleted_at"],
+            select(
+                func.coalesce(func.max(sparks.c.id), 0) + span + 1,
+                literal(""), literal(uid), literal(deletion_stamp()),
+            ),
+        )
+    )
+    _forget_changes(connection, uid)
+    placeholder = connection.scalar(select(func.max(sparks.c.id)))
+    return placeholder - 1 - high, placeholder
+
+def _forget_changes(connection, uid):
+    """Drop the sync change log entries the placeholder's triggers wrote."""
+    from sqlalchemy import text
+    connection.execute(text("DELETE FROM changes WHERE table_name = 'sparks' AND row_key = :uid"), {"uid": uid})
+
+def _import_by_key(connection, table, key, rows, mapping):
+    """Get-or-create rows by their natural key and record old id -> new id."""
+    from sqlalchemy import select
+
+    columns = [c for c in COLUMNS[table.name] if c != "id"]
+    connection.execute(
+        _insert(connection, table).on_conflict_do_nothing(index_elements=[key]),
+        [{c: row.get(c) for c in columns} for row in rows],
+    )
+    old_ids = {row[key]: row["id"] for row in rows}
+    for row_id, value in connection.execute(
+        select(table.c.id, table.c[key]).where(table.c[key].in_(list(old_ids)))
+    ):
+        mapping[old_ids[value]] = row_id
+
+def import_chunk(connection, table, rows, state):
+    from sqlalchemy import select, bindparam, Integer
+    from db.lite import new_uid
+
+    tables = _tables()
+    if table == "contexts":
+        _import_by_key(connection, tables[table], "working_directory", rows, state["contexts"])
+    elif table == "collections":
+        _import_by_key(connection, tables[table], "name", rows, state["collections"])
+    elif table == "sparks":
+        offset = state["spark_offset"]
+        connection.execute(
+            # Explicit ids: a chunk replayed after a crash conflicts and is skipped,
+            # and so does a spark whose uid is already here (the same spark)
+            _insert(connection, tables[table]).on_conflict_do_nothing(),
+            [
+                {
+                    "id": row["id"] + offset,
+                    # Kept so sync matches it with its source; version 1 dumps
+                    # have none, so those get a fresh one
+                    "uid": row.get("uid") or new_uid(),
+                    "content": row["content"],
+                    "created_at": row["created_at"],
+                    "updated_at": row["updated_at"],
+                    "context_id": state["contexts"].get(row["context_id"]),
+                }
+                for row in rows
+            ],
+        )
+    else:
+        # Only link sparks that made it in: a resumed export can list memberships
+        # of sparks created after its sparks were written
+        sparks = tables["sparks"]
+        statement = _insert(connection, tables[table]).from_select(
+            ["spark_id", "collection_id"],
+            select(sparks.c.id, bindparam("new_collection_id", type_=Integer)).where(
+                sparks.c.id == bindparam("new_spark_id")
+            ),
+        ).on_conflict_do_nothing()
+        links = [
+            {"new_spark_id": row["spark_id"] + state["spark_offset"], "new_collection_id": state["collections"][row["collection_id"]]}
+            for row in rows
+            if state["spark_offset"] is not None and row["collection_id"] in state["collections"]
+        ]
+        if links:
+            connection.execute(statement, links)
+
+def finish_import(connection, state):
+    if state.get("placeholder") is not None:
+        from sqlalchemy import delete
+        sparks = _tables()["sparks"]
+        uid = connection.scalar(delete(sparks).where(sparks.c.id == state["placeholder"]).returning(sparks.c.uid))
+        if uid is not None:
+            _forget_changes(connection, uid)
+
+def _load_import_state(path):
+    state = load_checkpoint(path, "import")
+    if state:
+        # JSON object keys are strings
+        for name in ("contexts", "collections"):
+            state[name] = {int(old): new for old, new in state[name].items()}
+    return state
+
+def import_store(engine, path, fmt="jsonl", compression="none", chunk_size=10_000, resume=False):
+    """Stream a dump into the store behind `engine`; yields (table, rows imported so far) per chunk.
+
+    Rows get new ids: contexts and collections are merged with existing ones
+    by working directory and name, sparks move into a freshly reserved id
+    block, and memberships follow both. Each chunk is one transaction
+    followed by a checkpoint, so resume=True skips what already committed.
+    """
+    check_dependencies(fmt, compression)
+    state = _load_import_state(path) if resume else None
+    if not resume and load_checkpoint(path, "import"):
+        raise ValueError(
+            f"An interrupted import of {path} exists; pass --resume to continue it "
+            f"or delete {checkpoint_path(path, 'import')} to start over"
+        )
+
+    records = read_records(path, fmt, compression, chunk_size)
+    table, manifest = next(records, (None, None))
+    if table != "manifest" or manifest.get("format") != FORMAT_NAME:
+        raise ValueError(f"{path} is not a spark export")
+    if manifest["version"] > FORMAT_VERSION:
+        raise ValueError(f"{path} is a version {manifest['version']} export; this spark reads up to version {FORMAT_VERSION}")
+
+    if state is None:
+        state = {
+            "records": 0, "rows": dict.fromkeys(TABLES, 0), "contexts": {}, "collections": {},
+            "spark_offset": None, "placeholder": None,
+        }
+        low, high = manifest["spark_ids"]
+        if low is not None:
+            with engine.begin() as connection:
+                state["spark_offset"], state["placeholder"] = reserve_spark_ids(connection, low, high)
+        save_checkpoint(path, "import", state)
+    else:
+        yield from _resumed_progress(state)
+    records = islice(records, state["records"], None)
+
+    def flush(table, rows):
+        with engine.begin() as connection:
+            import_chunk(connection, table, [_decode(row) for row in rows], state)
+        state["records"] += len(rows)
+        state["rows"][table] += len(rows)
+        save_checkpoint(path, "import", state)
+        return table, state["rows"][table]
+
+    pending_table, pending = None, []
+    for table, row in records:
+        if table == "manifest":
+            continue
+        if pending and (table != pending_table or len(pending) >= chunk_size):
+            yield flush(pending_table, pending)
+            pending = []
+        pending_table = table
+        pending.append(row)
+    if pending:
+        yield flush(pending_table, pending)
+
+    with engine.begin() as connection:
+        finish_import(connection, state)
+    remove_checkpoint(path, "import")
@@ -1,11 +1,181 @@
-from db.models import Base, Context, Spark, Collection
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from db.models import Base, Change, Context, Spark, Collection, spark_collection
+from db.lite import build_fts_query, HIGHLIGHT_START, HIGHLIGHT_END
+from db.query import build_tsquery
+from sqlalchemy import create_engine, text, func, tuple_, insert, select, update, delete, literal, and_, or_, column, Integer
+from sqlalchemy.orm import aliased, sessionmaker, selectinload, Session, make_transient_to_detached
+from sqlalchemy import event, inspect
+from db import instrument
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import islice
+import os
+import threading
+import time
 
 # engine = create_engine("sqlite:///db/spark_store.db")
 # Session = sessionmaker(bind=engine)
 # session = Session()
 
+# Identity cache: snapshots of recently loaded sparks and collections,
+# shared by every session in the process
+IDENTITY_CACHE_SIZE = int(os.environ.get("SPARK_IDENTITY_CACHE_SIZE", 1024))
+IDENTITY_CACHE_TTL = float(os.environ.get("SPARK_IDENTITY_CACHE_TTL", 30))
+
+class IdentityCache:
+    """Bounded LRU of column values by (database, model, primary key), plus collection ids by name.
+
+    A lookup first tries the session's own identity map; otherwise a cached
+    snapshot is merged into the session without a query. Only committed rows
+    are shared: rows loaded by a session that has written in its current
+    transaction wait on the session until it commits (or, for a unit of
+    work, until its outer transaction does) and are dropped if it doesn't.
+    Write helpers invalidate what they change and any rollback clears the
+    cache, so only writes from other processes can be served stale, for up
+    to `max_age` seconds. Relationships are never cached, so membership
+    changes don't invalidate anything.
+    """
+
+    def __init__(self, max_size=IDENTITY_CACHE_SIZE, max_age=IDENTITY_CACHE_TTL):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.max_age:
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._entries.pop(key, None)
+            return None
+
+    def _store(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _database(session):
+        return str(session.get_bind().engine.url)
+
+    def get(self, session, model, key):
+        """The cached row as an instance in `session`, or None (a miss)."""
+        instance = session.identity_map.get(session.identity_key(model, key))
+        if instance is not None and not inspect(instance).expired:
+            self.hits += 1
+            return instance
+        values = self._lookup((self._database(session), model, key))
+        if values is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        instance = model(**values)
+        make_transient_to_detached(instance)
+        return session.merge(instance, load=False)
+
+    def get_collection(self, session, name):
+        collection_id = self._lookup((self._database(session), Collection, "name", name))
+        if collection_id is None:
+            self.misses += 1
+            return None
+        collection = self.get(session, Collection, collection_id)
+        # Renamed since: the name entry outlived its row's snapshot
+        return collection if collection is not None and collection.name == name else None
+
+    def put(self, session, instance):
+        state = inspect(instance)
+        columns = [attr.key for attr in state.mapper.column_attrs]
+        if state.key is None or any(column not in state.dict for column in columns):
+            return  # pending, or partly expired
+        database = self._database(session)
+        entries = [((database, type(instance), state.identity[0]), {column: state.dict[column] for column in columns})]
+        if isinstance(instance, Collection):
+            entries.append(((database, Collection, "name", instance.name), instance.id))
+        if session.info.get(WROTE) or session.info.get(OUTER_TRANSACTION):
+            # May not be committed yet; other sessions must not see it before then
+            session.info.setdefault(STAGED, []).extend(entries)
+            return
+        for key, value in entries:
+            self._store(key, value)
+
+    def publish(self, session):
+        """Share the rows `session` loaded since it last wrote, now that its writes are committed."""
+        for key, value in session.info.pop(STAGED, ()):
+            self._store(key, value)
+
+    def invalidate(self, session, model, key):
+        database = self._database(session)
+        with self._lock:
+            values = self._entries.pop((database, model, key), (None, None))[1]
+            if model is Collection and values is not None:
+                self._entries.pop((database, Collection, "name", values["name"]), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+# session.info keys: the current transaction has written, rows waiting for
+# its commit, and set by store.unit_of_work on sessions joined to an outer
+# transaction, whose commits only count once that transaction commits
+WROTE = "identity_cache_wrote"
+STAGED = "identity_cache_staged"
+OUTER_TRANSACTION = "identity_cache_outer_transaction"
+
+identity_cache = IdentityCache()
+instrument.register_counters("identity cache", identity_cache.stats)
+
+@event.listens_for(Session, "do_orm_execute")
+def _note_write(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info[WROTE] = True
+
+@event.listens_for(Session, "after_flush")
+def _note_flush(session, flush_context):
+    session.info[WROTE] = True
+
+@event.listens_for(Session, "after_commit")
+def _publish_identity_cache(session):
+    if not session.info.get(OUTER_TRANSACTION):
+        identity_cache.publish(session)
+        session.info.pop(WROTE, None)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _clear_identity_cache(session, previous_transaction):
+    # Rows read or written in the rolled back transaction may not exist
+    session.info.pop(STAGED, None)
+    session.info.pop(WROTE, None)
+    identity_cache.clear()
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_staged(session, transaction):
+    # Ended without a commit (closed): its writes, and what was read after them, are gone
+    if transaction.parent is None and not session.info.get(OUTER_TRANSACTION):
+        session.info.pop(STAGED, None)
+        session.info.pop(WROTE, None)
+
+# Sparks not deleted; tombstones (deleted_at set) stay until `spark gc`
+LIVE = Spark.deleted_at.is_(None)
+# Tombstones undo and gc act on; the one without a context is an import's
+# id fence (db.transfer.reserve_spark_ids), removed when the import ends
+DELETED = Spark.deleted_at.is_not(None) & Spark.context_id.is_not(None)
+
+def _cached(session, model, key, query):
+    instance = identity_cache.get(session, model, key)
+    if instance is None:
+        instance = query.first()
+        if instance is not None:
+            identity_cache.put(session, instance)
+    return instance
+
 # Context CRUD
 def create_context(session, working_dir, project_name):
     try:
@@ -69,7 +239,8 @@ def create_spark(session, content, context):
 
 def get_spark_by_id(session, spark_id):
     try:
-        return session.query(Spark).where(Spark.id == spark_id).first()
+        spark = _cached(session, Spark, spark_id, session.query(Spark).where(Spark.id == spark_id))
+        return spark if spark is not None and spark.deleted_at is None else None
     except Exception as e:
         raise e
 
@@ -77,9 +248,13 @@ def update_spark(session, spark_id, **kwargs):
     try:
         spark = get_spark_by_id(session, spark_id)
         if spark:
+            if "content" in kwargs and kwargs["content"] != spark.content:
+                from db import revisions
+                revisions.record(session, spark_id, kwargs["content"])
             for key, value in kwargs.items():
                 if hasattr(spark, key) and key != "id":
                     setattr(spark, key, value)
+            identity_cache.invalidate(session, Spark, spark_id)
             session.commit()
             return spark
         else:
@@ -88,18 +263,181 @@ def update_spark(session, spark_id, **kwargs):
         session.rollback()
         raise e
 
+def revert_spark(session, spark_id, rev):
+    """Make revision `rev` the spark's content again, as a new revision."""
+    try:
+        from db import revisions
+        content = revisions.content_at(session, spark_id, rev)
+        if content is None:
+            raise ValueError(f"Spark with id {spark_id} has no revision {rev}.")
+        return update_spark(session, spark_id, content=content)
+    except Exception as e:
+        session.rollback()
+        raise e
+
 def delete_spark(session, spark_id):
     try:
         spark = get_spark_by_id(session, spark_id)
         if spark:
-            session.delete(spark)
-            session.commit()
+            delete_sparks(session, select(Spark.id).where(Spark.id == spark_id))
         else:
             raise ValueError(f"Spark with id {spark_id} does not exist.")
     except Exception as e:
         session.rollback()
         raise e
 
+# Soft delete: a delete only stamps deleted_at, so it is one UPDATE however
+# many sparks are selected and `spark undo` can bring them back. Memberships
+# and revisions stay with the tombstone; purge_deleted_sparks removes them
+# with the row (ON DELETE CASCADE) in short batches.
+
+def delete_sparks(session, selection):
+    """Tombstone the selected live sparks with one shared deleted_at; returns how many."""
+    try:
+        # Microseconds keep batches apart, so undo can find the last one
+        stamp = datetime.now(timezone.utc).replace(tzinfo=None)
+        deleted = session.execute(
+            update(Spark).where(Spark.id.in_(selection), LIVE)
+            # updated_at=itself: deleting isn't an edit
+            .values(deleted_at=stamp, updated_at=Spark.updated_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        identity_cache.clear()
+        session.commit()
+        return deleted
+    except Exception as e:
+        session.rollback()
+        raise e
+
+def restore_sparks(session, selection=None, context_id=None):
+    """Bring back the selected tombstoned sparks, by default the last batch deleted on this
+    replica (in `context_id`, if given); returns how many."""
+    try:
+        if selection is None:
+            # Deletes pulled from a peer (their last change has an origin) aren't ours to undo
+            later = aliased(Change)
+            last_change = select(func.max(later.seq)).where(
+                later.table_name == "sparks", later.row_key == Spark.uid
+            ).correlate_except(later).scalar_subquery()
+            pulled = select(Change.seq).where(Change.seq == last_change, Change.origin.is_not(None)).exists()
+            batch = [DELETED, ~pulled]
+            if context_id is not None:
+                batch.append(Spark.context_id == context_id)
+            last = select(func.max(Spark.deleted_at)).where(*batch).scalar_subquery()
+            picked = (Spark.deleted_at == last) & and_(*batch)
+        else:
+            picked = Spark.id.in_(selection) & DELETED
+        # A restore is a write: sync needs it to be newer than the delete it undoes
+        restored = session.execute(
+            update(Spark).where(picked)
+            .values(deleted_at=None, updated_at=datetime.now(timezone.utc).replace(tzinfo=None))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        identity_cache.clear()
+        session.commit()
+        return restored
+    except Exception as e:
+        session.rollback()
+        raise e
+
+def _purge_in_batches(session, statement, batch_size):
+    total = 0
+    while True:
+        try:
+            purged = session.execute(statement, execution_options={"synchronize_session": False}).rowcount
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        total += purged
+        if purged < batch_size:
+            return total
+
+def purge_deleted_sparks(session, before=None, batch_size=1000):
+    """DELETE tombstones (deleted before `before`, if given) `batch_size` at a time, one
+    transaction per batch so other writers get the lock in between; returns how many."""
+    tombstones = [DELETED]
+    if before is not None:
+        tombstones.append(Spark.deleted_at < before)
+    batch = select(Spark.id).where(*tombstones).limit(batch_size)
+    return _purge_in_batches(session, delete(Spark).where(Spark.id.in_(batch)), batch_size)
+
+def purge_orphan_memberships(session, batch_size=1000):
+    """DELETE memberships whose spark or collection is gone, left from before foreign keys
+    were enforced (or by connections that turn them off); returns how many."""
+    columns = spark_collection.c
+    orphans = select(columns.spark_id, columns.collection_id).where(or_(
+        ~select(Spark.id).where(Spark.id == columns.spark_id).exists(),
+        ~select(Collection.id).where(Collection.id == columns.collection_id).exists(),
+    )).limit(batch_size)
+    statement = delete(spark_collection).where(tuple_(columns.spark_id, columns.collection_id).in_(orphans))
+    return _purge_in_batches(session, statement, batch_size)
+
+def dialect_insert(session, table):
+    """INSERT construct for the session's backend, which supports on_conflict_do_nothing()."""
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as backend_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as backend_insert
+    return backend_insert(table)
+
+def get_or_create_collection(session, name):
+    """Race-free get-or-create: concurrent writers may insert the same name."""
+    collection = identity_cache.get_collection(session, name)
+    if collection is not None:
+        return collection
+    session.execute(
+        dialect_insert(session, Collection).values(name=name).on_conflict_do_nothing(index_elements=["name"])
+    )
+    return _get_collection_by_name(session, name)
+
+def create_spark_in_collection(session, content, context_id, collection_name):
+    """Create a spark and file it under `collection_name` (created if missing) in one commit."""
+    try:
+        collection = get_or_create_collection(session, collection_name)
+        spark = Spark(content=content, context_id=context_id, collections=[collection])
+        session.add(spark)
+        session.commit()
+        return spark
+    except Exception as e:
+        session.rollback()
+        raise e
+
+def bulk_create_sparks(session, records, context_id, default_collection, batch_size=1000):
+    """ORM-side counterpart of db.lite.bulk_add_sparks for non-SQLite backends.
+
+    Sparks go in through a multi-row INSERT ... RETURNING so the new ids come
+    back without a round trip per row; yields the running total per batch.
+    """
+    collection_ids = {}
+    records = iter(records)
+    total = 0
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        try:
+            names = {name or default_collection for _, name in batch}
+            for name in names - collection_ids.keys():
+                collection_ids[name] = get_or_create_collection(session, name).id
+            spark_ids = session.scalars(
+                insert(Spark).returning(Spark.id, sort_by_parameter_order=True),
+                [{"content": content, "context_id": context_id} for content, _ in batch],
+            ).all()
+            session.execute(
+                insert(spark_collection),
+                [
+                    {"spark_id": spark_id, "collection_id": collection_ids[name or default_collection]}
+                    for spark_id, (_, name) in zip(spark_ids, batch)
+                ],
+            )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        total += len(batch)
+        yield total
+
 # Collection CRUD
 def create_collection(session, name, description=None):
     try:
@@ -116,7 +454,8 @@ def create_collection(session, name, description=None):
 
 def get_collection_by_id(session, collection_id):
     try:
-        return session.query(Collection).where(Collection.id == collection_id).first()
+        query = session.query(Collection).where(Collection.id == collection_id)
+        return _cached(session, Collection, collection_id, query)
     except Exception as e:
         raise e
 
@@ -127,6 +466,7 @@ def update_collection(session, collection_id, **kwargs):
             for key, value in kwargs.items():
                 if hasattr(collection, key) and key != "id":
                     setattr(collection, key, value)
+            identity_cache.invalidate(session, Collection, collection_id)
             session.commit()
             return collection
         else:
@@ -139,6 +479,7 @@ def delete_collection(session, collection_id):
     try:
         collection = get_collection_by_id(session, collection_id)
         if collection:
+            identity_cache.invalidate(session, Collection, collection_id)
             session.delete(collection)
             session.commit()
         else:
@@ -162,62 +503,183 @@ def get_all_contexts(session):
 
 def get_sparks_by_context(session, context_id):
     try:
-        return session.query(Spark).where(Spark.context_id == context_id).all()
+        return session.query(Spark).where(Spark.context_id == context_id, LIVE).all()
+    except Exception as e:
+        raise e
+
+def iter_sparks_by_context(session, context_id, after_id=None, limit=None, reverse=False, batch_size=500):
+    """Stream a context's sparks in creation order, `batch_size` rows at a time.
+
+    Keyset pagination: `after_id` continues after that spark instead of
+    using an OFFSET that has to skip every earlier row.
+    """
+    try:
+        query = session.query(Spark).where(Spark.context_id == context_id, LIVE)
+        key = tuple_(Spark.created_at, Spark.id)
+        if after_id is not None:
+            anchor = session.query(Spark.created_at).where(Spark.id == after_id).scalar()
+            after = tuple_(anchor, after_id)
+            query = query.where(key < after if reverse else key > after)
+        if reverse:
+            query = query.order_by(Spark.created_at.desc(), Spark.id.desc())
+        else:
+            query = query.order_by(Spark.created_at, Spark.id)
+        return query.limit(limit).yield_per(batch_size)
+    except Exception as e:
+        raise e
+
+def query_sparks(session, plan, context_id=None, after_id=None, limit=None, reverse=False, batch_size=500):
+    """Stream the rows of a compiled `list` query (a db.query.Plan), `batch_size` at a time."""
+    try:
+        sql, params = plan.statement(context_id, after_id, limit, reverse)
+        return session.execute(text(sql), params, execution_options={"yield_per": batch_size})
+    except Exception as e:
+        raise e
+
+def iter_sparks_by_collection(session, collection_id, after_id=None, limit=None, reverse=False, batch_size=500):
+    try:
+        query = session.query(Spark).join(
+            spark_collection, spark_collection.c.spark_id == Spark.id
+        ).where(spark_collection.c.collection_id == collection_id, LIVE)
+        if after_id is not None:
+            if reverse:
+                query = query.where(spark_collection.c.spark_id < after_id)
+            else:
+                query = query.where(spark_collection.c.spark_id > after_id)
+        order = spark_collection.c.spark_id.desc() if reverse else spark_collection.c.spark_id
+        return query.order_by(order).limit(limit).yield_per(batch_size)
     except Exception as e:
         raise e
 
 def get_sparks_by_collection(session, collection_id):
     try:
-        collection = get_collection_by_id(session, collection_id)
-        if collection:
-            return collection.sparks
+        if get_collection_by_id(session, collection_id):
+            return iter_sparks_by_collection(session, collection_id).all()
         return []
     except Exception as e:
         raise e
 
-def get_sparks_from_today(session, context_id):
+def get_sparks_from_today(session, context_id, timezone=None):
+    """Sparks created since local midnight, as a half-open range on the indexed created_at."""
     try:
-        from datetime import datetime, date
-        today = date.today()
+        from db.query import date_bounds, local_timezone
+        start, end = date_bounds("today")(local_timezone(timezone))
         return session.query(Spark).where(
             Spark.context_id == context_id,
-            func.date(Spark.created_at) == today
-        ).all()
+            Spark.created_at >= start,
+            Spark.created_at < end,
+            LIVE,
+        ).order_by(Spark.created_at, Spark.id).all()
     except Exception as e:
         raise e
 
-def search_sparks(session, context_id, search_term):
+def search_sparks(session, context_id, search_term, limit=50):
     try:
-        return session.query(Spark).where(
-            Spark.context_id == context_id,
-            Spark.content.ilike(f"%{search_term}%")
+        if session.get_bind().dialect.name != "sqlite":
+            return _search_sparks_postgres(session, context_id, search_term, limit)
+        fts_query = build_fts_query(search_term)
+        if not fts_query:
+            return []
+        return session.execute(
+            text(
+                "SELECT sparks.id, sparks.content, "
+                "snippet(sparks_fts, 0, :hl_start, :hl_end, '...', 16) AS snippet, "
+                "bm25(sparks_fts) AS rank "
+                "FROM sparks_fts JOIN sparks ON sparks.id = sparks_fts.rowid "
+                "WHERE sparks_fts MATCH :query AND sparks.context_id = :context_id "
+                "ORDER BY rank LIMIT :limit"
+            ),
+            {
+                "hl_start": HIGHLIGHT_START,
+                "hl_end": HIGHLIGHT_END,
+                "query": fts_query,
+                "context_id": context_id,
+                "limit": limit,
+            },
         ).all()
     except Exception as e:
         raise e
 
+def _search_sparks_postgres(session, context_id, search_term, limit):
+    ts_query = build_tsquery(search_term)
+    if not ts_query:
+        return []
+    # Matches the expression indexed by ix_sparks_content_tsv
+    return session.execute(
+        text(
+            "SELECT sparks.id, sparks.content, "
+            "ts_headline('simple', sparks.content, q, :headline) AS snippet, "
+            "ts_rank(to_tsvector('simple', sparks.content), q) AS rank "
+            "FROM sparks, to_tsquery('simple', :query) AS q "
+            "WHERE to_tsvector('simple', sparks.content) @@ q AND sparks.context_id = :context_id "
+            "AND sparks.deleted_at IS NULL "
+            "ORDER BY rank DESC LIMIT :limit"
+        ),
+        {
+            "headline": f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_END}", MaxWords=16, MinWords=5',
+            "query": ts_query,
+            "context_id": context_id,
+            "limit": limit,
+        },
+    ).all()
+
 def get_all_collections(session):
     try:
         return session.query(Collection).all()
     except Exception as e:
         raise e
 
+def get_collection_spark_counts(session):
+    """Return (collection, spark_count) pairs using a single GROUP BY query."""
+    try:
+        return session.query(Collection, func.count(Spark.id)).outerjoin(
+            spark_collection, spark_collection.c.collection_id == Collection.id
+        ).outerjoin(Spark, (Spark.id == spark_collection.c.spark_id) & LIVE).group_by(Collection.id).order_by(Collection.name).all()
+    except Exception as e:
+        raise e
+
+def get_collection_spark_count(session, collection_id):
+    try:
+        return session.query(func.count(spark_collection.c.spark_id)).join(
+            Spark, Spark.id == spark_collection.c.spark_id
+        ).where(spark_collection.c.collection_id == collection_id, LIVE).scalar()
+    except Exception as e:
+        raise e
+
+def get_spark_with_collections(session, spark_id):
+    try:
+        return session.query(Spark).options(selectinload(Spark.collections)).where(
+            Spark.id == spark_id, LIVE
+        ).first()
+    except Exception as e:
+        raise e
+
+def get_collection_with_sparks(session, collection_id):
+    try:
+        return session.query(Collection).options(selectinload(Collection.sparks.and_(LIVE))).where(
+            Collection.id == collection_id
+        ).first()
+    except Exception as e:
+        raise e
+
 def get_collection_by_name(session, name):
     try:
-        return session.query(Collection).where(Collection.name == name).first()
+        return identity_cache.get_collection(session, name) or _get_collection_by_name(session, name)
     except Exception as e:
         raise e
 
+def _get_collection_by_name(session, name):
+    collection = session.query(Collection).where(Collection.name == name).first()
+    if collection is not None:
+        identity_cache.put(session, collection)
+    return collection
+
 def add_spark_to_collection(session, spark_id, collection_id):
     try:
         spark = get_spark_by_id(session, spark_id)
-        collection = get_collection_by_id(session, collection_id)
-        
-        if spark and collection:
-            if collection not in spark.collections:
-                spark.collections.append(collection)
-                session.commit()
-            return spark
-        return None
+        if spark:
+            add_sparks_to_collection(session, select(Spark.id).where(Spark.id == spark_id), collection_id)
+        return spark
     except Exception as e:
         session.rollback()
         raise e
@@ -225,14 +687,99 @@ def add_spark_to_collection(session, spark_id, collection_id):
 def remove_spark_from_collection(session, spark_id, collection_id):
     try:
         spark = get_spark_by_id(session, spark_id)
-        collection = get_collection_by_id(session, collection_id)
-        
-        if spark and collection:
-            if collection in spark.collections:
-                spark.collections.remove(collection)
-                session.commit()
-            return spark
-        return None
+        if spark:
+            remove_sparks_from_collection(session, select(Spark.id).where(Spark.id == spark_id), collection_id)
+        return spark
+    except Exception as e:
+        session.rollback()
+        raise e
+
+# Bulk collection membership: set-based statements on spark_collections, one
+# transaction per operation however many sparks are selected
+
+def select_spark_ids(session, ids=(), ranges=(), search=None, context_id=None, in_collection_id=None, deleted=False):
+    """SELECT of spark ids for the bulk collection operations, delete and undo.
+
+    `ids` and inclusive (low, high) `ranges` are OR-ed together; a search
+    query (scoped to `context_id`) and membership of `in_collection_id`
+    narrow the result further. At least one filter is required. Picks live
+    sparks, or tombstones with `deleted`.
+    """
+    criteria = []
+    picked = [Spark.id.in_(ids)] if ids else []
+    picked.extend(Spark.id.between(low, high) for low, high in ranges)
+    if picked:
+        criteria.append(or_(*picked))
+    if search is not None:
+        criteria.append(Spark.context_id == context_id)
+        criteria.append(_search_filter(session, search))
+    if in_collection_id is not None:
+        criteria.append(Spark.id.in_(
+            select(spark_collection.c.spark_id).where(spark_collection.c.collection_id == in_collection_id)
+        ))
+    if not criteria:
+        raise ValueError("Select sparks by ID, range (e.g. 10-200), --search or --in")
+    criteria.append(DELETED if deleted else LIVE)
+    return select(Spark.id).where(*criteria)
+
+def _search_filter(session, search_term):
+    if session.get_bind().dialect.name == "sqlite":
+        fts_query = build_fts_query(search_term)
+        if not fts_query:
+            raise ValueError(f"Nothing to search for in '{search_term}'")
+        matches = text("SELECT rowid FROM sparks_fts WHERE sparks_fts MATCH :fts_query")
+        return Spark.id.in_(matches.bindparams(fts_query=fts_query).columns(column("rowid", Integer)))
+    ts_query = build_tsquery(search_term)
+    if not ts_query:
+        raise ValueError(f"Nothing to search for in '{search_term}'")
+    return func.to_tsvector("simple", Spark.content).bool_op("@@")(func.to_tsquery("simple", ts_query))
+
+def _insert_memberships(session, selection, collection_id):
+    # Sparks already in the collection hit the primary key and are skipped
+    statement = dialect_insert(session, spark_collection).from_select(
+        ["spark_id", "collection_id"], selection.add_columns(literal(collection_id))
+    ).on_conflict_do_nothing()
+    return session.execute(statement).rowcount
+
+def add_sparks_to_collection(session, selection, collection_id):
+    """INSERT ... SELECT every selected spark into the collection; returns how many were added."""
+    try:
+        added = _insert_memberships(session, selection, collection_id)
+        session.commit()
+        return added
+    except Exception as e:
+        session.rollback()
+        raise e
+
+def remove_sparks_from_collection(session, selection, collection_id):
+    """DELETE the selected sparks' memberships of the collection; returns how many were removed."""
+    try:
+        removed = session.execute(
+            delete(spark_collection).where(
+                spark_collection.c.collection_id == collection_id,
+                spark_collection.c.spark_id.in_(selection),
+            )
+        ).rowcount
+        session.commit()
+        return removed
+    except Exception as e:
+        session.rollback()
+        raise e
+
+def move_sparks_to_collection(session, selection, collection_id, from_collection_id=None):
+    """Add the selected sparks to the collection and take them out of `from_collection_id`
+    (default: every other collection) in one transaction. Returns (added, removed)."""
+    try:
+        added = _insert_memberships(session, selection, collection_id)
+        if from_collection_id is not None:
+            source = spark_collection.c.collection_id == from_collection_id
+        else:
+            source = spark_collection.c.collection_id != collection_id
+        removed = session.execute(
+            delete(spark_collection).where(source, spark_collection.c.spark_id.in_(selection))
+        ).rowcount
+        session.commit()
+        return added, removed
     except Exception as e:
         session.rollback()
         raise e
\ No newline at end of file
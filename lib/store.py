@@ -0,0 +1,236 @@
+# store.py
+# Library API over the ORM helpers, for scripts and services that embed spark
+# instead of shelling out to the CLI.
+#
+#   with SparkStore("sqlite:////home/me/sparks.db") as store:
+#       context = store.get_or_create_context("/home/me/app", "app")
+#       store.add_spark("cache session tokens", context.id, "perf")
+#       with store.unit_of_work() as uow:        # one transaction for the lot
+#           for line in ideas:
+#               uow.add_spark(line, context.id, "inbox")
+#
+#   async with AsyncSparkStore() as store:     # SQLAlchemy's asyncio engine
+#       sparks = await asyncio.gather(*(store.get_spark(i) for i in ids))
+#
+# Every operation is a helpers.py function run on a session of its own, so
+# concurrent callers (threads, or tasks on one event loop) never share one.
+# The helpers commit as they go; inside a unit of work their session is
+# joined to an outer transaction whose commit is only a flush, and which is
+# committed when the block exits or rolled back if it raises.
+#
+# AsyncSparkStore runs the same helpers through AsyncSession.run_sync, so
+# queries await the driver (aiosqlite for SQLite) and the event loop keeps
+# serving other tasks in the meantime. It needs aiosqlite for SQLite stores.
+from contextlib import asynccontextmanager, contextmanager
+
+from db import storage
+import helpers
+
+def _get_or_create_context(session, working_dir, project_name):
+    context = helpers.get_context_by_working_dir(session, working_dir)
+    return context or helpers.create_context(session, working_dir, project_name)
+
+def _add_spark(session, content, context_id, collection):
+    if collection is None:
+        return helpers.create_spark(session, content, helpers.get_context_by_id(session, context_id))
+    return helpers.create_spark_in_collection(session, content, context_id, collection)
+
+def _add_sparks(session, records, context_id, default_collection, batch_size):
+    total = 0
+    for total in helpers.bulk_create_sparks(session, records, context_id, default_collection, batch_size):
+        pass
+    return total
+
+def _get_spark(session, spark_id, with_collections):
+    if with_collections:
+        return helpers.get_spark_with_collections(session, spark_id)
+    return helpers.get_spark_by_id(session, spark_id)
+
+def _list_sparks(session, context_id, after_id, limit, reverse):
+    return helpers.iter_sparks_by_context(session, context_id, after_id, limit, reverse).all()
+
+def _spark_history(session, spark_id):
+    from db import revisions
+    return revisions.history(session, spark_id)
+
+def _restore_sparks(session, spark_ids, context_id):
+    selection = None if spark_ids is None else helpers.select_spark_ids(session, ids=spark_ids, deleted=True)
+    return helpers.restore_sparks(session, selection, context_id)
+
+def _add_to_collection(session, spark_ids, collection):
+    collection_id = helpers.get_or_create_collection(session, collection).id
+    return helpers.add_sparks_to_collection(session, helpers.select_spark_ids(session, ids=spark_ids), collection_id)
+
+class _Operations:
+    """The store's operations, each run through `_run(fn, *args)`.
+
+    `_run` is synchronous in SparkStore and UnitOfWork and a coroutine in the
+    async classes, so the same methods return results or awaitables.
+    """
+
+    def get_or_create_context(self, working_dir, project_name):
+        return self._run(_get_or_create_context, working_dir, project_name)
+
+    def get_context(self, working_dir):
+        return self._run(helpers.get_context_by_working_dir, working_dir)
+
+    def add_spark(self, content, context_id, collection=None):
+        return self._run(_add_spark, content, context_id, collection)
+
+    def add_sparks(self, records, context_id, default_collection, batch_size=1000):
+        """Add (content, collection or None) pairs in multi-row batches; returns how many."""
+        return self._run(_add_sparks, records, context_id, default_collection, batch_size)
+
+    def get_spark(self, spark_id, with_collections=False):
+        return self._run(_get_spark, spark_id, with_collections)
+
+    def update_spark(self, spark_id, **changes):
+        return self._run(helpers.update_spark, spark_id, **changes)
+
+    def spark_history(self, spark_id):
+        """[(rev, created_at, content)] of an edited spark, oldest first; empty if never edited."""
+        return self._run(_spark_history, spark_id)
+
+    def revert_spark(self, spark_id, rev):
+        return self._run(helpers.revert_spark, spark_id, rev)
+
+    def delete_spark(self, spark_id):
+        """Soft delete: the spark disappears from every read until restored or purged by gc."""
+        return self._run(helpers.delete_spark, spark_id)
+
+    def restore_sparks(self, spark_ids=None, context_id=None):
+        """Undo deletes of the given sparks, or else of the batch deleted last here (in
+        `context_id`, if given; deletes pulled by sync are skipped); returns how many."""
+        return self._run(_restore_sparks, None if spark_ids is None else list(spark_ids), context_id)
+
+    def list_sparks(self, context_id, after_id=None, limit=None, reverse=False):
+        return self._run(_list_sparks, context_id, after_id, limit, reverse)
+
+    def search_sparks(self, context_id, search_term, limit=50):
+        return self._run(helpers.search_sparks, context_id, search_term, limit)
+
+    def get_collections(self):
+        """(collection, spark_count) pairs, by name."""
+        return self._run(helpers.get_collection_spark_counts)
+
+    def add_to_collection(self, spark_ids, collection):
+        """File the sparks under `collection` (created if missing); returns how many were added."""
+        return self._run(_add_to_collection, list(spark_ids), collection)
+
+class UnitOfWork(_Operations):
+    """SparkStore operations on one session inside an outer transaction."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def _run(self, fn, *args, **kwargs):
+        return fn(self.session, *args, **kwargs)
+
+class SparkStore(_Operations):
+    def __init__(self, url=None, pragmas=None, **engine_options):
+        from sqlalchemy.orm import sessionmaker
+        self.engine = storage.create_engine(url, pragmas=pragmas, **engine_options)
+        # Results outlive their session, so keep them loaded after commit
+        self._sessionmaker = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    @contextmanager
+    def session(self):
+        session = self._sessionmaker()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def _run(self, fn, *args, **kwargs):
+        with self.session() as session:
+            return fn(session, *args, **kwargs)
+
+    @contextmanager
+    def unit_of_work(self):
+        """Yield a UnitOfWork whose operations commit together when the block exits."""
+        from sqlalchemy.orm import Session
+        with self.engine.connect() as connection:
+            transaction = connection.begin()
+            # rollback_only: the helpers' commits stay inside the transaction,
+            # their rollbacks (on error) still end it
+            session = Session(bind=connection, join_transaction_mode="rollback_only", expire_on_commit=False)
+            session.info[helpers.OUTER_TRANSACTION] = True
+            try:
+                yield UnitOfWork(session)
+                session.flush()
+                transaction.commit()
+                helpers.identity_cache.publish(session)
+            except Exception as e:
+                # A failing helper may already have rolled it back
+                if transaction.is_active:
+                    transaction.rollback()
+                # Rows cached inside the transaction are gone with it
+                session.info.pop(helpers.STAGED, None)
+                helpers.identity_cache.clear()
+                raise e
+            finally:
+                session.close()
+
+    def close(self):
+        self.engine.dispose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class AsyncUnitOfWork(_Operations):
+    """AsyncSparkStore operations on one session inside an outer transaction."""
+
+    def __init__(self, session):
+        self.session = session
+
+    async def _run(self, fn, *args, **kwargs):
+        return await self.session.run_sync(fn, *args, **kwargs)
+
+class AsyncSparkStore(_Operations):
+    def __init__(self, url=None, pragmas=None, **engine_options):
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        self.engine = storage.create_async_engine(url, pragmas=pragmas, **engine_options)
+        self._sessionmaker = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def session(self):
+        async with self._sessionmaker() as session:
+            yield session
+
+    async def _run(self, fn, *args, **kwargs):
+        async with self._sessionmaker() as session:
+            return await session.run_sync(fn, *args, **kwargs)
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Yield an AsyncUnitOfWork whose operations commit together when the block exits."""
+        from sqlalchemy.ext.asyncio import AsyncSession
+        async with self.engine.connect() as connection:
+            transaction = await connection.begin()
+            session = AsyncSession(bind=connection, join_transaction_mode="rollback_only", expire_on_commit=False)
+            session.sync_session.info[helpers.OUTER_TRANSACTION] = True
+            try:
+                yield AsyncUnitOfWork(session)
+                await session.flush()
+                await transaction.commit()
+                helpers.identity_cache.publish(session.sync_session)
+            except Exception as e:
+                if transaction.is_active:
+                    await transaction.rollback()
+                session.sync_session.info.pop(helpers.STAGED, None)
+                helpers.identity_cache.clear()
+                raise e
+            finally:
+                await session.close()
+
+    async def aclose(self):
+        await self.engine.dispose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,141 @@
+# context_cache.py
+# On-disk cache of cwd -> (nearest .spark, its parsed config, context ids).
+# Entries are validated against the .spark file's mtime and inode, so editing
+# or replacing the file invalidates them. Context ids are stored per database
+# since the same project can point at different stores; a miss falls back to
+# the database.
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from db.instrument import span
+
+CACHE_VERSION = 2
+MAX_ENTRIES = 512
+
+def cache_path():
+    cache_dir = os.environ.get("SPARK_CACHE_DIR")
+    if not cache_dir:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(base, "spark")
+    return os.path.join(cache_dir, "contexts.json")
+
+@lru_cache(maxsize=128)
+def find_dot_spark(start):
+    """Return the nearest .spark at or above `start` (like git's repo discovery), or None."""
+    directory = Path(start)
+    for candidate in (directory, *directory.parents):
+        dot_spark = candidate / ".spark"
+        if dot_spark.is_file():
+            return dot_spark
+    return None
+
+_entries = None
+_loaded_mtime_ns = None
+
+def _load():
+    global _entries, _loaded_mtime_ns
+    if _entries is None:
+        try:
+            with span("load context cache", "config"), open(cache_path(), "r") as cache_file:
+                _loaded_mtime_ns = os.fstat(cache_file.fileno()).st_mtime_ns
+                data = json.load(cache_file)
+            _entries = data["entries"] if data.get("version") == CACHE_VERSION else {}
+        except (OSError, ValueError, KeyError):
+            _entries = {}
+    return _entries
+
+def refresh():
+    """Reload if another process rewrote the cache file (for long-lived processes like the daemon)."""
+    global _entries
+    try:
+        mtime_ns = os.stat(cache_path()).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    if mtime_ns != _loaded_mtime_ns:
+        _entries = None
+        find_dot_spark.cache_clear()
+
+def _save():
+    global _loaded_mtime_ns
+    import tempfile
+    path = cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so concurrent commands never read a torn file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".contexts-")
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump({"version": CACHE_VERSION, "entries": _entries}, cache_file)
+        os.replace(tmp_path, path)
+        _loaded_mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        # The cache is an optimization; a read-only home must not break commands
+        pass
+
+def _fingerprint(dot_spark):
+    stat = dot_spark.stat()
+    return stat.st_mtime_ns, stat.st_ino
+
+def _valid_entry(cwd):
+    entry = _load().get(cwd)
+    if not entry:
+        return None
+    try:
+        mtime_ns, inode = _fingerprint(Path(entry["dot_spark"]))
+    except OSError:
+        return None
+    if (mtime_ns, inode) != (entry["mtime_ns"], entry["inode"]):
+        return None
+    return entry
+
+def load_config(cwd):
+    """Return (dot_spark_path, config) for `cwd`, parsing the YAML only on a miss.
+
+    Returns (None, None) when no .spark exists at or above `cwd`.
+    """
+    entry = _valid_entry(cwd)
+    if entry is None:
+        dot_spark = find_dot_spark(cwd)
+        if dot_spark is None:
+            return None, None
+        with span("parse .spark", "config", path=str(dot_spark)):
+            import yaml
+            with open(dot_spark, "r") as spark_file:
+                config = yaml.safe_load(spark_file)
+        mtime_ns, inode = _fingerprint(dot_spark)
+        entry = {
+            "dot_spark": str(dot_spark),
+            "mtime_ns": mtime_ns,
+            "inode": inode,
+            "config": config,
+            "context_ids": {},
+        }
+        _put(cwd, entry)
+    return Path(entry["dot_spark"]), entry["config"]
+
+def get_context_id(cwd, database):
+    entry = _valid_entry(cwd)
+    return entry["context_ids"].get(database) if entry else None
+
+def set_context_id(cwd, database, context_id):
+    entry = _valid_entry(cwd)
+    if entry is not None:
+        entry["context_ids"][database] = context_id
+        _save()
+
+def _put(cwd, entry):
+    entries = _load()
+    entries.pop(cwd, None)
+    entries[cwd] = entry
+    # dicts keep insertion order, so the first keys are the least recently stored
+    while len(entries) > MAX_ENTRIES:
+        entries.pop(next(iter(entries)))
+    _save()
+
+def invalidate():
+    """Forget every cached entry, e.g. after `spark init` creates a new .spark."""
+    global _entries
+    _entries = {}
+    find_dot_spark.cache_clear()
+    _save()
@@ -1,8 +1,8 @@
 # utils.py
-import yaml
-from pathlib import Path
+# yaml is imported inside the functions that need it to keep CLI startup fast
 import os
-from datetime import datetime
+from . import context_cache
+from db.instrument import span
 
 def create_dot_spark(project_name, default_collection):
     dot_context = {
@@ -10,37 +10,126 @@ def create_dot_spark(project_name, default_collection):
         "default_collection": default_collection
     }
 
+    import yaml
     with open(".spark", "w") as spark_file:
         yaml.dump(dot_context, spark_file)
+    # A new .spark can shadow one further up the tree for cached directories
+    context_cache.invalidate()
 
 def read_dot_spark():
-    if not Path(".spark").exists():
+    dot_config = load_dot_spark()[1]
+    if dot_config is None:
         raise FileNotFoundError("No .spark file found. Run 'spark init' first.")
-    
-    with open(".spark", "r") as spark_file:
-        return yaml.safe_load(spark_file)
+    return dot_config
+
+def load_dot_spark(cwd=None):
+    """Return (path, config) of the nearest .spark, or (None, None) if there is none."""
+    return context_cache.load_config(cwd or os.getcwd())
+
+def sqlite_database_key(path):
+    # The inode changes when the file is deleted and recreated, which drops
+    # cached context ids that would otherwise point at missing rows
+    path = os.path.abspath(path)
+    try:
+        return f"{path}@{os.stat(path).st_ino}"
+    except OSError:
+        return path
+
+def resolve_current_context(database, get_or_create, cwd=None):
+    """Return (context_id, dot_config) for `cwd` (default: the current directory).
+
+    Served from the on-disk context cache when the nearest .spark is
+    unchanged; otherwise `get_or_create(working_dir, project_name)` looks the
+    context up (or inserts it) in the database.
+    """
+    cwd = cwd or os.getcwd()
+    dot_spark, dot_config = context_cache.load_config(cwd)
+    if dot_spark is None:
+        raise FileNotFoundError("No .spark file found. Run 'spark init' first.")
+
+    context_id = context_cache.get_context_id(cwd, database)
+    if context_id is None:
+        with span("resolve context", "config"):
+            context_id = get_or_create(str(dot_spark.parent), dot_config["project_name"])
+            context_cache.set_context_id(cwd, database, context_id)
+    return context_id, dot_config
 
 def get_current_context_id(session):
-    dot_config = read_dot_spark()
-    working_dir = os.getcwd()
-    
-    from helpers import get_context_by_working_dir
-    context = get_context_by_working_dir(session, working_dir)
-    
-    if not context:
-        from helpers import create_context
-        context = create_context(session, working_dir, dot_config["project_name"])
-    
-    return context.id
-
-def format_timestamp(timestamp):
+    from helpers import get_context_by_working_dir, create_context
+
+    def get_or_create(working_dir, project_name):
+        context = get_context_by_working_dir(session, working_dir)
+        if not context:
+            context = create_context(session, working_dir, project_name)
+        return context.id
+
+    url = session.get_bind().url
+    if url.get_backend_name() == "sqlite":
+        database = sqlite_database_key(url.database)
+    else:
+        database = url.render_as_string(hide_password=True)
+    return resolve_current_context(database, get_or_create)[0]
+
+def get_current_context_lite(conn, database_path, cwd=None):
+    """Resolve (context_id, dot_config) through the sqlite3 fast path (db.lite)."""
+    from db.lite import get_or_create_context_id
+
+    def get_or_create(working_dir, project_name):
+        return get_or_create_context_id(conn, working_dir, project_name)
+
+    return resolve_current_context(sqlite_database_key(database_path), get_or_create, cwd)
+
+def read_spark_records(stream):
+    """Yield (content, collection) pairs from newline-delimited text or JSONL.
+
+    Lines starting with '{' are parsed as JSON objects with a "content" key
+    and an optional "collection"; any other non-blank line is one spark.
+    """
+    import json
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+            content = record.get("content")
+            if not content:
+                raise ValueError(f"Line {line_number}: JSON record has no 'content'")
+            yield content, record.get("collection")
+        else:
+            yield line, None
+
+def format_timestamp(timestamp, tz=None):
+    """A stored (UTC) timestamp in `tz`, else the local timezone (see db.query.local_timezone)."""
     if not timestamp:
         return "N/A"
-    return timestamp.strftime("%Y-%m-%d %H:%M")
+    from db.query import local_timezone, to_local
+    return to_local(timestamp, tz or local_timezone()).strftime("%Y-%m-%d %H:%M")
+
+def parse_spark_ids(tokens):
+    """Split selectors like "5", "3,7,9" and "10-200" into (ids, inclusive ranges)."""
+    ids, ranges = [], []
+    for token in tokens:
+        for part in filter(None, token.split(",")):
+            low, dash, high = part.partition("-")
+            if not (low.isdigit() and (not dash or high.isdigit())):
+                raise ValueError(f"Invalid spark ID or range: '{part}'")
+            if dash:
+                low, high = sorted((int(low), int(high)))
+                ranges.append((low, high))
+            else:
+                ids.append(int(low))
+    return ids, ranges
 
-def validate_spark_id(session, spark_id):
-    from helpers import get_spark_by_id
-    spark = get_spark_by_id(session, spark_id)
+def validate_spark_id(session, spark_id, with_collections=False):
+    from helpers import get_spark_by_id, get_spark_with_collections
+    if with_collections:
+        spark = get_spark_with_collections(session, spark_id)
+    else:
+        spark = get_spark_by_id(session, spark_id)
     if not spark:
         raise ValueError(f"Spark with ID {spark_id} not found")
     return spark
\ No newline at end of file